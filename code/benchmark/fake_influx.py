@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# code/benchmark/fake_influx.py
+# In-process stand-in for the Home Assistant InfluxDB 1.8 HTTP API.
+#
+# Serves /ping and /query from in-memory arrays, for exactly the InfluxQL the
+# pipeline sends:
+#   SHOW DATABASES / SHOW RETENTION POLICIES ON <db>
+#   SELECT time, value FROM "W" WHERE entity_id =~ /re/ | entity_id = 'x'
+#          AND time >= '…' | time > '…' | time >= now() - 72h  AND time < '…'  [GROUP BY entity_id]
+#   SELECT entity_id, last(value) AS value … GROUP BY entity_id            (check_fuse_data.py)
+#   SELECT mean("value") … GROUP BY time(1m), entity_id fill(none)         (nilm_online.py)
+#   SELECT count(value) … GROUP BY time(1m), entity_id fill(none)          (check_fuse_data.py, EXPORT_PLAN=gaps)
+#   SELECT mean|min|max|last|count(value) [AS x], … GROUP BY time(1m)[, entity_id] fill(none)
+#                                                                          (export_fuse_data.py, minutely)
+# Several statements separated by ';' give one result per statement, and
+# epoch=ns|u|ms|s|m|h is honoured; anything else answers HTTP 400.
+#
+#   with FakeInflux({"ams_linje6_p": (ts_ns, values), ...}, database="homeassistantdb") as influx:
+#       influx.url   → http://127.0.0.1:<port>
+#       influx.stats → {"queries": ..., "points": ...}
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+EPOCH_NS = {"ns": 1, "u": 1_000, "ms": 1_000_000, "s": 1_000_000_000, "m": 60_000_000_000, "h": 3_600_000_000_000}
+UNIT_NS = {"s": EPOCH_NS["s"], "m": EPOCH_NS["m"], "h": EPOCH_NS["h"], "d": 24 * EPOCH_NS["h"], "w": 7 * 24 * EPOCH_NS["h"]}
+
+SELECT = re.compile(r"^\s*SELECT\s+(?P<fields>.+?)\s+FROM\s+(?P<source>\S+)"
+                    r"(?:\s+WHERE\s+(?P<where>.+?))?(?:\s+GROUP\s+BY\s+(?P<group>.+?))?\s*$", re.I | re.S)
+ENTITY_REGEX = re.compile(r"entity_id\s*=~\s*/(.*?)/(?=\s|$)", re.S)
+ENTITY_EQUALS = re.compile(r"entity_id\s*=\s*'([^']*)'")
+TIME_LITERAL = re.compile(r"time\s*(>=|>|<=|<)\s*'([^']+)'")
+TIME_NOW = re.compile(r"time\s*(>=|>|<=|<)\s*now\(\)\s*-\s*(\d+)([smhdw])")
+GROUP_TIME = re.compile(r"time\((\d+)([smhdw])\)")
+AGGREGATE = re.compile(r'(mean|min|max|last|count)\("?value"?\)(?:\s+AS\s+"?(\w+)"?)?', re.I)
+
+
+class QueryError(Exception):
+    pass
+
+
+class FakeInflux:
+    def __init__(self, series, database="homeassistantdb", measurement="W", host="127.0.0.1", port=0):
+        """series: {entity_id: (int64 epoch-ns timestamps, sorted; float64 values)}."""
+        self.series = series
+        self.database = database
+        self.measurement = measurement
+        self.stats = {"queries": 0, "points": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-influx", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # === Query evaluation ===
+    def _entities(self, where):
+        match = ENTITY_REGEX.search(where)
+        if match:
+            pattern = re.compile(match.group(1))
+            return [e for e in self.series if pattern.search(e)]
+        match = ENTITY_EQUALS.search(where)
+        if match:
+            return [match.group(1)] if match.group(1) in self.series else []
+        return list(self.series)
+
+    @staticmethod
+    def _time_range(where):
+        """[lower, upper) in epoch ns from the time conditions of a WHERE clause."""
+        lower, upper = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+        bounds = [(op, pd.Timestamp(value).value) for op, value in TIME_LITERAL.findall(where)]
+        bounds += [(op, time.time_ns() - int(n) * UNIT_NS[unit]) for op, n, unit in TIME_NOW.findall(where)]
+        for op, ns in bounds:
+            if op == ">=":
+                lower = max(lower, ns)
+            elif op == ">":
+                lower = max(lower, ns + 1)
+            elif op == "<":
+                upper = min(upper, ns)
+            else:
+                upper = min(upper, ns + 1)
+        return lower, upper
+
+    def _select(self, match, epoch):
+        fields, group = match.group("fields"), match.group("group") or ""
+        measurement = match.group("source").split(".")[-1].strip('"')
+        where = match.group("where") or ""
+        lower, upper = self._time_range(where)
+        scale = EPOCH_NS.get(epoch)
+
+        def times(ns):
+            if scale:
+                return (ns // scale).tolist()
+            return [f"{t.isoformat()}Z" for t in pd.to_datetime(ns)]
+
+        by_entity = "entity_id" in group
+        bucket = GROUP_TIME.search(group)
+        series, points = [], 0
+        for entity in (self._entities(where) if measurement == self.measurement else []):
+            ts, values = self.series[entity]
+            lo, hi = np.searchsorted(ts, lower), np.searchsorted(ts, upper)
+            ts, values = ts[lo:hi], values[lo:hi]
+            if not len(ts):
+                continue
+
+            aggregates = AGGREGATE.findall(fields)
+            if aggregates and bucket:
+                width = int(bucket.group(1)) * UNIT_NS[bucket.group(2)]
+                starts, first = np.unique(ts // width * width, return_index=True)
+                counts = np.diff(np.append(first, len(ts)))
+                per_bucket = {
+                    "mean": lambda: np.add.reduceat(values, first) / counts,
+                    "min": lambda: np.minimum.reduceat(values, first),
+                    "max": lambda: np.maximum.reduceat(values, first),
+                    "last": lambda: values[first + counts - 1],
+                    "count": lambda: counts,
+                }
+                columns = ["time"] + [alias or func.lower() for func, alias in aggregates]
+                results = [per_bucket[func.lower()]().tolist() for func, _ in aggregates]
+                rows = [list(r) for r in zip(times(starts), *results)]
+            elif "last(" in fields:
+                columns, rows = ["time", "entity_id", "value"], [[times(ts[-1:])[0], entity, float(values[-1])]]
+            elif aggregates:
+                raise QueryError("aggregates other than last() are only supported with GROUP BY time(...)")
+            elif fields.replace(" ", "") == "time,value":
+                columns, rows = ["time", "value"], [list(r) for r in zip(times(ts), values.tolist())]
+            else:
+                raise QueryError(f"unsupported field list: {fields}")
+
+            points += len(rows)
+            if by_entity:
+                series.append({"name": measurement, "tags": {"entity_id": entity}, "columns": columns, "values": rows})
+            elif series:
+                series[0]["values"].extend(rows)
+            else:
+                series.append({"name": measurement, "columns": columns, "values": rows})
+
+        if series and not by_entity and len(series[0]["values"]) > 1:
+            series[0]["values"].sort(key=lambda row: row[0])
+        return series, points
+
+    def query(self, q, db=None, epoch=None):
+        """InfluxQL → the JSON body InfluxDB 1.8 would answer with."""
+        results, points = [], 0
+        for i, statement in enumerate(s for s in q.split(";") if s.strip()):
+            statement = " ".join(statement.split())
+            upper = statement.upper()
+            if upper == "SHOW DATABASES":
+                series = [{"name": "databases", "columns": ["name"], "values": [[self.database]]}]
+            elif upper.startswith("SHOW RETENTION POLICIES"):
+                series = [{"name": "", "columns": ["name", "duration", "shardGroupDuration", "replicaN", "default"],
+                           "values": [["autogen", "0s", "168h0m0s", 1, True]]}]
+            elif SELECT.match(statement):
+                if db and db != self.database:
+                    raise QueryError(f"database not found: {db}")
+                series, n = self._select(SELECT.match(statement), epoch)
+                points += n
+            else:
+                raise QueryError(f"unsupported statement: {statement}")
+            results.append({"statement_id": i, **({"series": series} if series else {})})
+        with self._lock:
+            self.stats["queries"] += 1
+            self.stats["points"] += points
+        return {"results": results}
+
+    # === HTTP ===
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _params(self):
+                params = parse_qs(urlparse(self.path).query)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    params.update(parse_qs(self.rfile.read(length).decode()))
+                return {k: v[0] for k, v in params.items()}
+
+            def _reply(self, status, body=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Influxdb-Version", "1.8.10")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self):
+                path = urlparse(self.path).path
+                if path == "/ping":
+                    return self._reply(204)
+                if path != "/query":
+                    return self._reply(404, {"error": f"unknown path {path}"})
+                params = self._params()
+                try:
+                    body = fake.query(params.get("q", ""), params.get("db"), params.get("epoch"))
+                except (QueryError, ValueError) as e:
+                    return self._reply(400, {"error": str(e)})
+                self._reply(200, body)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def series_from_chunks(chunks):
+    """generate() chunks → {entity_id: (epoch-ns int64, float64)} for FakeInflux."""
+    parts = {}
+    for index, columns in chunks:
+        ts = index.as_unit("ns").asi8
+        for entity, values in columns.items():
+            parts.setdefault(entity, []).append((ts, values))
+    return {e: (np.concatenate([p[0] for p in v]), np.concatenate([p[1] for p in v])) for e, v in parts.items()}
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# code/benchmark/synthetic_data.py
+# Synthetic minutely power for the 18 fuses of the house, at any scale.
+#
+# Every fuse gets a profile built from a few vectorized blocks:
+#   • on/off cycles with random run lengths (heat pump, water heater, freezer, EV charger...)
+#   • hour-of-day activity gates (cooking, lights, evening charging)
+#   • a solar curve following day length and season, scaled by daily cloud cover
+#   • heating demand from a seasonal outdoor temperature
+# The two AMS meter channels are derived from the rest: import = loads − solar, export = solar − loads.
+#
+# House 1 uses the real fuse ids; houses 2..N get a _h<n> suffix, so the archive
+# and the fuse matrix simply grow by 18 columns per house.
+#
+#   for index, columns in generate(start, end, houses=2, seed=42):   # one chunk of CHUNK_DAYS
+#       columns["ams_linje6_p"]  → float64 W per minute of `index`
+#
+# Chunks are generated from their own seed (seed, house, chunk), so the same
+# arguments always give the same data and chunks do not depend on each other.
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from fuse_config import DEFAULT_FUSE_IDS as FUSE_IDS  # the profiles below are those of the pilot house
+
+CHUNK_DAYS = 7
+
+
+def _hours(*ranges, base=0.05):
+    """Probability per hour of day: `base`, raised to p inside each (from, to, p)."""
+    p = np.full(24, base)
+    for start, end, value in ranges:
+        p[start:end] = value
+    return p
+
+
+NIGHT = _hours((0, 6, 0.02), base=0.3)
+MEALS = _hours((6, 9, 0.6), (15, 20, 0.8), base=0.05)
+EVENING = _hours((6, 8, 0.7), (16, 23, 0.9), base=0.05)
+CHARGING = _hours((0, 6, 0.5), (17, 24, 0.7), base=0.02)
+HOT_WATER = _hours((5, 9, 0.9), (17, 22, 0.7), base=0.2)
+DISHWASHER = _hours((19, 23, 0.6), base=0.0)
+
+
+def fuse_ids(house):
+    return FUSE_IDS if house == 1 else [f"{fuse}_h{house}" for fuse in FUSE_IDS]
+
+
+def _cycles(rng, n, mean_on, mean_off, levels):
+    """On/off process with geometric run lengths; each on-run draws its power from `levels` (low, high)."""
+    runs = max(16, int(2.5 * n / (mean_on + mean_off)))
+    while True:
+        lengths = np.empty(2 * runs, dtype=np.int64)
+        lengths[0::2] = rng.geometric(1 / mean_off, runs)
+        lengths[1::2] = rng.geometric(1 / mean_on, runs)
+        if lengths.sum() >= n:
+            break
+        runs *= 2
+    lengths[0] = rng.integers(0, lengths[0] + 1)  # random phase at the chunk start
+    power = np.zeros(2 * runs)
+    power[1::2] = rng.uniform(*levels, runs)
+    return np.repeat(power, lengths)[:n]
+
+
+def _gate(rng, hour, by_hour):
+    """Active minutes: one draw per clock hour against the probability of that hour of day."""
+    block = np.arange(len(hour)) // 60
+    return rng.random(block[-1] + 1)[block] < by_hour[hour]
+
+
+def _smooth(rng, n, scale, minutes=30):
+    """Slowly varying multiplicative noise around 1."""
+    steps = n // minutes + 2
+    knots = 1 + rng.normal(0, scale, steps)
+    return np.interp(np.arange(n) / minutes, np.arange(steps), knots)
+
+
+def _weather(index, rng):
+    """(outdoor temperature °C, cloud factor 0..1) per minute."""
+    doy = index.dayofyear.to_numpy()
+    hour = index.hour.to_numpy() + index.minute.to_numpy() / 60
+    days = (index.normalize() - index[0].normalize()).days.to_numpy()
+    daily = rng.normal(0, 3, days[-1] + 1)[days]
+    temperature = 5 - 10 * np.cos(2 * np.pi * (doy - 20) / 365) + 4 * np.sin(2 * np.pi * (hour - 9) / 24) + daily
+    clouds = rng.uniform(0.15, 1.0, days[-1] + 1)[days]
+    return temperature, clouds * np.clip(_smooth(rng, len(index), 0.25), 0.1, 1.2)
+
+
+def _solar(index, clouds, peak=4500):
+    """PV output at ~60°N (UTC): day length 6–19 h, solar noon ≈ 11:45 UTC."""
+    doy = index.dayofyear.to_numpy()
+    hour = index.hour.to_numpy() + index.minute.to_numpy() / 60
+    season = np.sin(2 * np.pi * (doy - 80) / 365)
+    day_length = 12.5 + 6.5 * season
+    elevation = np.sin(np.pi * (hour - (11.75 - day_length / 2)) / day_length)
+    return peak * (0.55 + 0.45 * season) * np.clip(elevation, 0, None) ** 1.5 * clouds
+
+
+def house_chunk(index, rng):
+    """{fuse: W per minute} for one house over `index` (house-1 fuse ids)."""
+    n = len(index)
+    hour = index.hour.to_numpy()
+    temperature, clouds = _weather(index, rng)
+    demand = np.clip((14 - temperature) / 25, 0, 1)  # space heating, 0 in summer
+    noise = lambda level: np.abs(rng.normal(0, level, n))
+
+    loads = {
+        "11_varmepumpe32a_apparent_power": _cycles(rng, n, 40, 20, (600, 900)) * (0.3 + 2.2 * demand) + 35,
+        "12_vvbereder3kw16a_apparent_power": _cycles(rng, n, 25, 90, (2800, 3000)) * _gate(rng, hour, HOT_WATER),
+        "04_fyrkjelevarmepump_active_power": _cycles(rng, n, 20, 60, (900, 1300)) * (demand > 0.3) + 15,
+        "03a_kjokken_3p_230vl_active_power": _cycles(rng, n, 12, 25, (800, 3600)) * _gate(rng, hour, MEALS) + 5,
+        "u05_billader16a_active_power": _cycles(rng, n, 150, 600, (3600, 7400)) * _gate(rng, hour, CHARGING),
+        "05_kjokkenlys15a_active_power": _cycles(rng, n, 60, 15, (40, 120)) * _gate(rng, hour, EVENING),
+        "06_kjeller15a_active_power": _cycles(rng, n, 15, 35, (90, 130)) + 20 + noise(3),
+        "07_lysstikk1floor16a_active_power": _cycles(rng, n, 20, 90, (100, 1500)) * _gate(rng, hour, NIGHT) + 45,
+        "08_lysstikk2ndfloor1_active_power": _cycles(rng, n, 30, 60, (60, 400)) * _gate(rng, hour, EVENING) + 30,
+        "09_internet16a_active_power": 28 + noise(1.5),
+        "10badgammel13a_active_power": _cycles(rng, n, 30, 45, (800, 1100)) * (demand > 0.15),
+        "u7_kitchen20a_active_power": (_cycles(rng, n, 15, 25, (100, 150))
+                                       + _cycles(rng, n, 90, 600, (1800, 2100)) * _gate(rng, hour, DISHWASHER)),
+        "u8_kitchenlight16a_active_power": _cycles(rng, n, 45, 20, (20, 60)) * _gate(rng, hour, EVENING),
+        "u9_lysstikk16a_active_power": _cycles(rng, n, 25, 120, (50, 900)) * _gate(rng, hour, NIGHT) + 15,
+        "u10_bad2nd16a_active_power": _cycles(rng, n, 35, 40, (600, 1000)) * (demand > 0.2)
+                                      + _cycles(rng, n, 8, 500, (1200, 2000)) * _gate(rng, hour, HOT_WATER),
+    }
+    solar = _solar(index, clouds)
+    total = sum(loads.values()) * (1 + rng.normal(0, 0.01, n))
+    net = total - solar
+
+    columns = {
+        "03_solarinput63a_active_power": solar,
+        "ams_linje6_po": np.clip(-net, 0, None),
+        "ams_linje6_p": np.clip(net, 0, None),
+        **loads,
+    }
+    return {fuse: np.round(columns[fuse], 1) for fuse in FUSE_IDS}
+
+
+def generate(start, end, houses=1, seed=42, chunk_days=CHUNK_DAYS):
+    """Yield (DatetimeIndex, {entity_id: float64 W}) for [start, end) in chunks of `chunk_days`."""
+    start, end = pd.Timestamp(start).floor("min"), pd.Timestamp(end).floor("min")
+    chunk_start, chunk_no = start, 0
+    while chunk_start < end:
+        chunk_end = min(chunk_start + pd.Timedelta(days=chunk_days), end)
+        index = pd.date_range(chunk_start, chunk_end, freq="min", inclusive="left")
+        columns = {}
+        for house in range(1, houses + 1):
+            rng = np.random.default_rng([seed, house, chunk_no])
+            values = house_chunk(index, rng)
+            columns.update(zip(fuse_ids(house), values.values()))
+        yield index, columns
+        chunk_start, chunk_no = chunk_end, chunk_no + 1
+
+
+def to_long(index, columns):
+    """One chunk → long (timestamp, entity_id, value_w) rows, as stored in MariaDB."""
+    return pd.DataFrame({
+        "timestamp": np.tile(index.values, len(columns)),
+        "entity_id": np.repeat(list(columns), len(index)),
+        "value_w": np.concatenate(list(columns.values())),
+    })
+
+
+def main():
+    end = pd.Timestamp.now().floor("min")
+    t0 = pd.Timestamp.now()
+    points = 0
+    for index, columns in generate(end - pd.Timedelta(days=7), end):
+        points += len(index) * len(columns)
+        df = pd.DataFrame(columns, index=index)
+    print(f"Generated {points:,} points in {(pd.Timestamp.now() - t0).total_seconds():.2f}s")
+    print(df.describe().T[["mean", "max"]].round(0).to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+# code/bulk_loader.py
+# Idempotent bulk-load paths for MariaDB archive tables.
+#
+# Modes:
+#   to_sql        – pandas DataFrame.to_sql(method='multi'), fails on duplicate keys (legacy)
+#   insert_ignore – cursor.executemany("INSERT IGNORE ..."), duplicates are skipped
+#   upsert        – cursor.executemany("INSERT ... ON DUPLICATE KEY UPDATE ..."), duplicates are overwritten
+#   load_data     – "LOAD DATA LOCAL INFILE ... IGNORE" from a TSV buffer, duplicates are skipped
+#
+# All functions take a SQLAlchemy Connection so the caller decides the transaction
+# boundaries (one batch = one transaction in export_fuse_data.py).
+
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+INSERT_MODES = ("to_sql", "insert_ignore", "upsert", "load_data")
+
+
+def iter_batches(df, batch_size):
+    for start in range(0, len(df), batch_size):
+        yield start, df.iloc[start:start + batch_size]
+
+
+def _column_arrays(df):
+    """DataFrame → list of plain NumPy columns the MySQL driver can send as-is.
+
+    Datetimes are written as naive UTC 'YYYY-MM-DD HH:MM:SS.ffffff' strings.
+    """
+    arrays = []
+    for name in df.columns:
+        col = df[name]
+        if isinstance(col.dtype, pd.DatetimeTZDtype):
+            col = col.dt.tz_convert(None)
+        if pd.api.types.is_datetime64_any_dtype(col.dtype):
+            values = np.datetime_as_string(col.to_numpy(dtype="datetime64[us]"), unit="us")
+            arrays.append(np.char.replace(values, "T", " ").astype(object))
+        elif isinstance(col.dtype, pd.CategoricalDtype):
+            arrays.append(col.astype(str).to_numpy(dtype=object))
+        else:
+            arrays.append(col.to_numpy(dtype=object))
+    return arrays
+
+
+def _insert_sql(table, columns, mode, update_columns):
+    cols = ", ".join(f"`{c}`" for c in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    if mode == "insert_ignore":
+        return f"INSERT IGNORE INTO {table} ({cols}) VALUES ({placeholders})"
+    updates = ", ".join(f"`{c}` = VALUES(`{c}`)" for c in update_columns)
+    return f"INSERT INTO {table} ({cols}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates}"
+
+
+def _executemany(conn, table, batch, mode, update_columns):
+    rows = list(zip(*_column_arrays(batch)))
+    cursor = conn.connection.cursor()
+    try:
+        cursor.executemany(_insert_sql(table, list(batch.columns), mode, update_columns), rows)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def _load_data(conn, table, batch):
+    # PyMySQL streams LOCAL INFILE from a path, so the in-memory TSV is spooled
+    # to a temporary file just for the duration of the statement.
+    buf = io.StringIO()
+    pd.DataFrame(dict(zip(batch.columns, _column_arrays(batch)))).to_csv(
+        buf, sep="\t", header=False, index=False, lineterminator="\n"
+    )
+    fd, path = tempfile.mkstemp(prefix="bulk_load_", suffix=".tsv")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(buf.getvalue())
+        cols = ", ".join(f"`{c}`" for c in batch.columns)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {table} "
+                f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({cols})",
+                (path,)
+            )
+            return cursor.rowcount
+        finally:
+            cursor.close()
+    finally:
+        os.unlink(path)
+
+
+def load_batch(conn, table, batch, mode="insert_ignore", update_columns=()):
+    """Write one batch; returns (rows affected, seconds).
+
+    For insert_ignore/load_data "affected" is the number of new rows; for upsert
+    MariaDB counts 1 per inserted and 2 per updated row.
+    """
+    if mode not in INSERT_MODES:
+        raise ValueError(f"Unknown insert mode '{mode}', expected one of {INSERT_MODES}")
+    if mode == "upsert" and not update_columns:
+        raise ValueError("upsert mode needs update_columns")
+
+    t0 = time.perf_counter()
+    if mode == "to_sql":
+        batch.to_sql(name=table, con=conn, if_exists="append", index=False, method="multi", chunksize=1000)
+        affected = len(batch)
+    elif mode == "load_data":
+        affected = _load_data(conn, table, batch)
+    else:
+        affected = _executemany(conn, table, batch, mode, update_columns)
+    return affected, time.perf_counter() - t0
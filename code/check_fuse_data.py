@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 # check_fuse_data.py
 import os
+import re
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -30,27 +31,21 @@ INFLUX_DB = INFLUX_BUCKET.split("/")[0]  # homeassistantdb
 # Configurable check window
 CHECK_HOURS = int(os.getenv("CHECK_HOURS", "72"))
 
+# gaps: scan per-minute coverage against MariaDB and write data/gap_map.json for export_fuse_data.py
+EXPORT_PLAN = os.getenv("EXPORT_PLAN", "window")
+TABLE_NAME = os.getenv("TABLE_NAME", "energy_fuse_archive")
+# The table export_fuse_data.py fills: raw samples, or per minute with their sample count
+if os.getenv("EXPORT_RESOLUTION", "raw") == "minutely":
+    ARCHIVE_TABLE, ARCHIVE_POINTS = os.getenv("MINUTELY_TABLE", f"{TABLE_NAME}_minutely"), "SUM(samples)"
+elif os.getenv("ARCHIVE_SCHEMA", "v1") == "v2":
+    sys.path.insert(0, str(Path(__file__).parent / "machine_learning"))
+    from archive_schema import v2_tables
+    ARCHIVE_TABLE, ARCHIVE_POINTS = v2_tables(TABLE_NAME)["view"], "COUNT(*)"
+else:
+    ARCHIVE_TABLE, ARCHIVE_POINTS = TABLE_NAME, "COUNT(*)"
+
 # === Fuse list ===
-FUSE_IDS = [
-    "03_solarinput63a_active_power",
-    "ams_linje6_po",
-    "ams_linje6_p",
-    "11_varmepumpe32a_apparent_power",
-    "12_vvbereder3kw16a_apparent_power",
-    "04_fyrkjelevarmepump_active_power",
-    "03a_kjokken_3p_230vl_active_power",
-    "u05_billader16a_active_power",
-    "05_kjokkenlys15a_active_power",
-    "06_kjeller15a_active_power",
-    "07_lysstikk1floor16a_active_power",
-    "08_lysstikk2ndfloor1_active_power",
-    "09_internet16a_active_power",
-    "10badgammel13a_active_power",
-    "u7_kitchen20a_active_power",
-    "u8_kitchenlight16a_active_power",
-    "u9_lysstikk16a_active_power",
-    "u10_bad2nd16a_active_power"
-]
+from fuse_config import FUSE_IDS
 
 print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Checking fuse data (last {CHECK_HOURS}h)...")
 print(f"Loaded config from: {env_path}")
@@ -73,8 +68,21 @@ except Exception as e:
     sys.exit(1)
 
 # === Query ===
-entity_regex = "|".join(FUSE_IDS)
-query = f'''
+if EXPORT_PLAN == "gaps":
+    # Coverage scan: points per minute and fuse, counted server-side (one row per covered minute)
+    scan_end = datetime.utcnow().replace(second=0, microsecond=0)  # the current minute is still open
+    scan_start = scan_end - timedelta(hours=CHECK_HOURS)
+    entity_regex = "^(" + "|".join(re.escape(f) for f in FUSE_IDS) + ")$"
+    query = f'''
+SELECT count(value) AS value
+FROM "autogen"."W"
+WHERE entity_id =~ /{entity_regex}/
+  AND time >= '{scan_start:%Y-%m-%dT%H:%M:%SZ}' AND time < '{scan_end:%Y-%m-%dT%H:%M:%SZ}'
+GROUP BY time(1m), entity_id fill(none)
+'''
+else:
+    entity_regex = "|".join(FUSE_IDS)
+    query = f'''
 SELECT entity_id, last(value) AS value
 FROM "autogen"."W"
 WHERE entity_id =~ /{entity_regex}/
@@ -83,7 +91,7 @@ GROUP BY entity_id
 '''
 
 try:
-    result = client.query(query)
+    result = client.query(query, epoch="s")
 except Exception as e:
     print(f"Query failed: {e}")
     print("Query:")
@@ -91,7 +99,13 @@ except Exception as e:
     sys.exit(1)
 
 # === Results ===
-fuses_with_data = {p["entity_id"] for p in result.get_points() if p.get("entity_id")}
+if EXPORT_PLAN == "gaps":
+    influx_counts = {}  # fuse → {minute (epoch s): points}
+    for series in result.raw.get("series") or []:
+        influx_counts[series["tags"]["entity_id"]] = {int(t): int(n) for t, n in series["values"]}
+    fuses_with_data = set(influx_counts)
+else:
+    fuses_with_data = {p["entity_id"] for p in result.get_points() if p.get("entity_id")}
 missing_fuses = [f for f in FUSE_IDS if f not in fuses_with_data]
 
 # === Output ===
@@ -104,6 +118,44 @@ else:
 
 print(f"Checked {len(FUSE_IDS)} fuses → {len(fuses_with_data)} active, {len(missing_fuses)} missing.")
 
+# === Gap map: minutes Influx has that MariaDB does not (fully) hold ===
+if EXPORT_PLAN == "gaps":
+    from sqlalchemy import bindparam, create_engine, text
+    from gap_map import GAP_MAP_PATH, find_gaps, save_gap_map
+
+    db_url = (f"mysql+pymysql://{os.getenv('MARIADB_USER')}:{os.getenv('MARIADB_PASSWORD')}"
+              f"@{os.getenv('MARIADB_HOST', '192.168.188.74')}:{os.getenv('MARIADB_PORT', '3306')}"
+              f"/{os.getenv('MARIADB_DATABASE', 'homeassistant')}")
+    try:
+        engine = create_engine(db_url)
+        with engine.connect() as conn:
+            # Minute offsets from the scan start: no time zone conversion on either side
+            rows = conn.execute(text(f"""
+                SELECT entity_id, TIMESTAMPDIFF(MINUTE, :start, timestamp) AS minute, {ARCHIVE_POINTS}
+                FROM {ARCHIVE_TABLE}
+                WHERE timestamp >= :start AND timestamp < :end AND entity_id IN :fuses
+                GROUP BY entity_id, minute
+            """).bindparams(bindparam("fuses", expanding=True)),
+                {"start": scan_start, "end": scan_end, "fuses": FUSE_IDS}).all()
+        engine.dispose()
+    except Exception as e:
+        print(f"WARNING: No gap map, cannot read `{ARCHIVE_TABLE}`: {e}")
+        GAP_MAP_PATH.unlink(missing_ok=True)  # export_fuse_data.py falls back to the full window
+    else:
+        start_s = int(scan_start.replace(tzinfo=timezone.utc).timestamp())
+        archive_counts = {}
+        for fuse, minute, n in rows:
+            archive_counts.setdefault(fuse, {})[start_s + 60 * int(minute)] = int(n)
+        influx_minutes = sum(len(c) for c in influx_counts.values())
+        gaps = find_gaps(influx_counts, archive_counts)
+        doc = save_gap_map(ARCHIVE_TABLE, scan_start, scan_end, FUSE_IDS, gaps, influx_minutes)
+        print(f"Coverage {scan_start:%Y-%m-%d %H:%M} → {scan_end:%Y-%m-%d %H:%M} UTC: "
+              f"{influx_minutes - doc['missing_minutes']:,}/{influx_minutes:,} fuse-minutes archived, "
+              f"{sum(len(r) for r in gaps.values())} gap(s) in {len(gaps)} fuse(s) → {GAP_MAP_PATH.name}")
+        for fuse, ranges in sorted(gaps.items()):
+            minutes = sum(int((b - a).total_seconds()) // 60 for a, b in ranges)
+            print(f"   • {fuse:<40} {len(ranges):>4} gap(s), {minutes:>6,} min")
+
 if missing_fuses:
     sys.exit(2)   # treat missing fuse as warning only
 
@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 # code/export_fuse_data_daily.py
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from influxdb import InfluxDBClient
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
+import queue
+import re
 import sys
+import threading
 import time
 from pathlib import Path
 from dotenv import load_dotenv
 import os
 
+from bulk_loader import INSERT_MODES, iter_batches, load_batch
+from fuse_config import FUSE_IDS
+from gap_map import gap_windows, load_gap_map
+
+sys.path.insert(0, str(Path(__file__).parent / "machine_learning"))
+from perf_metrics import StageMetrics
+from archive_dataset import record_refill
+from archive_schema import SCHEMAS, create_v2, entity_ids, to_v2_rows, v2_tables
+
 # === Load .env ===
 env_path = Path(__file__).parent.parent / "env" / ".env"
 load_dotenv(dotenv_path=env_path)
@@ -23,43 +38,103 @@ DB_PORT = os.getenv("MARIADB_PORT", "3306")
 DB_NAME = os.getenv("MARIADB_DATABASE", "homeassistant")
 TABLE_NAME = os.getenv("TABLE_NAME", "energy_fuse_archive")
 
+# raw:      every sample → TABLE_NAME (default)
+# minutely: mean/min/max/last/count per minute, aggregated by InfluxDB → MINUTELY_TABLE
+RESOLUTION = os.getenv("EXPORT_RESOLUTION", "raw")
+MINUTELY_TABLE = os.getenv("MINUTELY_TABLE", f"{TABLE_NAME}_minutely")
+# Layout of the raw table, see archive_schema.py: v1 = TABLE_NAME, v2 = <TABLE_NAME>_v2 + entity dictionary
+ARCHIVE_SCHEMA = os.getenv("ARCHIVE_SCHEMA", "v1")
+PARTITION_MONTHS_AHEAD = int(os.getenv("ARCHIVE_PARTITION_MONTHS_AHEAD", "2"))
+V2 = v2_tables(TABLE_NAME) if RESOLUTION == "raw" and ARCHIVE_SCHEMA == "v2" else None
+TARGET_TABLE = MINUTELY_TABLE if RESOLUTION == "minutely" else V2["data"] if V2 else TABLE_NAME
+READ_TABLE = V2["view"] if V2 else TARGET_TABLE  # same columns as the v1 table
+WATERMARK_TABLE = os.getenv("WATERMARK_TABLE", f"{TARGET_TABLE}_watermark")
+
 INFLUX_URL = os.getenv("INFLUX_URL", "http://192.168.188.74:8086")
 INFLUX_USER = os.getenv("INFLUX_USER")
 INFLUX_PASS = os.getenv("INFLUX_PASSWORD")
 INFLUX_DB = os.getenv("INFLUX_BUCKET")  # Must be: homeassistantdb
 
 CHECK_HOURS = int(os.getenv("CHECK_HOURS", "72"))
+RESUME_MAX_HOURS = int(os.getenv("EXPORT_RESUME_MAX_HOURS", "168"))  # how far back a lagging fuse may catch up
+FETCH_MODE = os.getenv("EXPORT_FETCH_MODE", "batched")  # batched | per_fuse
+
+# window: every fuse from its watermark (or CHECK_HOURS back) to now
+# gaps:   first the minute ranges missing in MariaDB per data/gap_map.json (check_fuse_data.py), then new data;
+#         the ranges are recorded for export_full_archive.py to read again (archive_dataset.py _refill.json)
+EXPORT_PLAN = os.getenv("EXPORT_PLAN", "window")
+GAP_MAP_MAX_AGE = int(os.getenv("EXPORT_GAP_MAP_MAX_AGE_MINUTES", "90"))   # older gap maps are ignored
+GAP_MERGE_MINUTES = float(os.getenv("EXPORT_GAP_MERGE_MINUTES", "15"))     # gaps closer than this share one fetch
+
+# Pipelined export: concurrent Influx fetches feeding a single MariaDB writer
+FETCH_WORKERS = int(os.getenv("EXPORT_FETCH_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("EXPORT_QUEUE_SIZE", "4"))            # chunks waiting for the writer
+WINDOW_HOURS = float(os.getenv("EXPORT_WINDOW_HOURS", "6"))      # first window, then adaptive
+MIN_WINDOW_MINUTES = float(os.getenv("EXPORT_MIN_WINDOW_MINUTES", "15"))
+MAX_WINDOW_HOURS = float(os.getenv("EXPORT_MAX_WINDOW_HOURS", "24"))
+TARGET_POINTS = int(os.getenv("EXPORT_TARGET_POINTS", "100000"))  # points per window
+TARGET_SECONDS = float(os.getenv("EXPORT_TARGET_SECONDS", "10"))  # Influx latency per window
+
+# MariaDB load path, see bulk_loader.py: insert_ignore | upsert | load_data | to_sql
+INSERT_MODE = os.getenv("EXPORT_INSERT_MODE", "insert_ignore")
+BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "5000"))
 
 required = ["MARIADB_USER", "MARIADB_PASSWORD", "INFLUX_USER", "INFLUX_PASSWORD", "INFLUX_BUCKET"]
 missing = [v for v in required if not os.getenv(v)]
 if missing:
     print(f"ERROR: Missing env vars: {', '.join(missing)}")
     sys.exit(1)
+if FETCH_MODE not in ("batched", "per_fuse"):
+    print(f"ERROR: EXPORT_FETCH_MODE must be 'batched' or 'per_fuse', got '{FETCH_MODE}'")
+    sys.exit(1)
+if RESOLUTION not in ("raw", "minutely"):
+    print(f"ERROR: EXPORT_RESOLUTION must be 'raw' or 'minutely', got '{RESOLUTION}'")
+    sys.exit(1)
+if ARCHIVE_SCHEMA not in SCHEMAS:
+    print(f"ERROR: ARCHIVE_SCHEMA must be one of {', '.join(SCHEMAS)}, got '{ARCHIVE_SCHEMA}'")
+    sys.exit(1)
+if EXPORT_PLAN not in ("window", "gaps"):
+    print(f"ERROR: EXPORT_PLAN must be 'window' or 'gaps', got '{EXPORT_PLAN}'")
+    sys.exit(1)
+if INSERT_MODE not in INSERT_MODES:
+    print(f"ERROR: EXPORT_INSERT_MODE must be one of {', '.join(INSERT_MODES)}, got '{INSERT_MODE}'")
+    sys.exit(1)
+if EXPORT_PLAN == "gaps" and INSERT_MODE == "to_sql":
+    # Gap windows start inside archived data, and to_sql fails on the first duplicate key
+    print("ERROR: EXPORT_PLAN=gaps re-fetches archived rows → use EXPORT_INSERT_MODE insert_ignore, upsert or load_data")
+    sys.exit(1)
 
 DB_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-FUSE_IDS = [
-    "03_solarinput63a_active_power", 
-    "ams_linje6_po",
-    "ams_linje6_p",
-    "11_varmepumpe32a_apparent_power", 
-    "12_vvbereder3kw16a_apparent_power",
-    "04_fyrkjelevarmepump_active_power", 
-    "03a_kjokken_3p_230vl_active_power",
-    "u05_billader16a_active_power", 
-    "05_kjokkenlys15a_active_power",
-    "06_kjeller15a_active_power", 
-    "07_lysstikk1floor16a_active_power",
-    "08_lysstikk2ndfloor1_active_power", 
-    "09_internet16a_active_power",
-    "10badgammel13a_active_power", 
-    "u7_kitchen20a_active_power",
-    "u8_kitchenlight16a_active_power", 
-    "u9_lysstikk16a_active_power",
-    "u10_bad2nd16a_active_power"
-]
-
-print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Starting streaming export – last {CHECK_HOURS}h")
+
+def fuse_regex(fuses):
+    # Anchored so that e.g. ams_linje6_p does not also pull in ams_linje6_po
+    return "/^(" + "|".join(re.escape(f) for f in fuses) + ")$/"
+
+
+# Influx columns of one fetched series → value columns of the target table
+if RESOLUTION == "minutely":
+    SELECT_FIELDS = ('mean(value) AS value_w, min(value) AS min_w, max(value) AS max_w, '
+                     'last(value) AS last_w, count(value) AS samples')
+    INFLUX_COLUMNS = VALUE_COLUMNS = ["value_w", "min_w", "max_w", "last_w", "samples"]
+    BUCKET = timedelta(minutes=1)
+else:
+    SELECT_FIELDS = "time, value"
+    INFLUX_COLUMNS, VALUE_COLUMNS = ["value"], ["value_w"]
+    BUCKET = None
+
+
+def group_by(by_entity):
+    """GROUP BY clause: one minute bucket per row in minutely mode, fill(none) skips empty minutes."""
+    tags = ["time(1m)"] if BUCKET else []
+    tags += ["entity_id"] if by_entity else []
+    if not tags:
+        return ""
+    return "GROUP BY " + ", ".join(tags) + (" fill(none)" if BUCKET else "")
+
+
+print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Starting streaming export – last {CHECK_HOURS}h ({RESOLUTION})")
+metrics = StageMetrics("export")
 
 # === MariaDB ===
 engine = create_engine(
@@ -67,6 +142,7 @@ engine = create_engine(
     pool_pre_ping=True,
     pool_recycle=3600,
     isolation_level="AUTOCOMMIT",
+    connect_args={"local_infile": True} if INSERT_MODE == "load_data" else {},
     echo=False
 )
 
@@ -74,27 +150,74 @@ with engine.connect() as conn:
     conn.execute(text("SELECT 1"))
 print("MariaDB connected")
 
+entity_map = {}  # v2: fuse → SMALLINT id
 with engine.begin() as conn:
+    if V2:
+        create_v2(conn, TABLE_NAME, months_ahead=PARTITION_MONTHS_AHEAD)
+        entity_map = entity_ids(conn, TABLE_NAME, FUSE_IDS)
+    else:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                timestamp DATETIME(6) NOT NULL,
+                entity_id VARCHAR(64) NOT NULL,
+                value_w DOUBLE NOT NULL,
+                CONSTRAINT uq_ts_entity UNIQUE (timestamp, entity_id),
+                INDEX idx_timestamp (timestamp DESC),
+                INDEX idx_entity (entity_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """))
+    # Newest exported timestamp (minutely: minute) per fuse, advanced in the same transaction as each insert batch
     conn.execute(text(f"""
-        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-            id BIGINT AUTO_INCREMENT PRIMARY KEY,
-            timestamp DATETIME(6) NOT NULL,
-            entity_id VARCHAR(64) NOT NULL,
-            value_w DOUBLE NOT NULL,
-            CONSTRAINT uq_ts_entity UNIQUE (timestamp, entity_id),
-            INDEX idx_timestamp (timestamp DESC),
-            INDEX idx_entity (entity_id)
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            entity_id VARCHAR(64) NOT NULL PRIMARY KEY,
+            last_timestamp DATETIME(6) NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
     """))
-print(f"Table `{TABLE_NAME}` ready")
+    if RESOLUTION == "minutely":
+        # One row per fuse and minute; value_w is the mean, so readers of the raw table work unchanged
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {MINUTELY_TABLE} (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                timestamp DATETIME NOT NULL,
+                entity_id VARCHAR(64) NOT NULL,
+                value_w DOUBLE NOT NULL,
+                min_w DOUBLE NOT NULL,
+                max_w DOUBLE NOT NULL,
+                last_w DOUBLE NOT NULL,
+                samples INT NOT NULL,
+                CONSTRAINT uq_ts_entity UNIQUE (timestamp, entity_id),
+                INDEX idx_timestamp (timestamp DESC),
+                INDEX idx_entity (entity_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """))
+print(f"Tables `{TARGET_TABLE}` + `{WATERMARK_TABLE}` ready" + (f" (v2, {len(entity_map)} entity ids)" if V2 else ""))
 
 # === InfluxDB 1.x ===
 host = INFLUX_URL.replace("http://", "").replace("https://", "").split(":")[0]
-client = InfluxDBClient(
-    host=host, port=8086,
-    username=INFLUX_USER, password=INFLUX_PASS,
-    database=INFLUX_DB, timeout=60, retries=5
-)
+port = int(INFLUX_URL.split(":")[-1].split("/")[0]) if INFLUX_URL.count(":") > 1 else 8086
+
+
+def make_influx_client():
+    return InfluxDBClient(
+        host=host, port=port,
+        username=INFLUX_USER, password=INFLUX_PASS,
+        database=INFLUX_DB, timeout=60, retries=5
+    )
+
+
+# One client (and HTTP session) per fetch thread
+_thread_local = threading.local()
+
+
+def influx_client():
+    if not hasattr(_thread_local, "client"):
+        _thread_local.client = make_influx_client()
+    return _thread_local.client
+
+
+client = make_influx_client()
 
 try:
     client.ping()
@@ -107,78 +230,249 @@ except Exception as e:
     print(f"InfluxDB connection failed: {e}")
     sys.exit(1)
 
-# === Determine cutoff timestamp (only insert newer data) ===
-with engine.connect() as conn:
-    result = conn.execute(text(f"SELECT MAX(timestamp) FROM {TABLE_NAME}")).scalar()
-    cutoff_ts = pd.to_datetime(result, utc=True) if result else None
+# === Influx fetch helpers ===
+EMPTY_COLUMNS = (np.empty(0, dtype=np.int64), np.empty((0, len(INFLUX_COLUMNS)), dtype=np.float64))
 
-if cutoff_ts:
-    print(f"Last record in DB: {cutoff_ts} → only newer data will be inserted")
-else:
-    print("First run → all data will be inserted")
 
-# === Streaming fetch + direct insert per chunk ===
-chunk_hours = 6
-chunks = (CHECK_HOURS + chunk_hours - 1) // chunk_hours
-now = datetime.utcnow()
-total_inserted = 0
+def influx_time(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
 
-print(f"Streaming data in {chunks} chunks of {chunk_hours}h each → direct DB insert...")
+def series_to_columns(series):
+    """Influx series → (epoch-ns int64 array, float64 array with one column per INFLUX_COLUMNS).
 
-for i in range(chunks):
-    start_dt = now - timedelta(hours=CHECK_HOURS) + timedelta(hours=i * chunk_hours)
-    end_dt = min(start_dt + timedelta(hours=chunk_hours), now)
+    Works on the column-oriented JSON directly instead of one dict per point.
+    None values become NaN here and are filled later.
+    """
+    rows = series.get("values") or []
+    if not rows:
+        return EMPTY_COLUMNS
+    columns = list(zip(*rows))
+    names = series["columns"]
+    ts_ns = np.asarray(columns[names.index("time")], dtype=np.int64)
+    values = np.column_stack([np.asarray(columns[names.index(c)], dtype=np.float64) for c in INFLUX_COLUMNS])
+    return ts_ns, values
 
-    print(f"\nChunk {i+1}/{chunks}: {start_dt:%Y-%m-%d %H:%M} → {end_dt:%Y-%m-%d %H:%M} UTC")
 
-    chunk_records = []
+def window_bounds(start_dt, end_dt, gap_fuses=None):
+    """Lower time bound per fuse for this window, starting at each fuse's own watermark.
 
+    Fuses whose watermark is already past the window are left out. The fuses of a
+    gap window (gap_fuses) lie behind their watermark and are fetched from the window start.
+    Minutely fuse starts are the first open minute, so they are inclusive.
+    """
+    if gap_fuses is not None:
+        return {fuse: f"time >= '{influx_time(start_dt)}'" for fuse in gap_fuses}
+    bounds = {}
     for fuse in FUSE_IDS:
+        first = fuse_starts[fuse]
+        if first >= end_dt:
+            continue
+        if first <= start_dt:
+            bounds[fuse] = f"time >= '{influx_time(start_dt)}'"
+        else:
+            bounds[fuse] = f"time {'>=' if BUCKET else '>'} '{influx_time(first)}'"
+    return bounds
+
+
+def fetch_chunk_per_fuse(start_dt, end_dt, gap_fuses=None):
+    """One query per fuse (legacy mode). Errors are kept per fuse."""
+    columns_by_fuse = {}
+    for fuse, lower in window_bounds(start_dt, end_dt, gap_fuses).items():
         query = f'''
-            SELECT time, value
+            SELECT {SELECT_FIELDS}
             FROM "W"
             WHERE entity_id = '{fuse}'
-              AND time >= '{start_dt.strftime('%Y-%m-%dT%H:%M:%SZ')}'
-              AND time < '{end_dt.strftime('%Y-%m-%dT%H:%M:%SZ')}'
+              AND {lower}
+              AND time < '{influx_time(end_dt)}'
+            {group_by(by_entity=False)}
         '''
         try:
-            result = client.query(query, epoch='ns')
-            points = list(result.get_points())
-            for p in points:
-                ts = pd.to_datetime(p['time'], utc=True)
-                if cutoff_ts is None or ts > cutoff_ts:
-                    chunk_records.append({
-                        "timestamp": ts,
-                        "entity_id": fuse,
-                        "value_w": float(p['value']) if p['value'] is not None else 0.0
-                    })
-            print(f"  • {fuse:<40} {len(points):>7,} points → {sum(1 for p in points if cutoff_ts is None or pd.to_datetime(p['time'], utc=True) > cutoff_ts):>6} new")
+            result = influx_client().query(query, epoch='ns')
+            series = result.raw.get("series") or []
+            columns_by_fuse[fuse] = series_to_columns(series[0]) if series else EMPTY_COLUMNS
         except Exception as e:
-            print(f"  • {fuse} → ERROR: {e}")
+            columns_by_fuse[fuse] = e
+    return columns_by_fuse
+
+
+def fetch_chunk_batched(start_dt, end_dt, gap_fuses=None):
+    """One request for all fuses, demultiplexed by the entity_id tag.
+
+    Fuses that start at the window start share one regex statement; fuses whose
+    watermark falls inside the window get their own statement in the same request.
+    """
+    bounds = window_bounds(start_dt, end_dt, gap_fuses)
+    if not bounds:
+        return {}
+    shared = [f for f, lower in bounds.items() if lower == f"time >= '{influx_time(start_dt)}'"]
+    conditions = [(f"entity_id =~ {fuse_regex(shared)}", f"time >= '{influx_time(start_dt)}'")] if shared else []
+    conditions += [(f"entity_id = '{f}'", lower) for f, lower in bounds.items() if f not in shared]
+    query = ";".join(f'''
+        SELECT {SELECT_FIELDS}
+        FROM "W"
+        WHERE {entity} AND {lower}
+          AND time < '{influx_time(end_dt)}'
+        {group_by(by_entity=True)}
+    ''' for entity, lower in conditions)
+
+    result = influx_client().query(query, epoch='ns')
+    columns_by_fuse = {fuse: EMPTY_COLUMNS for fuse in bounds}
+    for result_set in (result if isinstance(result, list) else [result]):
+        for series in result_set.raw.get("series") or []:
+            fuse = (series.get("tags") or {}).get("entity_id")
+            if fuse in columns_by_fuse:
+                columns_by_fuse[fuse] = series_to_columns(series)
+    return columns_by_fuse
+
+
+def fetch_chunk(start_dt, end_dt, gap_fuses=None):
+    if FETCH_MODE == "per_fuse":
+        return fetch_chunk_per_fuse(start_dt, end_dt, gap_fuses)
+    return fetch_chunk_batched(start_dt, end_dt, gap_fuses)
+
+
+def build_chunk_frame(columns_by_fuse, use_watermarks=True):
+    """Filter, fill and assemble one chunk into a single DataFrame.
+
+    Points at or before a fuse's watermark are dropped, except in gap windows
+    (use_watermarks=False): those are behind the watermark on purpose.
+    Returns (DataFrame or None, {fuse: (points, new)}).
+    """
+    ts_parts, value_parts, code_parts = [], [], []
+    counts = {}
+    for code, fuse in enumerate(FUSE_IDS):
+        if fuse not in columns_by_fuse:
+            continue
+        columns = columns_by_fuse[fuse]
+        if isinstance(columns, Exception):
+            counts[fuse] = columns
+            continue
+        ts_ns, values = columns
+        cutoff_ns = watermark_ns.get(fuse) if use_watermarks else None
+        keep = ts_ns > cutoff_ns if cutoff_ns is not None else slice(None)
+        ts_ns, values = ts_ns[keep], values[keep]
+        counts[fuse] = (len(columns[0]), len(ts_ns))
+        if len(ts_ns):
+            ts_parts.append(ts_ns)
+            value_parts.append(values)
+            code_parts.append(np.full(len(ts_ns), code, dtype=np.int16))
+
+    if not ts_parts:
+        return None, counts
+
+    values = np.concatenate(value_parts)
+    values[np.isnan(values)] = 0.0  # Influx nulls → 0 W, as before
+    df_chunk = pd.DataFrame({
+        "timestamp": pd.to_datetime(np.concatenate(ts_parts), utc=True),
+        "entity_id": pd.Categorical.from_codes(np.concatenate(code_parts), categories=FUSE_IDS),
+        **dict(zip(VALUE_COLUMNS, values.T)),
+    })
+    if "samples" in df_chunk:
+        df_chunk["samples"] = df_chunk["samples"].astype(np.int64)
+    return df_chunk, counts
+
+
+def fetch_window(start_dt, end_dt, gap_fuses=None):
+    """Runs in a fetch thread: query + columnar conversion for one window."""
+    t0 = time.perf_counter()
+    columns_by_fuse = fetch_chunk(start_dt, end_dt, gap_fuses)
+    seconds = time.perf_counter() - t0
+    points = sum(len(c[0]) for c in columns_by_fuse.values() if not isinstance(c, Exception))
+    metrics.record("influx_query", seconds, points)
+    with metrics.step("build_chunk", rows=points):
+        df_chunk, counts = build_chunk_frame(columns_by_fuse, use_watermarks=gap_fuses is None)
+    return df_chunk, counts, points, seconds
+
 
-    if not chunk_records:
-        print("  No new data in this chunk.")
-        continue
+def floor_bucket(dt):
+    return dt - (dt - datetime.min) % BUCKET
 
-    df_chunk = pd.DataFrame(chunk_records)
-    print(f"  Inserting {len(df_chunk):,} new rows from this chunk...")
 
-    chunk_size = 5000
-    for start in range(0, len(df_chunk), chunk_size):
-        subchunk = df_chunk.iloc[start:start + chunk_size]
+class WindowPlanner:
+    """Hands out consecutive [start, end) windows, sized from what Influx returned so far.
+
+    Each window aims for TARGET_POINTS points and TARGET_SECONDS of query time,
+    and may at most double from one window to the next.
+    """
+
+    def __init__(self, start_dt, end_dt):
+        self.cursor = start_dt
+        self.end_dt = end_dt
+        self.hours = WINDOW_HOURS
+
+    def next_window(self):
+        if self.cursor >= self.end_dt:
+            return None
+        start_dt = self.cursor
+        end_dt = min(start_dt + timedelta(hours=self.hours), self.end_dt)
+        if BUCKET:
+            # Whole minutes only: a minute split over two windows would be aggregated twice
+            end_dt = max(floor_bucket(end_dt), start_dt + BUCKET)
+        self.cursor = end_dt
+        return start_dt, end_dt
+
+    def observe(self, hours, points, seconds):
+        if hours <= 0:
+            return
+        by_latency = hours * TARGET_SECONDS / max(seconds, 1e-3)
+        by_points = TARGET_POINTS / (points / hours) if points else MAX_WINDOW_HOURS
+        wanted = min(by_latency, by_points, 2 * self.hours)
+        self.hours = max(MIN_WINDOW_MINUTES / 60, min(MAX_WINDOW_HOURS, wanted))
+
+
+class GapPlanner:
+    """Hands out the gap windows (start, end, fuses) first, then the windows of `tail`."""
+
+    def __init__(self, windows, tail):
+        self.windows = deque(windows)
+        self.tail = tail
+
+    @property
+    def hours(self):
+        return self.tail.hours
+
+    def next_window(self):
+        if self.windows:
+            return self.windows.popleft()
+        return self.tail.next_window()
+
+    def observe(self, hours, points, seconds):
+        self.tail.observe(hours, points, seconds)
+
+
+def advance_watermarks(conn, batch):
+    newest = batch.groupby("entity_id", observed=True)["timestamp"].max()
+    conn.execute(text(f"""
+        INSERT INTO {WATERMARK_TABLE} (entity_id, last_timestamp)
+        VALUES (:entity_id, :last_timestamp)
+        ON DUPLICATE KEY UPDATE last_timestamp = GREATEST(last_timestamp, VALUES(last_timestamp))
+    """), [
+        {"entity_id": str(fuse), "last_timestamp": ts.tz_convert(None).to_pydatetime()}
+        for fuse, ts in newest.items()
+    ])
+
+
+def insert_chunk(conn, df_chunk):
+    """Insert one chunk in BATCH_ROWS batches, retrying on lock timeouts.
+
+    Each batch and its watermark update are one transaction, so a crashed run
+    resumes right after the last committed batch.
+    """
+    inserted = 0
+    for start, batch in iter_batches(df_chunk, BATCH_ROWS):
         retries = 0
         while retries < 5:
             try:
-                subchunk.to_sql(
-                    name=TABLE_NAME,
-                    con=engine,
-                    if_exists='append',
-                    index=False,
-                    method='multi',
-                    chunksize=1000
-                )
-                total_inserted += len(subchunk)
-                print(f"    Inserted {start+1:,}–{start+len(subchunk):,} (total so far: {total_inserted:,})")
+                with conn.begin():
+                    rows = to_v2_rows(batch, entity_map) if V2 else batch
+                    affected, seconds = load_batch(conn, TARGET_TABLE, rows, INSERT_MODE, update_columns=VALUE_COLUMNS)
+                    advance_watermarks(conn, batch)
+                metrics.record("insert_batch", seconds, len(batch))
+                inserted += affected
+                print(f"    Batch {start+1:,}–{start+len(batch):,}: {affected:,} written in {seconds:.2f}s "
+                      f"({len(batch) / max(seconds, 1e-9):,.0f} rows/s, {INSERT_MODE}) "
+                      f"(total so far: {total_inserted + inserted:,})")
                 break
             except Exception as e:
                 if any(x in str(e) for x in ["Lock wait timeout", "Deadlock", "1205"]):
@@ -190,8 +484,192 @@ for i in range(chunks):
                     print(f"    Fatal insert error: {e}")
                     raise
         else:
-            print("    Max retries exceeded. Skipping this subchunk.")
+            print("    Max retries exceeded. Skipping this batch.")
+    return inserted
+
+
+def writer():
+    """Drains the chunk queue into MariaDB until it receives None.
+
+    After an error it keeps draining (without inserting) so the fetch side never blocks.
+    """
+    global total_inserted, writer_error
+    conn = None
+    try:
+        conn = engine.connect().execution_options(isolation_level="READ COMMITTED")
+    except Exception as e:
+        writer_error = e
+    try:
+        while True:
+            item = chunk_queue.get()
+            try:
+                if item is None:
+                    return
+                if writer_error is None:
+                    label, df_chunk = item
+                    print(f"  [{label}] Inserting {len(df_chunk):,} new rows...")
+                    total_inserted += insert_chunk(conn, df_chunk)
+            except Exception as e:
+                writer_error = e
+            finally:
+                chunk_queue.task_done()
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+# === Per-fuse watermarks (only fetch and insert newer data) ===
+# Placeholder for fuses the archive had no rows for when seeded: counts as no watermark
+NO_WATERMARK = datetime(1000, 1, 1)
+
+with engine.begin() as conn:
+    known = {r[0] for r in conn.execute(text(f"SELECT entity_id FROM {WATERMARK_TABLE}"))}
+    unseeded = [f for f in FUSE_IDS if f not in known]
+    if unseeded:
+        # First run for these fuses: seed from what the archive already holds. Fuses without
+        # archived rows get NO_WATERMARK, so the seed scan runs once per fuse, not every export.
+        conn.execute(text(f"""
+            INSERT IGNORE INTO {WATERMARK_TABLE} (entity_id, last_timestamp)
+            SELECT entity_id, MAX(timestamp) FROM {READ_TABLE}
+            WHERE entity_id IN :fuses
+            GROUP BY entity_id
+        """).bindparams(bindparam("fuses", expanding=True)), {"fuses": unseeded})
+        conn.execute(text(f"""
+            INSERT IGNORE INTO {WATERMARK_TABLE} (entity_id, last_timestamp)
+            VALUES (:entity_id, :last_timestamp)
+        """), [{"entity_id": f, "last_timestamp": NO_WATERMARK} for f in unseeded])
+    watermarks = {
+        r[0]: pd.Timestamp(r[1]) for r in
+        conn.execute(text(f"SELECT entity_id, last_timestamp FROM {WATERMARK_TABLE} WHERE last_timestamp > :none"),
+                     {"none": NO_WATERMARK})
+    }
+
+now = datetime.utcnow()
+if BUCKET:
+    now = floor_bucket(now)  # the current minute is still open
+default_start = now - timedelta(hours=CHECK_HOURS)
+oldest_start = now - timedelta(hours=RESUME_MAX_HOURS)
+fuse_starts, watermark_ns = {}, {}
+for fuse in FUSE_IDS:
+    if fuse in watermarks:
+        fuse_starts[fuse] = max(watermarks[fuse].to_pydatetime() + (BUCKET or timedelta(0)), oldest_start)
+        watermark_ns[fuse] = watermarks[fuse].tz_localize("UTC").value
+    else:
+        fuse_starts[fuse] = default_start
+
+windows = []
+if EXPORT_PLAN == "gaps":
+    gap_map, reason = load_gap_map(READ_TABLE, FUSE_IDS, GAP_MAP_MAX_AGE)
+    if gap_map is None:
+        print(f"Gap plan: {reason} → exporting the full window")
+    else:
+        scan_start = datetime.fromisoformat(gap_map["start"])
+        scan_end = datetime.fromisoformat(gap_map["end"])
+        # Fuses resuming inside the scan: the gap map lists all they miss up to scan_end.
+        # Fuses resuming before it keep their window; their gaps are covered by it.
+        covered = [f for f in FUSE_IDS if fuse_starts[f] >= scan_start]
+        gap_map["gaps"] = {f: r for f, r in gap_map["gaps"].items() if f in covered}
+        for fuse in covered:
+            fuse_starts[fuse] = max(fuse_starts[fuse], scan_end)
+        windows = gap_windows(gap_map, GAP_MERGE_MINUTES, MAX_WINDOW_HOURS)
+        # The Parquet archive only appends rows after its own marks: have export_full_archive.py
+        # read these ranges again. Recorded before fetching, so rows of an aborted run are covered too.
+        if gap_map["gaps"]:
+            record_refill(gap_map["gaps"])
+        print(f"Gap plan ({gap_map['created']} UTC): {len(windows)} gap window(s), "
+              f"{sum(len(r) for r in gap_map['gaps'].values())} gap(s) in {len(gap_map['gaps'])} fuse(s); "
+              f"{len(covered)}/{len(FUSE_IDS)} fuses scanned up to {scan_end:%Y-%m-%d %H:%M} UTC")
+
+if watermarks:
+    print(f"Watermarks for {sum(f in watermarks for f in FUSE_IDS)}/{len(FUSE_IDS)} fuses "
+          f"(oldest {min(fuse_starts.values()):%Y-%m-%d %H:%M}) → each fuse resumes from its own")
+else:
+    print("First run → all data will be inserted")
+
+# === Pipelined fetch + insert ===
+total_inserted = 0
+writer_error = None
+fetch_error = None
+failed_fuses = set()
+chunk_queue = queue.Queue(maxsize=QUEUE_SIZE)
+planner = WindowPlanner(min(fuse_starts.values()), now)
+if windows:
+    planner = GapPlanner(windows, planner)
+
+print(f"Streaming data with {FETCH_WORKERS} fetch worker(s) ({FETCH_MODE} fetch), "
+      f"adaptive windows starting at {WINDOW_HOURS:g}h → queued DB insert...")
+
+writer_thread = threading.Thread(target=writer, name="mariadb-writer", daemon=True)
+writer_thread.start()
+
+pending = deque()
+window_no = 0
+with ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="influx-fetch") as pool:
+    while True:
+        # Keep FETCH_WORKERS windows in flight; results are consumed in window order
+        while len(pending) < FETCH_WORKERS and writer_error is None and fetch_error is None:
+            window = planner.next_window()
+            if window is None:
+                break
+            window_no += 1
+            pending.append((window_no, window, pool.submit(fetch_window, *window)))
+        if not pending:
+            break
+
+        no, window, future = pending.popleft()
+        start_dt, end_dt = window[:2]
+        hours = (end_dt - start_dt).total_seconds() / 3600
+        label = f", gap in {len(window[2])} fuse(s)" if len(window) > 2 else ""
+        print(f"\nWindow {no}: {start_dt:%Y-%m-%d %H:%M} → {end_dt:%Y-%m-%d %H:%M} UTC ({hours:.2f}h{label})")
+
+        try:
+            df_chunk, counts, points, seconds = future.result()
+        except Exception as e:
+            # Later windows would move the watermarks past this gap, so stop here
+            print(f"  • Window query → ERROR: {e}")
+            fetch_error = e
+            break
+
+        planner.observe(hours, points, seconds)
+        for fuse, count in counts.items():
+            if isinstance(count, Exception):
+                print(f"  • {fuse} → ERROR: {count} (skipping this fuse for the rest of the run)")
+                failed_fuses.add(fuse)
+            elif fuse not in failed_fuses:
+                print(f"  • {fuse:<40} {count[0]:>7,} points → {count[1]:>6} new")
+        print(f"  Fetched {points:,} points in {seconds:.2f}s → next window {planner.hours:.2f}h")
+
+        if writer_error is not None:
+            break
+        if df_chunk is not None and failed_fuses:
+            df_chunk = df_chunk[~df_chunk["entity_id"].isin(failed_fuses)]
+            df_chunk = df_chunk if len(df_chunk) else None
+        if df_chunk is None:
+            print("  No new data in this window.")
+            continue
+
+        chunk_queue.put((f"window {no}", df_chunk))  # blocks when the writer falls behind
+
+    for _, _, future in pending:
+        future.cancel()
+
+chunk_queue.put(None)
+writer_thread.join()
 
 client.close()
+
+metrics.close(rows=total_inserted)
+
+if writer_error is not None:
+    print(f"\nExport aborted: {writer_error}")
+    raise writer_error
+
+if fetch_error is not None:
+    print(f"\nExport stopped after {total_inserted:,} rows: Influx query failed.")
+    print("Watermarks point at the last committed batch → the next run resumes from there.")
+    sys.exit(1)
+
 print(f"\n[{datetime.now():%H:%M:%S}] Export completed successfully!")
-print(f"Total new rows inserted: {total_inserted:,}")
+print(f"Total new rows inserted: {total_inserted:,} ({INSERT_MODE})")
+if failed_fuses:
+    print(f"WARNING: {len(failed_fuses)} fuse(s) failed and will resume next run: {', '.join(sorted(failed_fuses))}")
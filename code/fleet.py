@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# code/fleet.py
+# Fleet mode: the pipeline for many houses, each with its own InfluxDB, MariaDB table and fuses.
+#
+#   python3 code/fleet.py                      → every house in the inventory
+#   python3 code/fleet.py house002 house017    → these houses
+#
+# Inventory (FLEET_INVENTORY, default env/fleet.json; see env/fleet.example.json):
+#   "defaults":    env vars for every house; "${VAR}" is taken from the environment / env/.env
+#   "houses":      house name → its env vars (INFLUX_URL, INFLUX_BUCKET, MARIADB_*, TABLE_NAME, FUSE_IDS...)
+#   "host_limits": host → houses allowed to talk to it at the same time (default FLEET_HOST_LIMIT)
+# Settings a house leaves out come from env/.env, like for the single-house pipeline.
+#
+# Houses are sharded over a pool of FLEET_WORKERS processes, one fresh worker per
+# house (the scripts read their settings when imported), round-robin over their
+# InfluxDB hosts. A worker runs FLEET_STEPS of its house in-process, in order; steps
+# that talk to InfluxDB or MariaDB first take a slot of that host. A failing step
+# stops its own house only.
+#
+# Per house: data/fleet/<house>/, models/fleet/<house>/, results/fleet/<house>/ (incl. metrics/),
+# log in results/fleet/logs/<run>/<house>.log. Summary of the run → results/fleet/<run>.json.
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+BASE = Path(__file__).resolve().parent
+project_root = BASE.parent
+load_dotenv(dotenv_path=project_root / "env" / ".env")
+
+INVENTORY = project_root / os.getenv("FLEET_INVENTORY", "env/fleet.json")
+WORKERS = int(os.getenv("FLEET_WORKERS", "4"))           # houses processed at the same time
+HOST_LIMIT = int(os.getenv("FLEET_HOST_LIMIT", "2"))     # houses per InfluxDB/MariaDB host at the same time
+STEPS = [s.strip() for s in os.getenv("FLEET_STEPS", "check,export,archive,train").split(",") if s.strip()]
+FLEET_DIR = project_root / "results" / "fleet"
+
+ML = BASE / "machine_learning"
+# step: (script, services it talks to)
+STEP_SCRIPTS = {
+    "check": (BASE / "check_fuse_data.py", ("influx",)),
+    "export": (BASE / "export_fuse_data.py", ("influx", "mariadb")),
+    "archive": (ML / "export_full_archive.py", ("mariadb",)),
+    "train": (ML / "per_fuse_minutely_forecast_xgboost.py", ()),
+    "forecast": (ML / "forecast_engine.py", ()),
+    "nilm": (ML / "nilm_per_fuse_detection.py", ()),
+}
+# Same defaults as the scripts
+DEFAULTS = {"INFLUX_URL": "http://192.168.188.74:8086", "MARIADB_HOST": "192.168.188.74",
+            "MARIADB_DATABASE": "homeassistant", "TABLE_NAME": "energy_fuse_archive"}
+
+
+# === Inventory ===
+def house_env(name, settings, defaults, run):
+    env = {}
+    for key, value in {**defaults, **settings}.items():
+        value = ",".join(value) if isinstance(value, list) else str(value)
+        env[key] = os.path.expandvars(value)
+    env.update({
+        "DATA_DIR": f"data/fleet/{name}",
+        "MODELS_DIR": f"models/fleet/{name}",
+        "RESULTS_DIR": f"results/fleet/{name}",
+        "PIPELINE_RUN_ID": f"{run}-{name}",
+    })
+    return env
+
+
+def load_inventory(run, selected=None):
+    """→ ({house: {"env": ..., "hosts": {"influx": host, "mariadb": host}}}, host limits); raises ValueError."""
+    if not INVENTORY.exists():
+        raise ValueError(f"No inventory at {INVENTORY} → copy env/fleet.example.json and fill in the houses")
+    inventory = json.loads(INVENTORY.read_text())
+    houses = inventory.get("houses") or {}
+    unknown = [h for h in selected or [] if h not in houses]
+    if unknown:
+        raise ValueError(f"Unknown house(s): {', '.join(unknown)} (inventory: {', '.join(houses)})")
+
+    result, tables = {}, {}
+    for name, settings in houses.items():
+        if selected and name not in selected:
+            continue
+        if not re.fullmatch(r"[A-Za-z0-9_.-]+", name):
+            raise ValueError(f"House name '{name}' must only use letters, digits, '_', '.', '-' (it names directories)")
+        env = house_env(name, settings, inventory.get("defaults") or {}, run)
+        unresolved = sorted(k for k, v in env.items() if re.search(r"\$\{?\w+", v))
+        if unresolved:
+            raise ValueError(f"{name}: unset variable(s) in {', '.join(unresolved)}")
+
+        effective = lambda key: env.get(key) or os.getenv(key) or DEFAULTS[key]
+        table = (effective("MARIADB_HOST"), effective("MARIADB_DATABASE"), effective("TABLE_NAME"))
+        if table in tables:
+            raise ValueError(f"{name} and {tables[table]} would share the table {table[1]}.{table[2]} on {table[0]} "
+                             f"→ give each house its own TABLE_NAME")
+        tables[table] = name
+        hosts = {"influx": urlparse(effective("INFLUX_URL")).hostname, "mariadb": effective("MARIADB_HOST")}
+        result[name] = {"env": env, "hosts": hosts}
+    return result, inventory.get("host_limits") or {}
+
+
+def shard_order(houses):
+    """Round-robin over the InfluxDB hosts, so the first houses to start do not all wait on one host."""
+    by_host = {}
+    for name, house in houses.items():
+        by_host.setdefault(house["hosts"]["influx"], []).append(name)
+    queues = list(by_host.values())
+    order = []
+    while any(queues):
+        for queue in queues:
+            if queue:
+                order.append(queue.pop(0))
+    return order
+
+
+# === Worker process (one per house) ===
+_host_slots = {}
+
+
+def _init_worker(host_slots):
+    global _host_slots
+    _host_slots = host_slots
+
+
+def run_house(name, env, hosts, steps, log_path):
+    """Run the steps of one house in this (fresh) process → result dict with per-step timings."""
+    os.environ.update(env)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    log = open(log_path, "w", buffering=1)
+    os.dup2(log.fileno(), 1)  # output of native code (XGBoost...) too
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+    for path in (BASE, ML):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
+    from fuse_matrix import SharedMatrix
+    from inprocess_runner import run_stage
+
+    matrix_loader = SharedMatrix()
+    result = {"house": name, "status": "ok", "steps": []}
+    started = time.perf_counter()
+    for step in steps:
+        script, services = STEP_SCRIPTS[step]
+        slots = [_host_slots[host] for host in sorted({hosts[s] for s in services})]
+        t0 = time.perf_counter()
+        for slot in slots:  # always in host order: no two houses wait on each other
+            slot.acquire()
+        waited = time.perf_counter() - t0
+        try:
+            print(f"\n[{datetime.now():%H:%M:%S}] {name}: {step} ({script.name}), waited {waited:.1f}s for a host slot")
+            print("─" * 80)
+            code, import_s, run_s, _ = run_stage(script, matrix_loader)
+        finally:
+            for slot in reversed(slots):
+                slot.release()
+        result["steps"].append({"step": step, "code": code, "wait_s": round(waited, 3),
+                                "import_s": round(import_s, 3), "run_s": round(run_s, 3)})
+        if code == 2:
+            result["status"] = "warning"
+        elif code != 0:
+            result["status"] = "failed"
+            result["failed_step"] = step
+            break
+    result["wall_s"] = round(time.perf_counter() - started, 3)
+    log.flush()
+    return result
+
+
+# === Scheduler ===
+def summary(results, order, wall):
+    print("\n=== Fleet timings (s: host wait + import + run) ===")
+    print(f"  {'house':<20} {'status':<8} " + " ".join(f"{s:>10}" for s in STEPS) + f" {'total':>9}")
+    for name in order:
+        r = results[name]
+        by_step = {s["step"]: s for s in r.get("steps", [])}
+        cells = [f"{by_step[s]['wait_s'] + by_step[s]['import_s'] + by_step[s]['run_s']:10.1f}" if s in by_step
+                 else f"{'-':>10}" for s in STEPS]
+        print(f"  {name:<20} {r['status']:<8} " + " ".join(cells) + f" {r.get('wall_s', 0):9.1f}")
+    busy = sum(r.get("wall_s", 0) for r in results.values())
+    waited = sum(s["wait_s"] for r in results.values() for s in r.get("steps", []))
+    print(f"Wall time {wall:.1f}s for {busy:.1f}s of house time ({busy / max(wall, 1e-9):.1f}× overlap), "
+          f"{waited:.1f}s waiting for host slots")
+    failed = [n for n in order if results[n]["status"] in ("failed", "error")]
+    for name in failed:
+        r = results[name]
+        print(f"  Error {name}: {r.get('failed_step') or r.get('error')} → {r.get('log')}")
+    print(f"{len(order) - len(failed)}/{len(order)} house(s) succeeded")
+    return failed
+
+
+def run_fleet(selected=None):
+    run = datetime.now().strftime("%Y%m%d-%H%M%S")
+    unknown = [s for s in STEPS if s not in STEP_SCRIPTS]
+    if unknown:
+        print(f"ERROR: FLEET_STEPS: unknown step(s) {', '.join(unknown)} (known: {', '.join(STEP_SCRIPTS)})")
+        return 1
+    try:
+        houses, limits = load_inventory(run, selected)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    if not houses:
+        print(f"No houses in {INVENTORY}")
+        return 1
+
+    ctx = multiprocessing.get_context("spawn")
+    all_hosts = {h for house in houses.values() for h in house["hosts"].values()}
+    host_slots = {h: ctx.Semaphore(int(limits.get(h, HOST_LIMIT))) for h in all_hosts}
+    order = shard_order(houses)
+    log_dir = FLEET_DIR / "logs" / run
+
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Fleet run {run}: {len(houses)} house(s), {WORKERS} worker(s), "
+          f"steps {' → '.join(STEPS)}")
+    for host in sorted(all_hosts):
+        print(f"  • {host}: {int(limits.get(host, HOST_LIMIT))} house(s) at a time")
+
+    started = time.perf_counter()
+    results = {}
+    # maxtasksperchild=1: every house gets a fresh interpreter with its own settings
+    with ctx.Pool(processes=max(1, min(WORKERS, len(houses))), maxtasksperchild=1,
+                  initializer=_init_worker, initargs=(host_slots,)) as pool:
+        pending = {
+            name: pool.apply_async(run_house, (name, houses[name]["env"], houses[name]["hosts"], STEPS,
+                                               log_dir / f"{name}.log"))
+            for name in order
+        }
+        while pending:
+            for name in [n for n, r in pending.items() if r.ready()]:
+                try:
+                    result = pending.pop(name).get()
+                except Exception as e:
+                    result = {"house": name, "status": "error", "error": f"{type(e).__name__}: {e}", "steps": []}
+                result["log"] = str((log_dir / f"{name}.log").relative_to(project_root))
+                results[name] = result
+                print(f"[{datetime.now():%H:%M:%S}] {name}: {result['status']}"
+                      + (f" in {result['wall_s']:.1f}s" if "wall_s" in result else "")
+                      + (f" (failed at {result['failed_step']})" if "failed_step" in result else ""))
+            time.sleep(0.2)
+    wall = time.perf_counter() - started
+
+    failed = summary(results, order, wall)
+    FLEET_DIR.mkdir(parents=True, exist_ok=True)
+    path = FLEET_DIR / f"{run}.json"
+    path.write_text(json.dumps({"run": run, "steps": STEPS, "wall_s": round(wall, 3),
+                                "houses": {n: results[n] for n in order}}, indent=2))
+    print(f"Summary → {path.relative_to(project_root)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    try:
+        raise SystemExit(run_fleet(sys.argv[1:]))
+    except KeyboardInterrupt:
+        print("\nInterrupted by user. Stopping fleet run.")
+        raise SystemExit(1)
@@ -0,0 +1,33 @@
+# code/fuse_config.py
+# The fuses of a house: one list for check_fuse_data.py, export_fuse_data.py and the benchmarks.
+# FUSE_IDS (comma-separated) replaces it, e.g. per house in fleet mode (fleet.py).
+# env/.env is loaded here, so the list is right wherever a script imports this module.
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).parent.parent / "env" / ".env")  # never overrides the process env
+
+DEFAULT_FUSE_IDS = [
+    "03_solarinput63a_active_power",
+    "ams_linje6_po",
+    "ams_linje6_p",
+    "11_varmepumpe32a_apparent_power",
+    "12_vvbereder3kw16a_apparent_power",
+    "04_fyrkjelevarmepump_active_power",
+    "03a_kjokken_3p_230vl_active_power",
+    "u05_billader16a_active_power",
+    "05_kjokkenlys15a_active_power",
+    "06_kjeller15a_active_power",
+    "07_lysstikk1floor16a_active_power",
+    "08_lysstikk2ndfloor1_active_power",
+    "09_internet16a_active_power",
+    "10badgammel13a_active_power",
+    "u7_kitchen20a_active_power",
+    "u8_kitchenlight16a_active_power",
+    "u9_lysstikk16a_active_power",
+    "u10_bad2nd16a_active_power"
+]
+
+FUSE_IDS = [f.strip() for f in os.getenv("FUSE_IDS", "").split(",") if f.strip()] or DEFAULT_FUSE_IDS
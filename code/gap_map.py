@@ -0,0 +1,102 @@
+# code/gap_map.py
+# Gap map: the minutes InfluxDB has data for that MariaDB does not (fully) hold yet.
+#
+# Written by check_fuse_data.py (EXPORT_PLAN=gaps) from one count(value) per
+# minute and fuse query against Influx and a COUNT(*) per minute and fuse against
+# the archive table; read by export_fuse_data.py to fetch only those minutes, which
+# also records them for export_full_archive.py (they lie behind its Parquet marks).
+#
+# data/gap_map.json:
+#   {"created": ..., "table": ..., "start": ..., "end": ...,        ← scanned [start, end), UTC
+#    "fuses": [...],                                              ← fuses that were scanned
+#    "gaps": {"<fuse>": [["<from>", "<to>"], ...]},                ← missing [from, to) minute ranges
+#    "missing_minutes": ..., "influx_minutes": ...}
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+project_root = Path(__file__).resolve().parent.parent
+GAP_MAP_PATH = project_root / os.getenv("DATA_DIR", "data") / "gap_map.json"
+
+MINUTE_S = 60
+
+
+def minutes_to_ranges(minutes):
+    """Sorted epoch seconds of whole minutes → [(from, to)] datetimes of consecutive runs (to exclusive)."""
+    minutes = np.asarray(minutes, dtype=np.int64)
+    if not len(minutes):
+        return []
+    breaks = np.flatnonzero(np.diff(minutes) != MINUTE_S) + 1
+    starts = minutes[np.r_[0, breaks]]
+    ends = minutes[np.r_[breaks - 1, len(minutes) - 1]] + MINUTE_S
+    return [(datetime.utcfromtimestamp(int(s)), datetime.utcfromtimestamp(int(e))) for s, e in zip(starts, ends)]
+
+
+def find_gaps(influx_counts, archive_counts):
+    """{fuse: {minute epoch s: count}} from both sides → {fuse: [(from, to)]} where the archive has fewer points."""
+    gaps = {}
+    for fuse, counts in influx_counts.items():
+        held = archive_counts.get(fuse, {})
+        missing = sorted(m for m, n in counts.items() if held.get(m, 0) < n)
+        if missing:
+            gaps[fuse] = minutes_to_ranges(missing)
+    return gaps
+
+
+def save_gap_map(table, start, end, fuses, gaps, influx_minutes, path=GAP_MAP_PATH):
+    doc = {
+        "created": datetime.utcnow().isoformat(timespec="seconds"),
+        "table": table,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "fuses": list(fuses),
+        "gaps": {fuse: [[a.isoformat(), b.isoformat()] for a, b in ranges] for fuse, ranges in gaps.items()},
+        "missing_minutes": sum(int((b - a).total_seconds()) // MINUTE_S for r in gaps.values() for a, b in r),
+        "influx_minutes": influx_minutes,
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(doc, indent=2))
+    os.replace(tmp, path)
+    return doc
+
+
+def load_gap_map(table, fuses, max_age_minutes, path=GAP_MAP_PATH):
+    """The gap map if it is fresh and was made for this table and fuse list → (doc, None) or (None, reason)."""
+    if not path.exists():
+        return None, f"no gap map at {path.name} (run check_fuse_data.py with EXPORT_PLAN=gaps first)"
+    doc = json.loads(path.read_text())
+    age = datetime.utcnow() - datetime.fromisoformat(doc["created"])
+    if age > timedelta(minutes=max_age_minutes):
+        return None, f"gap map is {age.total_seconds() / 60:.0f} min old (> {max_age_minutes} min)"
+    if doc["table"] != table or set(doc["fuses"]) != set(fuses):
+        return None, "gap map was made for another table or fuse list"
+    return doc, None
+
+
+def gap_windows(doc, merge_minutes, max_hours):
+    """Gap ranges of all fuses → [(from, to, fuses)] fetch windows.
+
+    Ranges closer than `merge_minutes` are merged into one window, whose fuses are
+    all fuses with a gap inside it; windows are split at `max_hours`.
+    """
+    ranges = sorted((datetime.fromisoformat(a), datetime.fromisoformat(b), fuse)
+                    for fuse, rs in doc["gaps"].items() for a, b in rs)
+    merged = []
+    for start, end, fuse in ranges:
+        if merged and start <= merged[-1][1] + timedelta(minutes=merge_minutes):
+            merged[-1][1] = max(merged[-1][1], end)
+            merged[-1][2].add(fuse)
+        else:
+            merged.append([start, end, {fuse}])
+
+    windows = []
+    for start, end, fuses in merged:
+        while start < end:
+            stop = min(start + timedelta(hours=max_hours), end)
+            windows.append((start, stop, sorted(fuses)))
+            start = stop
+    return windows
@@ -0,0 +1,338 @@
+# code/machine_learning/archive_dataset.py
+# Hive-partitioned Parquet archive shared by the export and ML scripts.
+#
+# Layout:
+#   data/energy_fuse_archive/entity_id=<fuse>/date=<YYYY-MM-DD>/part-<run>-<n>.parquet
+#   data/energy_fuse_archive/_state.json      ← high-water mark per entity_id (+ token of an unfinished append)
+#   data/energy_fuse_archive/_refill.json     ← time ranges filled in MariaDB behind those marks
+#                                                (export_fuse_data.py EXPORT_PLAN=gaps), read again by the next append
+#
+# The legacy single file data/energy_fuse_archive.parquet is still read when no
+# partitioned archive exists yet.
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+project_root = Path(__file__).parent.parent.parent
+
+# Relative to the project root; fleet.py gives every house its own. Read from the
+# process environment when first imported (env/.env is loaded later by the scripts).
+DATA_DIR = project_root / os.getenv("DATA_DIR", "data")
+MODELS_DIR = project_root / os.getenv("MODELS_DIR", "models")
+RESULTS_DIR = project_root / os.getenv("RESULTS_DIR", "results")
+
+ARCHIVE_DIR = DATA_DIR / "energy_fuse_archive"
+LEGACY_PATH = DATA_DIR / "energy_fuse_archive.parquet"
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("entity_id", pa.string()), ("date", pa.string())]), flavor="hive"
+)
+FILE_SCHEMA = pa.schema([("timestamp", pa.timestamp("us")), ("value_w", pa.float64())])
+
+
+# === State (high-water marks) ===
+def load_state(root=ARCHIVE_DIR):
+    path = Path(root) / "_state.json"
+    if not path.exists():
+        return {"high_water": {}}
+    return json.loads(path.read_text())
+
+
+def save_state(state, root=ARCHIVE_DIR):
+    path = Path(root) / "_state.json"
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def high_water(state):
+    """{entity_id: pd.Timestamp} from the stored state."""
+    return {e: pd.Timestamp(ts) for e, ts in state.get("high_water", {}).items()}
+
+
+# === Refill (rows MariaDB received behind the high-water marks) ===
+def load_refill(root=ARCHIVE_DIR):
+    """{entity_id: [(from, to)]} pd.Timestamp ranges still to be read again, to exclusive."""
+    path = Path(root) / "_refill.json"
+    if not path.exists():
+        return {}
+    return {e: [(pd.Timestamp(a), pd.Timestamp(b)) for a, b in r] for e, r in json.loads(path.read_text()).items()}
+
+
+def record_refill(ranges, root=ARCHIVE_DIR):
+    """Add {entity_id: [(from, to)]} ranges to the ones still to be read again; overlapping ranges are merged."""
+    refill = load_refill(root)
+    for entity, new in ranges.items():
+        merged = []
+        for a, b in sorted(refill.get(entity, []) + [(pd.Timestamp(a), pd.Timestamp(b)) for a, b in new]):
+            if merged and a <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], b)
+            else:
+                merged.append([a, b])
+        refill[entity] = merged
+    path = Path(root) / "_refill.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    doc = {e: [[a.isoformat(), b.isoformat()] for a, b in r] for e, r in refill.items()}
+    tmp.write_text(json.dumps(doc, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def clear_refill(root=ARCHIVE_DIR):
+    (Path(root) / "_refill.json").unlink(missing_ok=True)
+
+
+def drop_archived(df, root=ARCHIVE_DIR):
+    """Rows (timestamp, entity_id, value_w) whose entity_id and timestamp the archive does not hold yet.
+
+    Makes reading a range again safe: rows that were already appended, by an
+    earlier export or an earlier batch of the same one, are not appended twice.
+    """
+    df = df.drop_duplicates(["entity_id", "timestamp"])
+    if df.empty or not has_partitioned_archive(root):
+        return df
+    keep = np.ones(len(df), dtype=bool)
+    for entity, rows in df.groupby("entity_id").indices.items():
+        timestamps = df["timestamp"].iloc[rows]
+        held = read_archive([entity], timestamps.min(), timestamps.max() + pd.Timedelta(microseconds=1),
+                            columns=(), root=root).index
+        keep[rows] = ~timestamps.isin(held).to_numpy()
+    return df[keep]
+
+
+# === Writing ===
+def _run_token():
+    # Sorts chronologically, so files inside a partition are read in append order
+    return datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+
+
+def append_partitions(df, root=ARCHIVE_DIR, compression="snappy", token=None):
+    """Append rows (timestamp, entity_id, value_w) as new files in their entity/date partitions.
+
+    All files of one call are named part-<token>-<n>.parquet. Returns the number of rows written.
+    """
+    if df.empty:
+        return 0
+    df = df.sort_values(["entity_id", "timestamp"], kind="stable")
+    timestamps = pd.to_datetime(df["timestamp"]).to_numpy(dtype="datetime64[us]")
+    table = pa.table({
+        "timestamp": pa.array(timestamps, type=pa.timestamp("us")),
+        "value_w": pa.array(df["value_w"].to_numpy(dtype=np.float64)),
+        "entity_id": pa.array(df["entity_id"].astype(str).to_numpy(dtype=object), type=pa.string()),
+        "date": pa.array(np.datetime_as_string(timestamps.astype("datetime64[D]")), type=pa.string()),
+    })
+    ds.write_dataset(
+        table, root, format="parquet", partitioning=PARTITIONING,
+        basename_template=f"part-{token or _run_token()}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+    )
+    return len(df)
+
+
+def begin_append(state, root=ARCHIVE_DIR):
+    """Record the token of the next append_partitions() call in the state → token.
+
+    If the process dies before end_append(), the next begin/discard removes those
+    files again: their rows are not covered by the high-water marks and would be
+    appended a second time.
+    """
+    discard_unfinished(state, root)
+    state["pending"] = _run_token()
+    save_state(state, root)
+    return state["pending"]
+
+
+def end_append(state, root=ARCHIVE_DIR):
+    """Save the new high-water marks together with the end of the pending append."""
+    state.pop("pending", None)
+    save_state(state, root)
+
+
+def discard_unfinished(state, root=ARCHIVE_DIR):
+    """Delete the files of an append that never reached end_append() → number of files deleted."""
+    token = state.pop("pending", None)
+    if token is None:
+        return 0
+    files = list(Path(root).glob(f"entity_id=*/date=*/part-{token}-*.parquet"))
+    for f in files:
+        f.unlink()
+    save_state(state, root)
+    return len(files)
+
+
+def compact_partitions(root=ARCHIVE_DIR, min_files=4):
+    """Merge partitions that have collected min_files or more small files into one sorted file.
+
+    Returns the number of partitions compacted.
+    """
+    compacted = 0
+    for part_dir in sorted(Path(root).glob("entity_id=*/date=*")):
+        files = sorted(part_dir.glob("part-*.parquet"))
+        if len(files) < min_files:
+            continue
+        table = pq.read_table(files, schema=FILE_SCHEMA)
+        df = table.to_pandas().drop_duplicates("timestamp", keep="last").sort_values("timestamp")
+        merged = pa.Table.from_pandas(df, schema=FILE_SCHEMA, preserve_index=False)
+        tmp = part_dir / f".compact-{_run_token()}.parquet"  # '.' prefix: ignored by readers
+        pq.write_table(merged, tmp)
+        os.replace(tmp, part_dir / f"part-{_run_token()}-c.parquet")
+        for f in files:
+            f.unlink()
+        compacted += 1
+    return compacted
+
+
+# === Reading ===
+def env_filters():
+    """ML_FUSES (comma-separated) / ML_START / ML_END → read_archive() keyword arguments."""
+    fuses = [f.strip() for f in os.getenv("ML_FUSES", "").split(",") if f.strip()]
+    return {
+        "entities": fuses or None,
+        "start": os.getenv("ML_START") or None,
+        "end": os.getenv("ML_END") or None,
+    }
+
+
+def has_partitioned_archive(root=ARCHIVE_DIR):
+    return any(Path(root).glob("entity_id=*/date=*/*.parquet"))
+
+
+def read_archive(entities=None, start=None, end=None, columns=("entity_id", "value_w"), root=ARCHIVE_DIR):
+    """Load the archive as a DataFrame indexed by timestamp.
+
+    entities/start/end are pushed down to the Parquet scan: only matching
+    entity_id=/date= partitions are opened, and row groups outside [start, end)
+    are skipped via their statistics. columns selects what is read besides the
+    timestamp index.
+    """
+    columns = list(columns)
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    if not has_partitioned_archive(root):
+        # Legacy single file (timestamp as index): no pushdown, filter after loading
+        df = pd.read_parquet(LEGACY_PATH).sort_index()
+        if entities is not None:
+            df = df[df["entity_id"].isin(list(entities))]
+        if start is not None:
+            df = df[df.index >= start]
+        if end is not None:
+            df = df[df.index < end]
+        return df[columns]
+
+    dataset = ds.dataset(root, format="parquet", partitioning=PARTITIONING)
+    ts_type = dataset.schema.field("timestamp").type
+    flt = None
+
+    def _and(expr):
+        nonlocal flt
+        flt = expr if flt is None else flt & expr
+
+    if entities is not None:
+        _and(ds.field("entity_id").isin(list(entities)))
+    if start is not None:
+        _and(ds.field("date") >= start.strftime("%Y-%m-%d"))
+        _and(ds.field("timestamp") >= pa.scalar(start.to_datetime64(), type=ts_type))
+    if end is not None:
+        _and(ds.field("date") <= end.strftime("%Y-%m-%d"))
+        _and(ds.field("timestamp") < pa.scalar(end.to_datetime64(), type=ts_type))
+
+    table = dataset.to_table(columns=["timestamp"] + columns, filter=flt)
+    df = table.to_pandas()
+    if "entity_id" in df.columns:
+        df["entity_id"] = df["entity_id"].astype(str)
+    return df.sort_values("timestamp", kind="stable").set_index("timestamp")
+
+
+# === Streaming reads (bounded memory) ===
+def entity_files(entity, root=ARCHIVE_DIR, start=None, end=None):
+    """Parquet files of one entity in chronological order: date partitions, then append order."""
+    files = []
+    for date_dir in sorted(Path(root).glob(f"entity_id={entity}/date=*")):
+        date = date_dir.name[len("date="):]
+        if start is not None and date < pd.Timestamp(start).strftime("%Y-%m-%d"):
+            continue
+        if end is not None and date > pd.Timestamp(end).strftime("%Y-%m-%d"):
+            continue
+        files.extend(sorted(date_dir.glob("part-*.parquet")))
+    return files
+
+
+def archive_entities(root=ARCHIVE_DIR, start=None, end=None, batch_rows=100_000):
+    """{entity_id: (rows, first timestamp, last timestamp)} without loading the archive.
+
+    For the partitioned archive this only reads Parquet footers (row counts and
+    timestamp statistics); start/end clip the range. The legacy file is scanned
+    batch by batch.
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    info = {}
+    if has_partitioned_archive(root):
+        for entity_dir in sorted(Path(root).glob("entity_id=*")):
+            entity = entity_dir.name[len("entity_id="):]
+            rows, first, last = 0, None, None
+            for f in entity_files(entity, root, start, end):
+                meta = pq.ParquetFile(f).metadata
+                rows += meta.num_rows
+                for i in range(meta.num_row_groups):
+                    stats = meta.row_group(i).column(0).statistics  # column 0 = timestamp
+                    lo, hi = pd.Timestamp(stats.min), pd.Timestamp(stats.max)
+                    first = lo if first is None else min(first, lo)
+                    last = hi if last is None else max(last, hi)
+            if rows:
+                if start is not None:
+                    first = max(first, start)
+                if end is not None:
+                    last = min(last, end - pd.Timedelta(microseconds=1))
+                info[entity] = (rows, first, last)
+        return info
+
+    for batch in pq.ParquetFile(LEGACY_PATH).iter_batches(batch_size=batch_rows, columns=["timestamp", "entity_id"]):
+        df = batch.to_pandas()
+        if start is not None:
+            df = df[df["timestamp"] >= start]
+        if end is not None:
+            df = df[df["timestamp"] < end]
+        for entity, g in df.groupby("entity_id")["timestamp"]:
+            rows, first, last = info.get(entity, (0, g.min(), g.max()))
+            info[entity] = (rows + len(g), min(first, g.min()), max(last, g.max()))
+    return info
+
+
+def iter_entity_batches(entity, start=None, end=None, batch_rows=100_000, root=ARCHIVE_DIR):
+    """Yield (timestamps datetime64[us], values float64) of one entity in time order.
+
+    Reads at most batch_rows rows per Parquet row-group batch, so memory does not
+    grow with the length of the history.
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    if has_partitioned_archive(root):
+        sources = [(pq.ParquetFile(f), ["timestamp", "value_w"]) for f in entity_files(entity, root, start, end)]
+    else:
+        sources = [(pq.ParquetFile(LEGACY_PATH), ["timestamp", "entity_id", "value_w"])]
+
+    for pf, columns in sources:
+        for batch in pf.iter_batches(batch_size=batch_rows, columns=columns):
+            if "entity_id" in columns:
+                batch = batch.filter(pc.equal(batch.column("entity_id"), entity))
+            timestamps = batch.column("timestamp").to_numpy().astype("datetime64[us]")
+            values = batch.column("value_w").to_numpy(zero_copy_only=False).astype(np.float64)
+            keep = np.ones(len(timestamps), dtype=bool)
+            if start is not None:
+                keep &= timestamps >= start.to_datetime64()
+            if end is not None:
+                keep &= timestamps < end.to_datetime64()
+            if keep.any():
+                yield timestamps[keep], values[keep]
@@ -0,0 +1,152 @@
+# code/machine_learning/archive_schema.py
+# Table layouts of the raw MariaDB fuse archive.
+#
+# v1 (TABLE_NAME, as export_fuse_data.py has always created it):
+#   id BIGINT AUTO_INCREMENT, timestamp, entity_id VARCHAR(64), value_w
+#   + UNIQUE (timestamp, entity_id), INDEX (timestamp), INDEX (entity_id) → four B-trees per insert
+#
+# v2 (ARCHIVE_SCHEMA=v2, filled by migrate_archive_v2.py and then by export_fuse_data.py):
+#   <TABLE_NAME>_entities  entity_id SMALLINT UNSIGNED ↔ name VARCHAR(64), one row per fuse
+#   <TABLE_NAME>_v2        entity_id SMALLINT UNSIGNED, timestamp, value_w
+#                          PRIMARY KEY (entity_id, timestamp) is the clustered index, nothing else
+#                          PARTITION BY RANGE (TO_DAYS(timestamp)): one partition per month + pmax
+#   <TABLE_NAME>_v2_named  view with the v1 columns (timestamp, entity_id = name, value_w) for readers,
+#                          + entity_key (the SMALLINT id) to read in primary key order
+#
+# Rows of one fuse are stored in time order and an old month goes with
+# ALTER TABLE ... DROP PARTITION instead of a DELETE. There is no index on timestamp
+# alone: a time filter only skips the months outside it, and inside those months
+# every fuse's rows are read unless entity_id narrows them down too.
+#   • Full reads go in key order (ORDER BY entity_key, timestamp), export_full_archive.py
+#     does that; ORDER BY timestamp would sort the whole table first.
+#   • Per-fuse reads (entity_id = … AND timestamp > …, the gap scan's entity_id IN … with a
+#     time range) are one primary key range per fuse.
+#   • A time range over all fuses without entity_id scans its months completely.
+# The minutely table (EXPORT_RESOLUTION=minutely) keeps its own layout.
+import re
+from datetime import date, datetime
+
+from sqlalchemy import bindparam, text
+
+SCHEMAS = ("v1", "v2")
+MONTHS_AHEAD = 2  # empty monthly partitions kept ready, so inserts never land in pmax
+
+
+def v2_tables(table):
+    """Names of the v2 tables for the v1 table `table` → {"data", "entities", "view"}."""
+    return {"data": f"{table}_v2", "entities": f"{table}_entities", "view": f"{table}_v2_named"}
+
+
+# === Monthly partitions ===
+def month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def add_months(month, n):
+    for _ in range(n):
+        month = next_month(month)
+    return month
+
+
+def _partition(month):
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{next_month(month)}'))"
+
+
+def _months(first, last):
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = next_month(month)
+
+
+def monthly_partitions(conn, data_table):
+    """Existing monthly partitions of `data_table` → sorted month starts (pmax not included)."""
+    names = conn.execute(text("""
+        SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+    """), {"table": data_table}).scalars()
+    return sorted(date(int(m[1]), int(m[2]), 1) for m in (re.fullmatch(r"p(\d{4})(\d{2})", n) for n in names) if m)
+
+
+def ensure_partitions(conn, table, months_ahead=MONTHS_AHEAD):
+    """Split pmax so every month up to `months_ahead` from now has its own partition → number added."""
+    data = v2_tables(table)["data"]
+    existing = monthly_partitions(conn, data)
+    last = add_months(month_start(datetime.utcnow()), months_ahead)
+    new = list(_months(next_month(existing[-1]), last)) if existing else []
+    if new:
+        parts = ", ".join([_partition(m) for m in new] + ["PARTITION pmax VALUES LESS THAN MAXVALUE"])
+        conn.execute(text(f"ALTER TABLE {data} REORGANIZE PARTITION pmax INTO ({parts})"))
+    return len(new)
+
+
+def drop_partitions_before(conn, table, month):
+    """Drop the monthly partitions older than `month` (a date) → their names."""
+    data = v2_tables(table)["data"]
+    old = [f"p{m:%Y%m}" for m in monthly_partitions(conn, data) if m < month_start(month)]
+    if old:
+        conn.execute(text(f"ALTER TABLE {data} DROP PARTITION {', '.join(old)}"))
+    return old
+
+
+# === Tables ===
+def create_v2(conn, table, first_month=None, months_ahead=MONTHS_AHEAD):
+    """Create the v2 tables and view if missing; partitions from `first_month` (default: this month).
+
+    Rows older than the first partition still fit: the first partition takes everything below its bound.
+    """
+    names = v2_tables(table)
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {names['entities']} (
+            entity_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(64) NOT NULL,
+            CONSTRAINT uq_name UNIQUE (name)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+    """))
+    first = month_start(first_month or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), months_ahead)
+    parts = ",\n                ".join([_partition(m) for m in _months(first, max(first, last))]
+                                       + ["PARTITION pmax VALUES LESS THAN MAXVALUE"])
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {names['data']} (
+            entity_id SMALLINT UNSIGNED NOT NULL,
+            timestamp DATETIME(6) NOT NULL,
+            value_w DOUBLE NOT NULL,
+            PRIMARY KEY (entity_id, timestamp)
+        ) ENGINE=InnoDB
+        PARTITION BY RANGE (TO_DAYS(timestamp)) (
+                {parts}
+        );
+    """))
+    conn.execute(text(f"""
+        CREATE OR REPLACE VIEW {names['view']} AS
+        SELECT d.timestamp, e.name AS entity_id, d.value_w, d.entity_id AS entity_key
+        FROM {names['data']} d JOIN {names['entities']} e ON e.entity_id = d.entity_id
+    """))
+    ensure_partitions(conn, table, months_ahead)
+
+
+def entity_ids(conn, table, fuses):
+    """{fuse name: SMALLINT id}, registering fuses that are new.
+
+    Only missing names are inserted: a duplicate INSERT IGNORE would still use up an
+    AUTO_INCREMENT value, and SMALLINT has 65,535 of them.
+    """
+    entities = v2_tables(table)["entities"]
+    select = text(f"SELECT name, entity_id FROM {entities} WHERE name IN :fuses").bindparams(
+        bindparam("fuses", expanding=True))
+    ids = dict(conn.execute(select, {"fuses": list(fuses)}).all())
+    new = [f for f in fuses if f not in ids]
+    if new:
+        conn.execute(text(f"INSERT IGNORE INTO {entities} (name) VALUES (:name)"), [{"name": f} for f in new])
+        ids = dict(conn.execute(select, {"fuses": list(fuses)}).all())
+    return ids
+
+
+def to_v2_rows(batch, ids):
+    """(timestamp, entity_id name, value_w) frame → (entity_id id, timestamp, value_w) frame for the v2 table."""
+    return batch.assign(entity_id=batch["entity_id"].map(ids).astype("uint16"))[["entity_id", "timestamp", "value_w"]]
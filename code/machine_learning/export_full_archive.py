@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 # code/machine_learning/export_full_archive.py
 import pandas as pd
-import os, sys
-from sqlalchemy import create_engine
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os, sys, time
+from sqlalchemy import DateTime, Float, String, bindparam, create_engine, text
 from dotenv import load_dotenv
 from pathlib import Path
 
+from archive_dataset import (
+    ARCHIVE_DIR, DATA_DIR, LEGACY_PATH, append_partitions, begin_append, clear_refill, compact_partitions,
+    discard_unfinished, drop_archived, end_append, high_water, load_refill, load_state,
+)
+from archive_schema import SCHEMAS, v2_tables
+from perf_metrics import StageMetrics
+
 project_root = Path(__file__).parent.parent.parent
 env_path = project_root / "env" / ".env"
 load_dotenv(dotenv_path=env_path)
@@ -15,27 +24,256 @@ DB_PASS = os.getenv("MARIADB_PASSWORD")
 DB_HOST = os.getenv("MARIADB_HOST", "192.168.188.74")
 DB_PORT = os.getenv("MARIADB_PORT", "3306")
 DB_NAME = os.getenv("MARIADB_DATABASE", "homeassistant")
+TABLE_NAME = os.getenv("TABLE_NAME", "energy_fuse_archive")
+# raw: every sample from TABLE_NAME; minutely: per-minute means from the EXPORT_RESOLUTION=minutely table
+ARCHIVE_SOURCE = os.getenv("ARCHIVE_SOURCE", "raw")
+# v2: raw rows from the view over <TABLE_NAME>_v2 (see archive_schema.py), read in primary key order
+ARCHIVE_SCHEMA = os.getenv("ARCHIVE_SCHEMA", "v1")
+SOURCE_COLUMNS, ORDER_BY = "timestamp, entity_id, value_w", "timestamp"
+if ARCHIVE_SOURCE == "minutely":
+    SOURCE_TABLE = os.getenv("MINUTELY_TABLE", f"{TABLE_NAME}_minutely")
+elif ARCHIVE_SCHEMA == "v2":
+    SOURCE_TABLE = v2_tables(TABLE_NAME)["view"]
+    # No timestamp index in v2: ORDER BY timestamp would sort the whole table
+    SOURCE_COLUMNS, ORDER_BY = SOURCE_COLUMNS + ", entity_key", "entity_key, timestamp"
+else:
+    SOURCE_TABLE = TABLE_NAME
 
-if not DB_USER or not DB_PASS:
-    print("ERROR: Missing credentials")
-    sys.exit(1)
+# partitioned: append new rows to data/energy_fuse_archive/entity_id=/date= (default)
+# stream:      rewrite data/energy_fuse_archive.parquet from the full table in bounded memory
+# single:      rewrite data/energy_fuse_archive.parquet via one pandas DataFrame (legacy)
+ARCHIVE_MODE = os.getenv("ARCHIVE_MODE", "partitioned")
+COMPACT_MIN_FILES = int(os.getenv("ARCHIVE_COMPACT_MIN_FILES", "8"))
 
-DB_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Streaming reads (partitioned + stream modes)
+BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "100000"))          # rows fetched per server-side cursor batch
+ROW_GROUP_SIZE = int(os.getenv("ARCHIVE_ROW_GROUP_SIZE", "500000"))  # rows per Parquet row group (stream mode)
+COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "snappy")
 
-data_dir = project_root / "data"
-data_dir.mkdir(exist_ok=True)
-output_path = data_dir / "energy_fuse_archive.parquet"
+# Any SQLAlchemy URL with the same table instead of MariaDB, e.g. the SQLite stand-in of the benchmarks
+ARCHIVE_DB_URL = os.getenv("ARCHIVE_DB_URL")
+DB_URL = ARCHIVE_DB_URL or f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-print(f"Exporting → {output_path}")
+data_dir = DATA_DIR
 
-engine = create_engine(DB_URL)
-df = pd.read_sql(
-    "SELECT timestamp, entity_id, value_w FROM energy_fuse_archive ORDER BY timestamp",
-    engine,
-    parse_dates=['timestamp']
+# Same layout pandas writes for a timestamp-indexed frame, so pd.read_parquet() keeps working
+STREAM_SCHEMA = pa.schema(
+    [("entity_id", pa.string()), ("value_w", pa.float64()), ("timestamp", pa.timestamp("us"))],
+    metadata=pa.Schema.from_pandas(pd.DataFrame(
+        {"entity_id": pd.Series(dtype=object), "value_w": pd.Series(dtype="float64")},
+        index=pd.DatetimeIndex([], name="timestamp", dtype="datetime64[us]"),
+    )).metadata,
 )
 
-# Set timestamp as index and save
-df = df.set_index('timestamp')
-df.to_parquet(output_path)  # index=True by default
-print(f"Exported {len(df):,} rows with timestamp as index")
+
+def archive_query(conditions=("",)):
+    """SELECT of the archive table, one UNION ALL branch per WHERE condition ("" = all rows).
+
+    Typed columns so drivers without native DATETIME (SQLite) return datetimes too.
+    The first three columns are always timestamp, entity_id, value_w.
+    """
+    branches = [f"SELECT {SOURCE_COLUMNS} FROM {SOURCE_TABLE}" + (f" WHERE {c}" if c else "")
+                for c in conditions]
+    return text(" UNION ALL ".join(branches) + f" ORDER BY {ORDER_BY}").columns(
+        timestamp=DateTime, entity_id=String, value_w=Float)
+
+
+def incremental_query(marks):
+    """Rows after each fuse's own high-water mark, plus every row of fuses without one.
+
+    One branch per fuse, so a fuse that stopped reporting long ago does not pull
+    the history of all others back in.
+    """
+    conditions, params = [], {}
+    for i, (fuse, mark) in enumerate(sorted(marks.items())):
+        conditions.append(f"entity_id = :fuse_{i} AND timestamp > :mark_{i}")
+        params.update({f"fuse_{i}": fuse, f"mark_{i}": mark.to_pydatetime()})
+    conditions.append("entity_id NOT IN :marked")
+    params["marked"] = sorted(marks)
+    query = archive_query(conditions).bindparams(
+        bindparam("marked", expanding=True), *(bindparam(f"mark_{i}", type_=DateTime) for i in range(len(marks))))
+    return query, params
+
+
+def refill_query(refill, marks):
+    """Rows of the refill ranges up to each fuse's high-water mark (later rows come with incremental_query)."""
+    conditions, params = [], {}
+    ranges = [(fuse, a, b) for fuse in sorted(refill) for a, b in refill[fuse]]
+    for i, (fuse, a, b) in enumerate(ranges):
+        conditions.append(f"entity_id = :fuse_{i} AND timestamp >= :from_{i} AND timestamp < :to_{i} "
+                          f"AND timestamp <= :mark_{i}")
+        params.update({f"fuse_{i}": fuse, f"from_{i}": a.to_pydatetime(), f"to_{i}": b.to_pydatetime(),
+                       f"mark_{i}": marks[fuse].to_pydatetime()})
+    query = archive_query(conditions).bindparams(
+        *(bindparam(f"{k}_{i}", type_=DateTime) for i in range(len(ranges)) for k in ("from", "to", "mark")))
+    return query, params
+
+
+def stream_batches(engine, query, params=None):
+    """Yield Arrow record batches of at most BATCH_ROWS rows from an unbuffered server-side cursor."""
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=BATCH_ROWS).execute(query, params or {})
+        partitions = result.partitions(BATCH_ROWS)
+        n = 0
+        while True:
+            t0 = time.perf_counter()  # includes waiting on the server
+            rows = next(partitions, None)
+            if rows is None:
+                return
+            n += 1
+            timestamps, entities, values = list(zip(*rows))[:3]
+            batch = pa.record_batch([
+                pa.array(entities, type=pa.string()),
+                pa.array(values, type=pa.float64()),
+                pa.array(timestamps, type=pa.timestamp("us")),
+            ], schema=STREAM_SCHEMA)
+            yield n, batch, time.perf_counter() - t0
+
+
+def log_batch(n, rows, seconds, total):
+    print(f"  Batch {n}: {rows:,} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/s, total {total:,})")
+
+
+def export_single(engine, metrics):
+    output_path = LEGACY_PATH
+    print(f"Exporting → {output_path}")
+    with metrics.step("mariadb_fetch") as step:
+        df = pd.read_sql(
+            f"SELECT {SOURCE_COLUMNS} FROM {SOURCE_TABLE} ORDER BY {ORDER_BY}",
+            engine,
+            parse_dates=['timestamp']
+        )
+        step.rows = len(df)
+
+    # Set timestamp as index and save
+    df = df[["timestamp", "entity_id", "value_w"]].set_index('timestamp')
+    with metrics.step("parquet_write", rows=len(df)):
+        df.to_parquet(output_path)  # index=True by default
+    print(f"Exported {len(df):,} rows with timestamp as index")
+    return len(df)
+
+
+def export_stream(engine, metrics):
+    output_path = LEGACY_PATH
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+    print(f"Streaming → {output_path} (batches of {BATCH_ROWS:,}, row groups of {ROW_GROUP_SIZE:,}, {COMPRESSION})")
+
+    total = 0
+    pending, pending_rows = [], 0
+    query = archive_query()
+    with pq.ParquetWriter(tmp_path, STREAM_SCHEMA, compression=COMPRESSION) as writer:
+        for n, batch, fetch_s in stream_batches(engine, query):
+            metrics.record("mariadb_fetch", fetch_s, batch.num_rows)
+            t0 = time.perf_counter()
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= ROW_GROUP_SIZE:
+                with metrics.step("parquet_write", rows=pending_rows):
+                    writer.write_table(pa.Table.from_batches(pending), row_group_size=ROW_GROUP_SIZE)
+                pending, pending_rows = [], 0
+            total += batch.num_rows
+            log_batch(n, batch.num_rows, fetch_s + time.perf_counter() - t0, total)
+        if pending:
+            with metrics.step("parquet_write", rows=pending_rows):
+                writer.write_table(pa.Table.from_batches(pending), row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, output_path)
+    print(f"Exported {total:,} rows with timestamp as index")
+    return total
+
+
+def export_partitioned(engine, metrics):
+    """Incremental append to the partitioned archive."""
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"Exporting → {ARCHIVE_DIR}/ (entity_id=/date= partitions, batches of {BATCH_ROWS:,})")
+
+    state = load_state()
+    discarded = discard_unfinished(state)
+    if discarded:
+        print(f"Removed {discarded} file(s) of an interrupted append (their rows are fetched again)")
+    marks = high_water(state)
+    if marks:
+        print(f"High-water marks for {len(marks)} fuses (oldest {min(marks.values())}) "
+              f"→ fetching each fuse's rows after its own mark")
+        query, params = incremental_query(marks)
+    else:
+        print("No high-water mark → exporting the full table once")
+        query = archive_query()
+        params = {}
+
+    written = 0
+    fuses_written = set()
+    # Ranges export_fuse_data.py filled in behind the marks (EXPORT_PLAN=gaps): read them again,
+    # without the rows the archive already holds. Fuses without a mark are read in full below.
+    refill = {fuse: ranges for fuse, ranges in load_refill().items() if fuse in marks}
+    if refill:
+        print(f"Refill: {sum(len(r) for r in refill.values())} range(s) in {len(refill)} fuse(s) "
+              f"filled in behind the marks → reading them again")
+        refill_q, refill_params = refill_query(refill, marks)
+        for n, batch, fetch_s in stream_batches(engine, refill_q, refill_params):
+            metrics.record("mariadb_fetch", fetch_s, batch.num_rows)
+            t0 = time.perf_counter()
+            with metrics.step("parquet_refill", rows=batch.num_rows):
+                df = drop_archived(batch.to_pandas().reset_index())
+                token = begin_append(state)
+                appended = append_partitions(df, compression=COMPRESSION, token=token)
+                end_append(state)
+            written += appended
+            fuses_written.update(df["entity_id"].unique())
+            print(f"  Refill batch {n}: {batch.num_rows:,} rows, {appended:,} not yet archived "
+                  f"in {fetch_s + time.perf_counter() - t0:.2f}s")
+    clear_refill()  # also when every listed fuse is read in full
+
+    for n, batch, fetch_s in stream_batches(engine, query, params):
+        metrics.record("mariadb_fetch", fetch_s, batch.num_rows)
+        t0 = time.perf_counter()
+        df = batch.to_pandas().reset_index()
+
+        with metrics.step("parquet_append", rows=len(df)):
+            token = begin_append(state)
+            appended = append_partitions(df, compression=COMPRESSION, token=token)
+        newest = df.groupby("entity_id")["timestamp"].max()
+        for fuse, ts in newest.items():
+            state["high_water"][fuse] = ts.isoformat()
+        end_append(state)  # marks and the end of this append in one write, so a crash never appends twice
+        written += appended
+        fuses_written.update(newest.index)
+        log_batch(n, batch.num_rows, fetch_s + time.perf_counter() - t0, written)
+
+    print(f"Appended {written:,} new rows across {len(fuses_written)} fuses")
+
+    with metrics.step("compact"):
+        compacted = compact_partitions(min_files=COMPACT_MIN_FILES)
+    if compacted:
+        print(f"Compacted {compacted} partition(s) with ≥{COMPACT_MIN_FILES} files")
+    return written
+
+
+def main():
+    if not ARCHIVE_DB_URL and (not DB_USER or not DB_PASS):
+        print("ERROR: Missing credentials")
+        return 1
+    if ARCHIVE_SOURCE not in ("raw", "minutely"):
+        print(f"ERROR: ARCHIVE_SOURCE must be 'raw' or 'minutely', got '{ARCHIVE_SOURCE}'")
+        return 1
+    if ARCHIVE_SCHEMA not in SCHEMAS:
+        print(f"ERROR: ARCHIVE_SCHEMA must be one of {', '.join(SCHEMAS)}, got '{ARCHIVE_SCHEMA}'")
+        return 1
+    if ARCHIVE_MODE not in ("partitioned", "stream", "single"):
+        print(f"ERROR: ARCHIVE_MODE must be 'partitioned', 'stream' or 'single', got '{ARCHIVE_MODE}'")
+        return 1
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(DB_URL)
+    metrics = StageMetrics("archive")
+    print(f"Source: `{SOURCE_TABLE}` ({ARCHIVE_SOURCE}, {ARCHIVE_SCHEMA})")
+    export = {"single": export_single, "stream": export_stream, "partitioned": export_partitioned}[ARCHIVE_MODE]
+    try:
+        rows = export(engine, metrics)
+    finally:
+        engine.dispose()
+    metrics.close(rows=rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
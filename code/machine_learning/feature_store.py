@@ -0,0 +1,288 @@
+# code/machine_learning/feature_store.py
+# Lag / rolling / calendar features for every fuse, computed in one vectorized pass
+# over the fuse matrix and shared by training and forecasting.
+#
+# data/cache/features/<key>/
+#   calendar.npy  float32 [minutes, 3]                minute, hour, dayofweek
+#   lagged.npy    float32 [minutes, fuses, lags + 1]  lag_<n>..., rolling_mean_<window>
+#   meta.json     spec, first minute, fuses, rows, prefix hash of the source matrix
+#
+# The key covers the fuse matrix fingerprint and the feature spec. When the matrix
+# only gained new minutes, the features of the previous cache are copied and just
+# the new rows are computed.
+#
+# stream_features() builds the same features from raw Parquet batches of one fuse
+# without the fuse matrix, for training on archives larger than memory.
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from archive_dataset import DATA_DIR
+
+CACHE_DIR = DATA_DIR / "cache" / "features"
+KEEP_CACHES = 3
+
+CALENDAR_COLUMNS = ["minute", "hour", "dayofweek"]
+BASE_LAGS = (1, 5, 15)
+MAX_LAG = 60
+ROLLING_WINDOW = 30
+
+
+def feature_spec(rows):
+    """Lags and rolling window for a series of `rows` minutes.
+
+    Adaptive lags: the longest lag is capped at a quarter of the data, as before.
+    A lag equal to one of the base lags is not repeated.
+    """
+    max_lag = min(MAX_LAG, rows // 4)
+    lags = list(dict.fromkeys([*BASE_LAGS, max_lag]))
+    return {"lags": lags, "window": ROLLING_WINDOW}
+
+
+def feature_columns(spec):
+    return CALENDAR_COLUMNS + [f"lag_{lag}" for lag in spec["lags"]] + [f"rolling_mean_{spec['window']}"]
+
+
+def calendar_features(index):
+    """DatetimeIndex → float32 [rows, 3] of minute, hour, dayofweek."""
+    return np.column_stack([index.minute, index.hour, index.dayofweek]).astype(np.float32)
+
+
+def lagged_features(values, lags, window):
+    """values [rows, fuses] → float32 [rows, fuses, len(lags) + 1].
+
+    lag_n[t] = values[t - n] (NaN for t < n); the rolling mean uses min_periods=1
+    like pandas' rolling(window, min_periods=1).mean(), via a cumulative sum.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rows, fuses = values.shape
+    out = np.full((rows, fuses, len(lags) + 1), np.nan, dtype=np.float32)
+    for i, lag in enumerate(lags):
+        if lag < rows:
+            out[lag:, :, i] = values[:rows - lag]
+
+    csum = np.cumsum(values, axis=0)
+    sums = csum.copy()
+    sums[window:] -= csum[:-window]
+    counts = np.minimum(np.arange(1, rows + 1), window)[:, None]
+    out[:, :, -1] = sums / counts
+    return out
+
+
+def spec_from_columns(columns):
+    """Inverse of feature_columns(), e.g. for the feature names stored in a booster."""
+    lags = [int(c[len("lag_"):]) for c in columns if c.startswith("lag_")]
+    window = next(int(c[len("rolling_mean_"):]) for c in columns if c.startswith("rolling_mean_"))
+    return {"lags": lags, "window": window}
+
+
+def step_features(buffer, row, timestamp, spec):
+    """Feature rows [fuses, columns] for one minute of a [minutes, fuses] buffer.
+
+    Same definitions as calendar_features() + lagged_features(), for forecasting
+    one step at a time: buffer[row] must already hold a value for the minute itself
+    (it enters the rolling mean).
+    """
+    n_fuses = buffer.shape[1]
+    calendar = np.array([timestamp.minute, timestamp.hour, timestamp.dayofweek], dtype=np.float32)
+    lags = [buffer[row - lag] for lag in spec["lags"]]
+    rolling = buffer[max(0, row - spec["window"] + 1):row + 1].mean(axis=0)
+    return np.column_stack([np.broadcast_to(calendar, (n_fuses, 3)), *lags, rolling]).astype(np.float32)
+
+
+def _minute_means(timestamps, values):
+    """Sorted raw points → (minutes, sums, counts) per distinct minute."""
+    order = np.argsort(timestamps, kind="stable")
+    minutes = timestamps[order].astype("datetime64[m]")
+    values = values[order]
+    uniq, first = np.unique(minutes, return_index=True)
+    sums = np.add.reduceat(values, first) if len(values) else np.empty(0)
+    counts = np.diff(np.append(first, len(values)))
+    return uniq, sums, counts
+
+
+def stream_features(batches, spec):
+    """Raw (timestamps, values) batches of one fuse → (row, index, X, y) chunks.
+
+    Minute means, forward-filled gaps and the lag/rolling/calendar features match
+    the fuse matrix + lagged_features() path; only the last `context` minutes and
+    the still-open minute are carried from one batch to the next. `row` counts
+    feature rows from the fuse's first usable minute (rows with NaN lags are left
+    out), index is the DatetimeIndex of the chunk, X float32 [n, columns], y float32 [n].
+    """
+    lags, window = spec["lags"], spec["window"]
+    first_row = max(lags)
+    context = max(first_row, window - 1)
+
+    tail = np.empty(0)    # last `context` minute values already emitted
+    next_minute = None    # first minute not emitted yet
+    emitted = 0           # minutes emitted so far
+    pending = None        # (minute, sum, count) of the last minute seen, may continue in the next batch
+
+    def emit(minutes, sums, counts):
+        nonlocal tail, next_minute, emitted
+        if next_minute is None:
+            next_minute = minutes[0]
+        keep = minutes >= next_minute  # late points of an already emitted minute are dropped
+        minutes, sums, counts = minutes[keep], sums[keep], counts[keep]
+        if not len(minutes):
+            return None
+        offsets = (minutes - next_minute).astype(np.int64)
+        n = int(offsets[-1]) + 1
+        # Minute means stored as float32 like the fuse matrix, gaps forward-filled
+        means = np.full(n, np.nan)
+        means[offsets] = (sums / counts).astype(np.float32)
+        last = np.where(~np.isnan(means), np.arange(n), -1)
+        np.maximum.accumulate(last, out=last)
+        filled = np.where(last >= 0, means[np.maximum(last, 0)], tail[-1] if len(tail) else np.nan)
+
+        series = np.concatenate([tail, filled])
+        lagged = lagged_features(series[:, None], lags, window)[len(tail):, 0]
+        index = pd.date_range(pd.Timestamp(next_minute), periods=n, freq="min")
+        X = np.concatenate([calendar_features(index), lagged], axis=1)
+
+        skip = max(0, first_row - emitted)
+        row = max(0, emitted - first_row)
+        chunk = (row, index[skip:], X[skip:], filled[skip:].astype(np.float32))
+        tail = series[-context:]
+        next_minute = next_minute + np.timedelta64(n, "m")
+        emitted += n
+        return chunk if skip < n else None
+
+    for timestamps, values in batches:
+        if not len(timestamps):
+            continue
+        minutes, sums, counts = _minute_means(timestamps, values)
+        if pending is not None:
+            if pending[0] == minutes[0]:
+                sums[0] += pending[1]
+                counts[0] += pending[2]
+            else:
+                minutes = np.concatenate([[pending[0]], minutes])
+                sums = np.concatenate([[pending[1]], sums])
+                counts = np.concatenate([[pending[2]], counts])
+        pending = (minutes[-1], sums[-1], counts[-1])
+        if len(minutes) > 1:
+            chunk = emit(minutes[:-1], sums[:-1], counts[:-1])
+            if chunk is not None:
+                yield chunk
+    if pending is not None:
+        chunk = emit(np.array([pending[0]]), np.array([pending[1]]), np.array([pending[2]]))
+        if chunk is not None:
+            yield chunk
+
+
+class FeatureSet:
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / "meta.json").read_text())
+        self.key = meta["key"]
+        self.spec = meta["spec"]
+        self.fuses = meta["fuses"]
+        self.start = pd.Timestamp(meta["start"])
+        self.columns = feature_columns(self.spec)
+        self.first_row = max(self.spec["lags"])  # rows before have NaN lags
+        self.calendar = np.load(self.path / "calendar.npy", mmap_mode="r")
+        self.lagged = np.load(self.path / "lagged.npy", mmap_mode="r")
+
+    def __len__(self):
+        return self.lagged.shape[0]
+
+    def frame(self, fuse, start=None, stop=None):
+        """Feature rows [start, stop) of one fuse, columns in feature_columns() order."""
+        start = self.first_row if start is None else start
+        j = self.fuses.index(fuse)
+        X = np.concatenate([self.calendar[start:stop], self.lagged[start:stop, j]], axis=1)
+        return pd.DataFrame(X, columns=self.columns)
+
+
+def _prefix_hash(values, rows):
+    return hashlib.sha256(np.ascontiguousarray(values[:rows]).tobytes()).hexdigest()
+
+
+def _find_extendable(matrix, spec):
+    """A cached FeatureSet whose source matrix is a prefix of `matrix`, or None."""
+    if not CACHE_DIR.exists():
+        return None
+    for path in sorted(CACHE_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True):
+        meta_path = path / "meta.json"
+        if path.name.startswith(".") or not meta_path.exists():
+            continue
+        meta = json.loads(meta_path.read_text())
+        if (meta["spec"] != spec or meta["fuses"] != matrix.fuses
+                or meta["start"] != matrix.start.isoformat() or not 1 < meta["rows"] < len(matrix)):
+            continue
+        # The last cached minute may have been only partly filled, it is recomputed
+        if _prefix_hash(matrix.values, meta["rows"] - 1) == meta["prefix_hash"]:
+            return FeatureSet(path)
+    return None
+
+
+def _save(path, key, spec, matrix, calendar, lagged_rows):
+    # Per-process temp dir: stages running side by side may build the same features
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "calendar.npy", calendar)
+    lagged = np.lib.format.open_memmap(
+        tmp / "lagged.npy", mode="w+", dtype=np.float32,
+        shape=(len(matrix), len(matrix.fuses), len(spec["lags"]) + 1),
+    )
+    for start, block in lagged_rows:
+        lagged[start:start + len(block)] = block
+    lagged.flush()
+    del lagged
+    (tmp / "meta.json").write_text(json.dumps({
+        "key": key,
+        "spec": spec,
+        "start": matrix.start.isoformat(),
+        "fuses": matrix.fuses,
+        "rows": len(matrix),
+        "prefix_hash": _prefix_hash(matrix.values, len(matrix) - 1),
+    }, indent=2))
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        if not (path / "meta.json").exists():
+            raise
+        shutil.rmtree(tmp, ignore_errors=True)  # another process saved the same features first
+
+
+def _prune():
+    caches = sorted((p for p in CACHE_DIR.iterdir() if p.is_dir() and not p.name.startswith(".")),
+                    key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in caches[KEEP_CACHES:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def load_features(matrix):
+    """Return the cached FeatureSet for a FuseMatrix, computing (or extending) it on a miss."""
+    spec = feature_spec(len(matrix))
+    key = hashlib.sha256(f"{matrix.fingerprint}|{json.dumps(spec)}".encode()).hexdigest()[:16]
+    path = CACHE_DIR / key
+    if (path / "meta.json").exists():
+        print(f"Feature cache hit → {path}")
+        return FeatureSet(path)
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    calendar = calendar_features(matrix.index)
+    previous = _find_extendable(matrix, spec)
+    if previous is not None:
+        # Rows from the last cached minute on; earlier rows only need `context` minutes of history
+        r0 = len(previous) - 1
+        context = max(max(spec["lags"]), spec["window"] - 1)
+        lo = max(0, r0 - context)
+        new_rows = lagged_features(matrix.values[lo:], spec["lags"], spec["window"])[r0 - lo:]
+        print(f"Feature cache extend → {path} (+{len(matrix) - r0:,} minutes on top of {previous.path.name})")
+        _save(path, key, spec, matrix, calendar, [(0, previous.lagged[:r0]), (r0, new_rows)])
+    else:
+        print(f"Feature cache miss → building {path}")
+        _save(path, key, spec, matrix, calendar,
+              [(0, lagged_features(matrix.values, spec["lags"], spec["window"]))])
+    _prune()
+    return FeatureSet(path)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# code/machine_learning/forecast_engine.py
+# Multi-step minutely forecasts for all fuses from the saved per-fuse boosters.
+#
+# One-shot (e.g. from cron every minute):
+#   python forecast_engine.py                    → results/forecast_latest.csv
+# Resident HTTP endpoint (models stay loaded between calls):
+#   FORECAST_PORT=8050 python forecast_engine.py
+#   curl 'http://localhost:8050/forecast?horizon=60'
+#
+# Importable:
+#   engine = ForecastEngine()
+#   forecast, timings = engine.forecast(load_matrix(), horizon=60)
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from archive_dataset import MODELS_DIR, RESULTS_DIR, env_filters
+from feature_store import spec_from_columns, step_features
+from fuse_matrix import load_matrix
+from perf_metrics import StageMetrics
+
+# === Paths ===
+models_dir = MODELS_DIR / "per_fuse"
+output_path = RESULTS_DIR / "forecast_latest.csv"
+
+HORIZON = int(os.getenv("FORECAST_HORIZON", "60"))   # minutes ahead
+PORT = int(os.getenv("FORECAST_PORT", "0"))          # 0 = one-shot, write CSV and exit
+HOST = os.getenv("FORECAST_HOST", "127.0.0.1")
+
+
+class ForecastEngine:
+    """Keeps every per-fuse booster in memory and forecasts all fuses together.
+
+    Forecasts are recursive: each predicted minute is written into the history
+    buffer and feeds the lag/rolling features of the next step. While a minute is
+    being predicted, its own slot holds the previous value (persistence), since
+    the rolling mean includes the current minute.
+    """
+
+    def __init__(self, models_dir=models_dir, n_threads=1):
+        self.models_dir = Path(models_dir)
+        self.n_threads = n_threads
+        self.boosters = {}
+        self.specs = {}
+        self._mtimes = {}
+        self.load_seconds = self.refresh()
+
+    def _model_files(self):
+        return {p.stem[len("xgboost_"):]: p for p in sorted(self.models_dir.glob("xgboost_*.json"))
+                if not p.name.endswith(".meta.json")}
+
+    def refresh(self):
+        """(Re)load boosters whose file changed since the last load; returns seconds spent."""
+        t0 = time.perf_counter()
+        files = self._model_files()
+        for fuse in set(self.boosters) - set(files):
+            del self.boosters[fuse], self.specs[fuse], self._mtimes[fuse]
+        for fuse, path in files.items():
+            mtime = path.stat().st_mtime_ns
+            if self._mtimes.get(fuse) == mtime:
+                continue
+            booster = xgb.Booster()
+            booster.load_model(path)
+            booster.set_param({"nthread": self.n_threads})
+            self.boosters[fuse] = booster
+            self.specs[fuse] = spec_from_columns(booster.feature_names)
+            self._mtimes[fuse] = mtime
+        return time.perf_counter() - t0
+
+    @property
+    def fuses(self):
+        return sorted(self.boosters)
+
+    def forecast(self, matrix, horizon=HORIZON, fuses=None):
+        """Forecast `horizon` minutes after the last minute of a FuseMatrix.
+
+        Returns (DataFrame [minutes × fuses] in W, timings dict in ms).
+        """
+        t0 = time.perf_counter()
+        fuses = [f for f in (fuses or self.fuses) if f in self.boosters and f in matrix.fuses]
+        if not fuses:
+            raise ValueError("No fuse has both a trained model and data in the fuse matrix")
+
+        # History: just enough minutes for the longest lag / rolling window
+        context = max(max(max(s["lags"]), s["window"]) for s in (self.specs[f] for f in fuses))
+        if len(matrix) < context:
+            raise ValueError(f"Need at least {context} minutes of history, the fuse matrix has {len(matrix)}")
+        cols = [matrix.column(f) for f in fuses]
+        buffer = np.empty((context + horizon, len(fuses)), dtype=np.float64)
+        buffer[:context] = matrix.values[-context:, cols]
+        index = pd.date_range(matrix.index[-1] + pd.Timedelta(minutes=1), periods=horizon, freq="min")
+
+        # Fuses sharing a feature spec get their features built in one batch
+        groups = {}
+        for i, fuse in enumerate(fuses):
+            groups.setdefault(json.dumps(self.specs[fuse], sort_keys=True), []).append(i)
+        t1 = time.perf_counter()
+
+        for step, timestamp in enumerate(index):
+            row = context + step
+            buffer[row] = buffer[row - 1]  # persistence placeholder for the rolling mean
+            for members in groups.values():
+                spec = self.specs[fuses[members[0]]]
+                X = step_features(buffer[:, members], row, timestamp, spec)
+                for k, i in enumerate(members):
+                    buffer[row, i] = self.boosters[fuses[i]].inplace_predict(X[k:k + 1])[0]
+        t2 = time.perf_counter()
+
+        forecast = pd.DataFrame(buffer[context:], index=index, columns=fuses)
+        forecast.index.name = "timestamp"
+        timings = {
+            "history_ms": (t1 - t0) * 1000,
+            "predict_ms": (t2 - t1) * 1000,
+            "total_ms": (t2 - t0) * 1000,
+        }
+        return forecast, timings
+
+
+def run_once(engine, filters, matrix_loader=load_matrix):
+    t0 = time.perf_counter()
+    matrix = matrix_loader(start=filters["start"], end=filters["end"])
+    matrix_ms = (time.perf_counter() - t0) * 1000
+    forecast, timings = engine.forecast(matrix, horizon=HORIZON, fuses=filters["entities"])
+    return forecast, {"matrix_ms": matrix_ms, **timings}
+
+
+def serve(engine, filters):
+    lock = Lock()  # one forecast at a time; boosters are shared
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                return self._reply(200, {"status": "ok", "models": len(engine.boosters)})
+            if url.path != "/forecast":
+                return self._reply(404, {"error": f"unknown path {url.path}"})
+
+            query = parse_qs(url.query)
+            try:
+                horizon = int(query.get("horizon", [HORIZON])[0])
+                fuses = query["fuse"] if "fuse" in query else filters["entities"]
+                with lock:
+                    reload_s = engine.refresh()
+                    t0 = time.perf_counter()
+                    matrix = load_matrix(start=filters["start"], end=filters["end"])
+                    matrix_ms = (time.perf_counter() - t0) * 1000
+                    forecast, timings = engine.forecast(matrix, horizon=horizon, fuses=fuses)
+            except ValueError as e:
+                return self._reply(400, {"error": str(e)})
+
+            timings = {"reload_ms": reload_s * 1000, "matrix_ms": matrix_ms, **timings}
+            print(f"  → /forecast horizon={horizon} fuses={forecast.shape[1]} | "
+                  + " | ".join(f"{k}: {v:.1f}" for k, v in timings.items()))
+            self._reply(200, {
+                "start": forecast.index[0].isoformat(),
+                "horizon": horizon,
+                "timings_ms": timings,
+                "forecast": {fuse: forecast[fuse].round(1).tolist() for fuse in forecast.columns},
+            })
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # one line per forecast is printed above
+
+    server = ThreadingHTTPServer((HOST, PORT), Handler)
+    print(f"Serving forecasts on http://{HOST}:{PORT}/forecast?horizon={HORIZON}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(matrix_loader=load_matrix):
+    metrics = StageMetrics("forecast")
+    engine = ForecastEngine()
+    metrics.record("model_load", engine.load_seconds, len(engine.boosters))
+    print(f"Loaded {len(engine.boosters)} models in {engine.load_seconds * 1000:.0f} ms")
+    if not engine.boosters:
+        print("No models in models/per_fuse/ → run per_fuse_minutely_forecast_xgboost.py first")
+        return 1
+
+    filters = env_filters()
+    if PORT:
+        serve(engine, filters)
+        return 0
+
+    forecast, timings = run_once(engine, filters, matrix_loader)
+    metrics.record("matrix_load", timings["matrix_ms"] / 1000)
+    metrics.record("predict", timings["total_ms"] / 1000, forecast.size)
+    print(f"Forecast {forecast.shape[1]} fuses × {len(forecast)} minutes "
+          f"({forecast.index[0]} → {forecast.index[-1]})")
+    print("Latency: " + " | ".join(f"{k}: {v:.1f}" for k, v in timings.items()))
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    forecast.round(1).to_csv(output_path)
+    print(f"Forecast → {output_path}")
+    metrics.close(rows=forecast.size)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
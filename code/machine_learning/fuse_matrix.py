@@ -0,0 +1,148 @@
+# code/machine_learning/fuse_matrix.py
+# Dense minute-aligned time × fuse matrix shared by the ML stages.
+#
+# data/cache/fuse_matrix/<fingerprint>/
+#   values.npy  float32 [minutes, fuses]  per-minute mean, gaps forward-filled (leading gaps back-filled)
+#   valid.npy   bool    [minutes, fuses]  True where the fuse reported in that minute
+#   meta.json   first minute, fuse names, raw sample counts
+#
+# The fingerprint covers the archive files (path, size, mtime) and the date range,
+# so the matrix is rebuilt only when the archive changed. Arrays are opened with
+# np.load(mmap_mode="r"), i.e. without copying them into memory.
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from archive_dataset import ARCHIVE_DIR, DATA_DIR, LEGACY_PATH, has_partitioned_archive, read_archive
+
+CACHE_DIR = DATA_DIR / "cache" / "fuse_matrix"
+KEEP_CACHES = 3
+
+
+class FuseMatrix:
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / "meta.json").read_text())
+        self.fingerprint = meta["fingerprint"]
+        self.fuses = meta["fuses"]
+        self.samples = meta["samples"]  # raw points per fuse
+        self.start = pd.Timestamp(meta["start"])
+        self.values = np.load(self.path / "values.npy", mmap_mode="r")
+        self.valid = np.load(self.path / "valid.npy", mmap_mode="r")
+        self.index = pd.date_range(self.start, periods=self.values.shape[0], freq="min")
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def column(self, fuse):
+        return self.fuses.index(fuse)
+
+
+def source_fingerprint(start=None, end=None):
+    if has_partitioned_archive():
+        files = sorted(ARCHIVE_DIR.glob("entity_id=*/date=*/*.parquet"))
+    else:
+        files = [LEGACY_PATH]
+    h = hashlib.sha256(f"{start}|{end}".encode())
+    for f in files:
+        st = f.stat()
+        h.update(f"{f.relative_to(DATA_DIR)}|{st.st_size}|{st.st_mtime_ns}".encode())  # also when DATA_DIR is absolute
+    return h.hexdigest()[:16]
+
+
+def build_matrix(df):
+    """Raw (timestamp index, entity_id, value_w) rows → (start, fuses, values, valid, samples)."""
+    fuses = sorted(df["entity_id"].unique())
+    minutes = df.index.to_numpy(dtype="datetime64[m]")
+    start = minutes.min()
+    n_rows = int((minutes.max() - start).astype(np.int64)) + 1
+    n_fuses = len(fuses)
+
+    rows = (minutes - start).astype(np.int64)
+    cols = pd.Categorical(df["entity_id"], categories=fuses).codes.astype(np.int64)
+    flat = rows * n_fuses + cols
+    counts = np.bincount(flat, minlength=n_rows * n_fuses).reshape(n_rows, n_fuses)
+    sums = np.bincount(flat, weights=df["value_w"].to_numpy(dtype=np.float64),
+                       minlength=n_rows * n_fuses).reshape(n_rows, n_fuses)
+    valid = counts > 0
+
+    # Forward-fill gaps: index of the last valid row at or before each row
+    last = np.where(valid, np.arange(n_rows)[:, None], -1)
+    np.maximum.accumulate(last, axis=0, out=last)
+    # Leading gaps take the first valid value (back-fill)
+    first = np.where(valid.any(axis=0), valid.argmax(axis=0), 0)
+    last = np.where(last < 0, first[None, :], last)
+
+    mean = np.divide(sums, counts, out=np.zeros_like(sums), where=valid)
+    values = np.take_along_axis(mean, last, axis=0).astype(np.float32)
+    samples = dict(zip(fuses, counts.sum(axis=0).tolist()))
+    return pd.Timestamp(start), fuses, values, valid, samples
+
+
+def _save(path, fingerprint, start, fuses, values, valid, samples):
+    # Per-process temp dir: the forecast and NILM stages may build the same matrix concurrently
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "values.npy", values)
+    np.save(tmp / "valid.npy", valid)
+    (tmp / "meta.json").write_text(json.dumps({
+        "fingerprint": fingerprint,
+        "start": start.isoformat(),
+        "fuses": fuses,
+        "samples": samples,
+    }, indent=2))
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        if not (path / "meta.json").exists():
+            raise
+        shutil.rmtree(tmp, ignore_errors=True)  # another process saved the same matrix first
+
+
+def _prune():
+    caches = sorted((p for p in CACHE_DIR.iterdir() if p.is_dir() and not p.name.startswith(".")),
+                    key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in caches[KEEP_CACHES:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def load_matrix(start=None, end=None):
+    """Return the cached FuseMatrix for the current archive, building it on a miss."""
+    fingerprint = source_fingerprint(start, end)
+    path = CACHE_DIR / fingerprint
+    if (path / "meta.json").exists():
+        print(f"Fuse matrix cache hit → {path}")
+        return FuseMatrix(path)
+
+    print(f"Fuse matrix cache miss → building {path}")
+    df = read_archive(start=start, end=end)
+    if df.empty:
+        raise ValueError("Archive is empty, nothing to build a fuse matrix from")
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _save(path, fingerprint, *build_matrix(df))
+    _prune()
+    return FuseMatrix(path)
+
+
+class SharedMatrix:
+    """load_matrix() for several stages in one process: the same FuseMatrix is handed
+    out again until the archive (or the date range) changes."""
+
+    def __init__(self):
+        self.matrix = None
+        self.fingerprint = None
+
+    def __call__(self, start=None, end=None):
+        fingerprint = source_fingerprint(start, end)
+        if fingerprint != self.fingerprint:
+            self.matrix = load_matrix(start=start, end=end)
+            self.fingerprint = fingerprint
+        else:
+            print(f"Fuse matrix shared in-process → {self.matrix.path}")
+        return self.matrix
@@ -0,0 +1,116 @@
+# code/machine_learning/inprocess_runner.py
+# Runs pipeline scripts inside one interpreter instead of one subprocess each:
+# pandas, pyarrow, xgboost, scikit-learn... are imported once, and the fuse matrix is
+# loaded once and handed to every ML stage that takes a `matrix_loader`.
+#
+# A stage is only imported when it starts, so an early failure never pays for the
+# imports of later stages. ML scripts are imported as modules and their main() is
+# called; top-level scripts (check_fuse_data.py, export_fuse_data.py) have their
+# module-level imports loaded first and are then executed as __main__.
+#
+# The report splits each stage into import time (modules first loaded by it) and run time.
+import ast
+import importlib
+import inspect
+import os
+import runpy
+import sys
+import time
+import traceback
+from pathlib import Path
+
+script_dir = Path(__file__).parent.resolve()
+
+
+def interpreter_startup():
+    """Seconds between process start and now (Linux /proc), None elsewhere."""
+    try:
+        fields = Path("/proc/self/stat").read_text().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")  # field 22: starttime in clock ticks
+        return float(Path("/proc/uptime").read_text().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _module_imports(path):
+    """Absolute modules imported at the top level of a script."""
+    names = []
+    for node in ast.parse(path.read_text()).body:
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return names
+
+
+def _exit_code(e):
+    if e.code is None:
+        return 0
+    return e.code if isinstance(e.code, int) else 1
+
+
+def run_stage(path, matrix_loader):
+    """Import and run one script → (exit code, import seconds, run seconds, modules loaded)."""
+    path = Path(path).resolve()
+    modules_before = len(sys.modules)
+    t0 = time.perf_counter()
+    t1 = None
+    try:
+        if path.parent == script_dir:
+            module = importlib.import_module(path.stem)
+            t1 = time.perf_counter()
+            params = inspect.signature(module.main).parameters
+            code = module.main(**({"matrix_loader": matrix_loader} if "matrix_loader" in params else {}))
+        else:
+            for name in _module_imports(path):
+                importlib.import_module(name)
+            t1 = time.perf_counter()
+            runpy.run_path(str(path), run_name="__main__")
+            code = 0
+        code = code or 0
+    except SystemExit as e:
+        code = _exit_code(e)
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    t2 = time.perf_counter()
+    t1 = t1 or t2  # failed while importing
+    return code, t1 - t0, t2 - t1, len(sys.modules) - modules_before
+
+
+def run_inprocess(scripts):
+    """Run scripts in order; exit code 2 is a warning, any other failure stops the run.
+
+    Returns 0 on success, 1 on failure.
+    """
+    if str(script_dir) not in sys.path:
+        sys.path.insert(0, str(script_dir))  # ML scripts import their siblings by name
+    from fuse_matrix import SharedMatrix
+
+    startup = interpreter_startup()
+    matrix_loader = SharedMatrix()
+    timings = []
+    status = 0
+    for path in scripts:
+        path = Path(path)
+        print(f"\n→ Running in-process: {path.name}")
+        print("─" * 80)
+        code, import_s, run_s, modules = run_stage(path, matrix_loader)
+        sys.stdout.flush()
+        timings.append((path.name, code, import_s, run_s, modules))
+        if code == 2:
+            print(f"\nWarning WARNING from {path.name} (continuing)")
+        elif code != 0:
+            print(f"\nError ERROR in {path.name} (exit code: {code})")
+            status = 1
+            break
+
+    print("\n=== In-process stage timings ===")
+    if startup is not None:
+        print(f"  {'interpreter startup':<40} {startup:6.2f}s (paid once)")
+    for name, code, import_s, run_s, modules in timings:
+        print(f"  {name:<40} import {import_s:6.2f}s ({modules:4d} modules) | run {run_s:7.2f}s | exit {code}")
+    total_import = sum(t[2] for t in timings)
+    total_run = sum(t[3] for t in timings)
+    print(f"  {'total':<40} import {total_import:6.2f}s | run {total_run:7.2f}s")
+    return status
@@ -0,0 +1,208 @@
+# code/machine_learning/nilm_engine.py
+# NILM on the minute-aligned aggregate: the feature matrix is built once from the
+# fuse matrix and one multi-output RandomForest predicts ON/OFF for every appliance.
+#
+#   total = aggregate(matrix)
+#   X, columns = build_features(matrix.index, total)
+#   labels = build_labels(matrix, APPLIANCES)
+#   model = train_multi(X[labels.rows], labels.y[labels.rows])
+#
+# Backends:
+#   random_forest – RandomForestClassifier(400 trees, unlimited depth), the original model
+#   hist_gb       – HistGradientBoostingClassifier (one per appliance via MultiOutputClassifier)
+#   compact_trees – RandomForestClassifier(60 trees, depth ≤ 10): small file, fast single-row predict
+import io
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import joblib
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.multioutput import MultiOutputClassifier
+
+# === Appliances: fuse → (display name, ON threshold in W) ===
+APPLIANCES = {
+    'ams_linje6_p': ('Main Line (ams_linje6_p)', 500),
+    '08_lysstikk2ndfloor1_active_power': ('2nd Floor Lights', 100),
+    '03_solarinput63a_active_power': ('Solar Input', 300),
+    '06_kjeller15a_active_power': ('Basement', 200),
+    '05_kjokkenlys15a_active_power': ('Kitchen Lights', 50),
+}
+
+project_root = Path(__file__).parent.parent.parent
+models_dir = project_root / os.getenv("MODELS_DIR", "models") / "nilm"
+
+BASE_COLUMNS = ["total_power", "hour", "minute", "dayofweek"]
+DIFF_LAGS = (1, 5)
+WINDOWS = (5, 15, 60)
+MIN_POINTS = 100
+N_ESTIMATORS = 400
+BACKENDS = ("random_forest", "hist_gb", "compact_trees")
+
+
+def aggregate(matrix):
+    """Total power per minute: sum over all fuses of the gap-filled fuse matrix."""
+    return matrix.values.sum(axis=1, dtype=np.float64)
+
+
+def window_features(total, diff_lags=DIFF_LAGS, windows=WINDOWS):
+    """Vectorized features of the aggregate → (float32 [minutes, k], column names).
+
+    diff_<n>: change over the last n minutes. roll<w>_mean/std/min/max: statistics
+    over the trailing w minutes; the start is edge-padded so every minute gets a full
+    window. Mean/std come from cumulative sums, min/max from a strided (zero-copy)
+    window view, so no [minutes, w] temporary is allocated.
+    """
+    columns, out = [], []
+    for lag in diff_lags:
+        diff = np.zeros_like(total)
+        diff[lag:] = total[lag:] - total[:-lag]
+        out.append(diff)
+        columns.append(f"diff_{lag}")
+    for w in windows:
+        padded = np.pad(total, (w - 1, 0), mode="edge")
+        s1 = np.concatenate([[0.0], np.cumsum(padded)])
+        s2 = np.concatenate([[0.0], np.cumsum(padded ** 2)])
+        mean = (s1[w:] - s1[:-w]) / w
+        std = np.sqrt(np.maximum((s2[w:] - s2[:-w]) / w - mean ** 2, 0.0))
+        view = sliding_window_view(padded, w)
+        out.extend([mean, std, view.min(axis=1), view.max(axis=1)])
+        columns.extend([f"roll{w}_mean", f"roll{w}_std", f"roll{w}_min", f"roll{w}_max"])
+    return np.column_stack(out).astype(np.float32), columns
+
+
+def build_features(index, total, rich=True):
+    """Feature matrix for every minute → (float32 [minutes, columns], column names)."""
+    X = np.column_stack([total, index.hour, index.minute, index.dayofweek]).astype(np.float32)
+    columns = list(BASE_COLUMNS)
+    if rich:
+        extra, extra_columns = window_features(total)
+        X = np.concatenate([X, extra], axis=1)
+        columns += extra_columns
+    return X, columns
+
+
+@dataclass
+class Labels:
+    fuses: list         # appliances with enough data, in APPLIANCES order
+    names: list         # display names
+    thresholds: list    # ON thresholds (W)
+    power: np.ndarray   # float32 [minutes, appliances] appliance power (gap-filled)
+    y: np.ndarray       # int8 [minutes, appliances] 1 = ON
+    valid: np.ndarray   # bool [minutes, appliances] appliance reported in that minute
+
+    @property
+    def rows(self):
+        """Minutes where at least one appliance reported: the shared training rows."""
+        return self.valid.any(axis=1)
+
+
+def build_labels(matrix, appliances=APPLIANCES, min_points=MIN_POINTS):
+    fuses = [f for f in appliances if f in matrix.fuses and matrix.samples[f] >= min_points]
+    cols = [matrix.column(f) for f in fuses]
+    power = np.asarray(matrix.values[:, cols])
+    thresholds = [appliances[f][1] for f in fuses]
+    return Labels(
+        fuses=fuses,
+        names=[appliances[f][0] for f in fuses],
+        thresholds=thresholds,
+        power=power,
+        y=(power > np.array(thresholds, dtype=np.float32)).astype(np.int8),
+        valid=np.asarray(matrix.valid[:, cols]),
+    )
+
+
+def make_classifier(backend="random_forest", multi_output=False):
+    if backend == "random_forest":
+        return RandomForestClassifier(n_estimators=N_ESTIMATORS, random_state=42, n_jobs=-1)
+    if backend == "compact_trees":
+        return RandomForestClassifier(n_estimators=60, max_depth=10, min_samples_leaf=5,
+                                      random_state=42, n_jobs=-1)
+    if backend == "hist_gb":
+        clf = HistGradientBoostingClassifier(max_iter=200, learning_rate=0.1, random_state=42)
+        return MultiOutputClassifier(clf) if multi_output else clf
+    raise ValueError(f"Unknown NILM backend '{backend}', expected one of {BACKENDS}")
+
+
+def train_multi(X, Y, backend="random_forest"):
+    """One model for all appliances (forests handle multi-output targets natively)."""
+    multi_output = Y.shape[1] > 1
+    clf = make_classifier(backend, multi_output)
+    clf.fit(X, Y if multi_output else Y[:, 0])
+    return clf
+
+
+def train_per_appliance(X, labels, backend="random_forest", train_rows=None):
+    """The previous approach: one model per appliance on the minutes it reported."""
+    models = []
+    for j in range(len(labels.fuses)):
+        rows = labels.valid[:, j] if train_rows is None else labels.valid[:, j] & train_rows
+        clf = make_classifier(backend)
+        clf.fit(X[rows], labels.y[rows, j])
+        models.append(clf)
+    return models
+
+
+def predict(model, X, n_appliances):
+    """ON/OFF [minutes, appliances] from a multi-output forest or a per-appliance list."""
+    if isinstance(model, list):
+        return np.column_stack([m.predict(X) for m in model]).astype(np.int8)
+    return np.asarray(model.predict(X), dtype=np.int8).reshape(len(X), n_appliances)
+
+
+def holdout_mask(n_rows, fraction):
+    """Time-based split: True for the first (1 - fraction) of the minutes (training)."""
+    train = np.zeros(n_rows, dtype=bool)
+    train[:int(round(n_rows * (1 - fraction)))] = True
+    return train
+
+
+def set_single_thread(model):
+    """Predicting a few rows at a time is faster without joblib's thread pool."""
+    for m in (model if isinstance(model, list) else [model]):
+        if hasattr(m, "n_jobs"):  # forests, MultiOutputClassifier; HistGradientBoosting has no pool
+            m.n_jobs = 1
+
+
+def predict_latency_ms(model, x, n_appliances, repeats=100):
+    """Median single-row predict latency of a model set to one thread."""
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        predict(model, x, n_appliances)
+        samples.append(time.perf_counter() - t0)
+    return float(np.median(samples) * 1000)
+
+
+def model_bytes(model):
+    buf = io.BytesIO()
+    joblib.dump(model, buf)
+    return buf.tell()
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+# === Persistence ===
+def model_path(mode="multi", backend="random_forest"):
+    return models_dir / f"nilm_{mode}_{backend}.joblib"
+
+
+def save_model(bundle, path):
+    """Store a model bundle (model + everything needed to rebuild its inputs) atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    joblib.dump(bundle, tmp)
+    tmp.replace(path)
+    return path
+
+
+def load_model(path):
+    return joblib.load(path)
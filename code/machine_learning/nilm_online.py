@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# code/machine_learning/nilm_online.py
+# Online NILM: one minute of total power at a time → ON/OFF state changes per appliance.
+#
+# The model is the one saved by nilm_per_fuse_detection.py (models/nilm/nilm_<mode>_<backend>.joblib);
+# it is loaded once and never refitted. Window features are updated incrementally
+# from a fixed-size ring buffer of the latest minutes.
+#
+# Sources:
+#   NILM_SOURCE=replay  replay the fuse matrix (Parquet archive) at NILM_REPLAY_SPEED× real time (0 = as fast as possible)
+#   NILM_SOURCE=influx  poll InfluxDB once per minute for the minute that just completed
+import csv
+import os
+import re
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from archive_dataset import RESULTS_DIR, env_filters
+from nilm_engine import DIFF_LAGS, WINDOWS, load_model, model_path, predict, set_single_thread
+
+project_root = Path(__file__).parent.parent.parent
+env_path = project_root / "env" / ".env"
+load_dotenv(dotenv_path=env_path)
+
+SOURCE = os.getenv("NILM_SOURCE", "replay")
+MODEL_PATH = Path(os.getenv("NILM_MODEL") or model_path(os.getenv("NILM_MODE", "multi"),
+                                                        os.getenv("NILM_BACKEND", "random_forest")))
+REPLAY_SPEED = float(os.getenv("NILM_REPLAY_SPEED", "0"))     # × real time, 0 = no pacing
+MAX_MINUTES = int(os.getenv("NILM_MAX_MINUTES", "0"))         # stop after this many minutes (0 = no limit)
+POLL_DELAY = float(os.getenv("NILM_POLL_DELAY", "5"))         # seconds after the minute closes before polling
+REPORT_EVERY = int(os.getenv("NILM_REPORT_EVERY", "1440"))    # minutes between latency reports
+events_path = RESULTS_DIR / "nilm_events.csv"
+
+
+class OnlineFeatures:
+    """Incremental nilm_engine.build_features(), one minute at a time.
+
+    A ring buffer holds the last max(WINDOWS) minutes. Rolling sums and sums of
+    squares are updated by adding the new minute and dropping the one leaving each
+    window; min/max scan the (at most 60) values of the window. Before the buffer
+    is full it is padded with the first value, like the offline edge padding.
+    """
+
+    RESYNC_EVERY = 1440  # recompute the running sums from the buffer to stop float drift
+
+    def __init__(self, rich=True):
+        self.rich = rich
+        self.capacity = max(max(WINDOWS), max(DIFF_LAGS) + 1)
+        self.ring = np.zeros(self.capacity)
+        self.n = 0
+        self.s1 = {w: 0.0 for w in WINDOWS}
+        self.s2 = {w: 0.0 for w in WINDOWS}
+
+    def _window(self, pos, w):
+        return self.ring[(pos - np.arange(w)) % self.capacity]
+
+    def update(self, timestamp, total):
+        """Add one minute of total power; returns its float32 [1, columns] feature row."""
+        row = [total, timestamp.hour, timestamp.minute, timestamp.dayofweek]
+        pos = self.n % self.capacity
+        if self.n == 0:
+            self.ring[:] = total
+            for w in WINDOWS:
+                self.s1[w], self.s2[w] = w * total, w * total * total
+
+        if self.rich:
+            for lag in DIFF_LAGS:
+                row.append(total - self.ring[(pos - lag) % self.capacity] if self.n >= lag else 0.0)
+            if self.n:
+                for w in WINDOWS:
+                    out = self.ring[(pos - w) % self.capacity]
+                    self.s1[w] += total - out
+                    self.s2[w] += total * total - out * out
+        self.ring[pos] = total
+        self.n += 1
+
+        if self.rich:
+            if self.n % self.RESYNC_EVERY == 0:
+                for w in WINDOWS:
+                    values = self._window(pos, w)
+                    self.s1[w], self.s2[w] = values.sum(), (values ** 2).sum()
+            for w in WINDOWS:
+                mean = self.s1[w] / w
+                std = np.sqrt(max(self.s2[w] / w - mean * mean, 0.0))
+                values = self._window(pos, w)
+                row += [mean, std, values.min(), values.max()]
+        return np.asarray(row, dtype=np.float32)[None, :]
+
+
+# === Sources: yield (minute timestamp, total power in W) ===
+def replay_source(speed=REPLAY_SPEED):
+    from fuse_matrix import load_matrix
+
+    filters = env_filters()
+    matrix = load_matrix(start=filters["start"], end=filters["end"])
+    print(f"Replaying {matrix.index[0]} → {matrix.index[-1]} ({len(matrix):,} minutes) at "
+          f"{f'{speed:g}×' if speed else 'full'} speed")
+    t0 = time.perf_counter()
+    for i, timestamp in enumerate(matrix.index):
+        if speed:
+            delay = t0 + i * 60 / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield timestamp, float(matrix.values[i].sum(dtype=np.float64))
+
+
+def influx_source(fuses, warmup_minutes=max(WINDOWS)):
+    from influxdb import InfluxDBClient
+
+    url = os.getenv("INFLUX_URL", "http://192.168.188.74:8086")
+    missing = [v for v in ("INFLUX_USER", "INFLUX_PASSWORD", "INFLUX_BUCKET") if not os.getenv(v)]
+    if missing:
+        print(f"ERROR: Missing env vars: {', '.join(missing)}")
+        sys.exit(1)
+    client = InfluxDBClient(
+        host=url.replace("http://", "").replace("https://", "").split(":")[0],
+        port=int(url.split(":")[-1].split("/")[0]) if url.count(":") > 1 else 8086,
+        username=os.getenv("INFLUX_USER"), password=os.getenv("INFLUX_PASSWORD"),
+        database=os.getenv("INFLUX_BUCKET"), timeout=30, retries=3
+    )
+    regex = "/^(" + "|".join(re.escape(f) for f in fuses) + ")$/"
+    last_values = {}  # per fuse, forward-filled between readings
+
+    # Start with the last hour so the rolling windows are filled
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    next_minute = now - timedelta(minutes=warmup_minutes)
+    print(f"Polling InfluxDB for {len(fuses)} fuses, warm-up from {next_minute:%H:%M} UTC")
+    while True:
+        current = datetime.now(timezone.utc).replace(second=0, microsecond=0)  # still open
+        if current > next_minute:
+            result = client.query(f'''
+                SELECT mean("value") FROM "W"
+                WHERE entity_id =~ {regex}
+                  AND time >= '{next_minute:%Y-%m-%dT%H:%M:%SZ}' AND time < '{current:%Y-%m-%dT%H:%M:%SZ}'
+                GROUP BY time(1m), entity_id fill(none)
+            ''', epoch="s")
+            by_minute = {}
+            for series in result.raw.get("series") or []:
+                fuse = series["tags"]["entity_id"]
+                for ts, value in series["values"]:
+                    by_minute.setdefault(ts, {})[fuse] = value
+            minute = next_minute
+            while minute < current:
+                last_values.update(by_minute.get(int(minute.timestamp()), {}))
+                yield pd.Timestamp(minute).tz_localize(None), float(sum(last_values.values()))
+                minute += timedelta(minutes=1)
+            next_minute = current
+        # Sleep until shortly after the next minute closes
+        wake = current + timedelta(minutes=1, seconds=POLL_DELAY)
+        time.sleep(max(0.0, (wake - datetime.now(timezone.utc)).total_seconds()))
+
+
+def report(latencies, minutes, started):
+    lat = np.fromiter(latencies, dtype=np.float64) * 1000
+    wall = time.perf_counter() - started
+    print(f"  [{minutes:,} minutes] latency p50 {np.percentile(lat, 50):.2f} ms | "
+          f"p95 {np.percentile(lat, 95):.2f} ms | max {lat.max():.2f} ms | "
+          f"throughput {minutes / max(wall, 1e-9):,.0f} minutes/s")
+
+
+def main():
+    if SOURCE not in ("replay", "influx"):
+        print(f"ERROR: NILM_SOURCE must be 'replay' or 'influx', got '{SOURCE}'")
+        return 1
+    if not MODEL_PATH.exists():
+        print(f"ERROR: No NILM model at {MODEL_PATH} → run nilm_per_fuse_detection.py first")
+        return 1
+
+    bundle = load_model(MODEL_PATH)
+    model = bundle["model"]
+    set_single_thread(model)  # one row per call: thread start-up would dominate the latency
+    names = bundle["names"]
+    print(f"Loaded {bundle['mode']}/{bundle.get('backend', 'random_forest')} NILM model for {len(names)} appliances ← {MODEL_PATH}")
+
+    source = replay_source() if SOURCE == "replay" else influx_source(bundle["all_fuses"])
+    features = OnlineFeatures(rich=bundle["rich"])
+    state = None
+    latencies = deque(maxlen=100_000)
+    minutes = events = 0
+
+    events_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(events_path, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["timestamp", "appliance", "fuse", "state", "total_power_w", "latency_ms"])
+        started = time.perf_counter()
+        for timestamp, total in source:
+            t0 = time.perf_counter()
+            x = features.update(timestamp, total)
+            new_state = predict(model, x, len(names))[0]
+            latency = time.perf_counter() - t0
+            latencies.append(latency)
+            minutes += 1
+
+            if state is None:
+                print(f"[{timestamp}] Initial state: " +
+                      ", ".join(f"{n} {'ON' if s else 'OFF'}" for n, s in zip(names, new_state)))
+            else:
+                for j in np.flatnonzero(new_state != state):
+                    label = "ON" if new_state[j] else "OFF"
+                    events += 1
+                    print(f"[{timestamp}] {names[j]} → {label} (total {total:.0f} W, {latency * 1000:.2f} ms)")
+                    writer.writerow([timestamp, names[j], bundle["fuses"][j], label, round(total, 1),
+                                     round(latency * 1000, 3)])
+            state = new_state
+
+            if minutes % REPORT_EVERY == 0:
+                report(latencies, minutes, started)
+                fh.flush()
+            if MAX_MINUTES and minutes >= MAX_MINUTES:
+                break
+
+    if minutes:
+        print(f"\nProcessed {minutes:,} minutes, {events:,} state changes → {events_path}")
+        report(latencies, minutes, started)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        raise SystemExit(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,139 +1,217 @@
 #!/usr/bin/env python3
 # code/machine_learning/nilm_minutely_detection.py
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
-import matplotlib.pyplot as plt
-import seaborn as sns
-from pathlib import Path
+
+from archive_dataset import RESULTS_DIR, env_filters
+from fuse_matrix import load_matrix
+from nilm_engine import (
+    APPLIANCES, BACKENDS, MIN_POINTS, aggregate, build_features, build_labels, holdout_mask,
+    load_model, model_bytes, model_path, predict, predict_latency_ms, save_model,
+    set_single_thread, timed, train_multi, train_per_appliance,
+)
+from perf_metrics import StageMetrics
+from plotting import PlotWriter
 
 # === Paths ===
-project_root = Path(__file__).parent.parent.parent
-data_path = project_root / "data" / "energy_fuse_archive.parquet"
-plots_dir = project_root / "results" / "plots"
+plots_dir = RESULTS_DIR / "plots"
 plots_dir.mkdir(parents=True, exist_ok=True)
 
-print(f"Loading data from: {data_path}")
-df = pd.read_parquet(data_path)
-df = df.sort_index()
-
-print(f"Data range: {df.index.min()} to {df.index.max()}")
-print(f"Total measurements: {len(df):,}")
-
-# Total power
-total_power = df.groupby(df.index)['value_w'].sum().to_frame('total_power')
-available_fuses = df['entity_id'].value_counts()
-print(f"\nFuses with data:\n{available_fuses}")
-
-# === Appliances ===
-appliances = {
-    'ams_linje6_p': ('Main Line (ams_linje6_p)', 500),
-    '08_lysstikk2ndfloor1_active_power': ('2nd Floor Lights', 100),
-    '03_solarinput63a_active_power': ('Solar Input', 300),
-    '06_kjeller15a_active_power': ('Basement', 200),
-    '05_kjokkenlys15a_active_power': ('Kitchen Lights', 50),
-}
-
-results = []
-
-for fuse, (display_name, threshold) in appliances.items():
-    if fuse not in df['entity_id'].unique():
-        continue
-
-    count = available_fuses[fuse]
-    if count < 100:
-        continue
-
-    print(f"\nTraining NILM for: {display_name} ({fuse}) — {count} points")
-
-    fuse_data = df[df['entity_id'] == fuse][['value_w']].copy()
-    fuse_data = fuse_data.rename(columns={'value_w': 'app_power'})
-
-    data = total_power.join(fuse_data, how='inner')
-    if len(data) < 100:
-        continue
-
-    data['true_on'] = (data['app_power'] > threshold).astype(int)
-
-    features = pd.DataFrame(index=data.index)
-    features['total_power'] = data['total_power']
-    features['hour'] = features.index.hour
-    features['minute'] = features.index.minute
-    features['dayofweek'] = features.index.dayofweek
-
-    X = features
-    y_true = data['true_on']
-
-    clf = RandomForestClassifier(n_estimators=400, random_state=42, n_jobs=-1)
-    clf.fit(X, y_true)
-
-    y_pred = clf.predict(X)
-    acc = accuracy_score(y_true, y_pred)
-    print(f"  → {display_name}: {acc:.1%} accuracy")
-
-    results.append({
-        'Appliance': display_name,
-        'Fuse': fuse,
-        'Accuracy': acc,
-        'Points': len(data),
-        'Threshold_W': threshold
-    })
-
-    # === PLOT — LIGHT GREEN/YELLOW FOR PREDICTED ON ===
-    plt.figure(figsize=(18, 9))
-    
-    ax1 = plt.gca()
-    ax1.plot(data.index, data['total_power'], label='Total Power', color='gray', alpha=0.6, linewidth=1)
-    ax1.set_ylabel("Total Power (W)", color='gray', fontsize=12)
-    ax1.tick_params(axis='y', labelcolor='gray')
-
-    # True ON — dark green
-    true_on_periods = data['true_on'] == 1
-    ax1.fill_between(data.index, 0, data['total_power'].max(),
-                     where=true_on_periods, color='#2ca02c', alpha=0.5, label='True ON')
-
-    # Predicted ON — light green/yellow
-    pred_on_periods = pd.Series(y_pred, index=data.index) == 1
-    ax1.fill_between(data.index, 0, data['total_power'].max(),
-                     where=pred_on_periods, color='#b2df8a', alpha=0.6, label='Predicted ON')
-
-    ax1.set_title(f"TRUE MINUTELY NILM — {display_name}\n"
-                  f"Entity ID: {fuse} | Accuracy: {acc:.1%} | Threshold: {threshold}W\n"
-                  f"From Total Power Only", 
-                  fontsize=18, pad=30, fontweight='bold')
-    ax1.set_xlabel("Time", fontsize=14)
-    ax1.legend(loc='upper left', fontsize=12)
-    ax1.grid(True, alpha=0.3)
-
-    # Appliance power
-    ax2 = ax1.twinx()
-    ax2.plot(data.index, data['app_power'], color='#1f77b4', linewidth=1.8, label='Appliance Power')
-    ax2.axhline(threshold, color='red', linestyle='--', linewidth=2, label=f'Threshold {threshold}W')
-    ax2.set_ylabel(f"{display_name} Power (W)", color='#1f77b4', fontsize=12)
-    ax2.tick_params(axis='y', labelcolor='#1f77b4')
-
-    # Combined legend
-    lines1, labels1 = ax1.get_legend_handles_labels()
-    lines2, labels2 = ax2.get_legend_handles_labels()
-    ax1.legend(lines1 + lines2, labels1 + labels2, loc='upper right', fontsize=11)
-
-    plt.tight_layout()
-    safe_name = fuse.replace("/", "_")
-    plt.savefig(plots_dir / f"nilm_minutely_{safe_name}.png", dpi=300, bbox_inches='tight')
-    plt.close()
-
-# === Summary ===
-if results:
-    results_df = pd.DataFrame(results).sort_values('Accuracy', ascending=False)
-    print("\n" + "="*80)
-    print("MINUTELY TRUE NILM RESULTS — FROM TOTAL POWER ONLY")
-    print("="*80)
-    print(results_df.to_string(
-        index=False,
-        float_format=lambda x: f"{x:.1%}" if x <= 1 else f"{x:.1f}"
-    ))
-    results_df.to_csv(project_root / "results" / "nilm_minutely_summary.csv", index=False)
-else:
-    print("\nNo appliances detected.")
-
-print(f"\nPlots saved in {plots_dir}/")
+# NILM_MODE: multi (one multi-output model) | per_appliance (one model per appliance)
+# NILM_FEATURES: rich (+ diffs and rolling stats of total power) | basic (total power + calendar)
+# NILM_BACKEND: random_forest | hist_gb | compact_trees (see nilm_engine.py)
+# NILM_HOLDOUT: fraction of the most recent minutes held out for evaluation
+# NILM_COMPARE=1: fit every mode × backend and write results/nilm_model_report.csv
+MODE = os.getenv("NILM_MODE", "multi")
+BACKEND = os.getenv("NILM_BACKEND", "random_forest")
+FEATURES = os.getenv("NILM_FEATURES", "rich")
+HOLDOUT = float(os.getenv("NILM_HOLDOUT", "0.2"))
+COMPARE = os.getenv("NILM_COMPARE", "0") == "1"
+
+
+# === Models ===
+def fingerprint(matrix, mode, backend):
+    settings = [matrix.fingerprint, mode, backend, FEATURES, HOLDOUT, APPLIANCES]
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def fit_or_load(mode, backend, matrix, X, columns, labels, train_rows, metrics):
+    """Saved model if it was fitted on the same data and settings, else fit and save one → (bundle, fitted)."""
+    path = model_path(mode, backend)
+    fp = fingerprint(matrix, mode, backend)
+    if path.exists():
+        with metrics.step("load_model"):
+            bundle = load_model(path)
+        if bundle.get("fingerprint") == fp:
+            print(f"Loaded {mode}/{backend} model (data unchanged) ← {path}")
+            return bundle, False
+    if mode == "multi":
+        rows = labels.rows & train_rows
+        model, fit_s = timed(train_multi, X[rows], labels.y[rows], backend)
+        metrics.record(f"fit:{mode}/{backend}", fit_s, rows.sum())
+    else:
+        model, fit_s = timed(train_per_appliance, X, labels, backend, train_rows)
+        metrics.record(f"fit:{mode}/{backend}", fit_s, (labels.valid & train_rows[:, None]).sum())
+    bundle = {
+        "model": model,
+        "mode": mode,
+        "backend": backend,
+        "fingerprint": fp,
+        "fit_seconds": fit_s,
+        "rich": FEATURES == "rich",
+        "columns": columns,
+        "fuses": labels.fuses,
+        "names": labels.names,
+        "thresholds": labels.thresholds,
+        "all_fuses": matrix.fuses,  # fuses summed into total power
+        "holdout_start": matrix.index[int(np.argmin(train_rows))],
+    }
+    save_model(bundle, path)
+    print(f"Trained {mode}/{backend} model in {fit_s:.1f}s → {path}")
+    return bundle, True
+
+
+def holdout_accuracy(y_pred, j, labels, train_rows):
+    rows = labels.valid[:, j] & ~train_rows
+    return accuracy_score(labels.y[rows, j], y_pred[rows, j]) if rows.any() else float("nan")
+
+
+def main(matrix_loader=load_matrix):
+    if MODE not in ("multi", "per_appliance"):
+        print(f"ERROR: NILM_MODE must be 'multi' or 'per_appliance', got '{MODE}'")
+        return 1
+    if BACKEND not in BACKENDS:
+        print(f"ERROR: NILM_BACKEND must be one of {', '.join(BACKENDS)}, got '{BACKEND}'")
+        return 1
+    if not 0 < HOLDOUT < 1:
+        print(f"ERROR: NILM_HOLDOUT must be between 0 and 1, got {HOLDOUT}")
+        return 1
+
+    # Minute-aligned, gap-filled time × fuse matrix (cached, memory-mapped; shared when run in-process).
+    # Total power needs every fuse, so only the date range filter applies here.
+    metrics = StageMetrics("nilm")
+    filters = env_filters()
+    with metrics.step("matrix_load") as step:
+        matrix = matrix_loader(start=filters["start"], end=filters["end"])
+        step.rows = len(matrix)
+
+    print(f"Data range: {matrix.index[0]} to {matrix.index[-1]}")
+    print(f"Total measurements: {sum(matrix.samples.values()):,}")
+
+    # Total power: sum of all fuses in each minute
+    total_power = aggregate(matrix)
+    available_fuses = pd.Series(matrix.samples).sort_values(ascending=False)
+    print(f"\nFuses with data:\n{available_fuses}")
+
+    # === Features + labels: built once for every appliance ===
+    with metrics.step("features", rows=len(matrix)):
+        X, columns = build_features(matrix.index, total_power, rich=FEATURES == "rich")
+        labels = build_labels(matrix, APPLIANCES)
+    print(f"\nFeatures ({FEATURES}): {', '.join(columns)}")
+    print(f"Appliances with ≥{MIN_POINTS} points: {len(labels.fuses)}")
+
+    if not labels.fuses:
+        print("\nNo appliances detected.")
+        metrics.close(rows=len(matrix))
+        return
+
+    # === Training: reuse the saved model while data and settings are unchanged ===
+    # multi:         one multi-output model on the minutes where any appliance reported
+    # per_appliance: one model per appliance on the minutes it reported (previous approach)
+    # The last NILM_HOLDOUT of the minutes is never trained on and is used for accuracy.
+    train_rows = holdout_mask(len(matrix), HOLDOUT)
+    holdout_start = matrix.index[int(np.argmin(train_rows))]
+    print(f"Holdout: {holdout_start} → {matrix.index[-1]} ({(~train_rows).sum():,} minutes)")
+
+    combos = [(m, b) for m in ("multi", "per_appliance") for b in BACKENDS] if COMPARE else [(MODE, BACKEND)]
+    report = []
+    for mode, backend in combos:
+        bundle, fitted = fit_or_load(mode, backend, matrix, X, columns, labels, train_rows, metrics)
+        model = bundle["model"]
+        n_app = len(labels.fuses)
+        preds, predict_s = timed(predict, model, X, n_app)
+        metrics.record(f"predict:{mode}/{backend}", predict_s, len(X))
+        if mode == MODE and backend == BACKEND:
+            y_pred_all = preds
+        if COMPARE:
+            set_single_thread(model)
+            report.append({
+                'Mode': mode,
+                'Backend': backend,
+                'Fit_s': bundle["fit_seconds"],
+                'Predict_all_s': predict_s,
+                'Latency_ms': predict_latency_ms(model, X[-1:], n_app),
+                'Size_KB': model_bytes(model) / 1024,
+                'Holdout_Accuracy': np.nanmean([holdout_accuracy(preds, j, labels, train_rows) for j in range(n_app)]),
+            })
+
+    if report:
+        report_df = pd.DataFrame(report)
+        print("\n" + "="*80)
+        print("NILM MODEL COMPARISON (fit time from when the model was trained)")
+        print("="*80)
+        print(report_df.to_string(index=False, float_format="%.3f"))
+        report_df.to_csv(RESULTS_DIR / "nilm_model_report.csv", index=False)
+
+    results = []
+    plots = PlotWriter(metrics=metrics)
+
+    for j, fuse in enumerate(labels.fuses):
+        display_name, threshold = labels.names[j], labels.thresholds[j]
+        count = available_fuses[fuse]
+        print(f"\nNILM for: {display_name} ({fuse}) — {count} points")
+
+        # Minutes where the appliance actually reported
+        reported = labels.valid[:, j]
+        data = pd.DataFrame({'total_power': total_power[reported]}, index=matrix.index[reported])
+        data['app_power'] = labels.power[reported, j]
+        data['true_on'] = labels.y[reported, j]
+        y_true = data['true_on']
+        y_pred = y_pred_all[reported, j]
+
+        acc = holdout_accuracy(y_pred_all, j, labels, train_rows)
+        train_acc = accuracy_score(y_true[train_rows[reported]], y_pred[train_rows[reported]])
+        print(f"  → {display_name}: {acc:.1%} holdout accuracy ({train_acc:.1%} on training minutes)")
+
+        results.append({
+            'Appliance': display_name,
+            'Fuse': fuse,
+            'Accuracy': acc,
+            'Train_Accuracy': train_acc,
+            'Points': len(data),
+            'Threshold_W': threshold
+        })
+
+        # === PLOT — LIGHT GREEN/YELLOW FOR PREDICTED ON (decimated, drawn in the background) ===
+        safe_name = fuse.replace("/", "_")
+        plots.nilm(plots_dir / f"nilm_minutely_{safe_name}.png", display_name, fuse, data.index,
+                   data['total_power'].to_numpy(), data['app_power'].to_numpy(),
+                   data['true_on'].to_numpy() == 1, y_pred == 1, acc, threshold, holdout_start)
+
+    # === Summary ===
+    if results:
+        results_df = pd.DataFrame(results).sort_values('Accuracy', ascending=False)
+        print("\n" + "="*80)
+        print("MINUTELY TRUE NILM RESULTS — FROM TOTAL POWER ONLY")
+        print("="*80)
+        print(results_df.to_string(
+            index=False,
+            float_format=lambda x: f"{x:.1%}" if x <= 1 else f"{x:.1f}"
+        ))
+        results_df.to_csv(RESULTS_DIR / "nilm_minutely_summary.csv", index=False)
+    else:
+        print("\nNo appliances detected.")
+
+    plot_s = plots.close()
+    print(f"\nPlots saved in {plots_dir}/ ({plots.count} {plots.mode}, all done {plot_s:.1f}s after the first was queued)")
+    metrics.close(rows=len(matrix))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,121 +1,436 @@
 #!/usr/bin/env python3
 # code/machine_learning/per_fuse_minutely_forecast_xgboost.py
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 import xgboost as xgb
-from sklearn.metrics import mean_absolute_error, mean_squared_error
-import matplotlib.pyplot as plt
 import numpy as np
-from pathlib import Path
+
+from archive_dataset import (
+    DATA_DIR, MODELS_DIR, RESULTS_DIR, archive_entities, entity_files, env_filters, iter_entity_batches,
+)
+from feature_store import FeatureSet, feature_columns, feature_spec, load_features, stream_features
+from fuse_matrix import FuseMatrix, load_matrix
+from perf_metrics import StageMetrics
+from plotting import PlotWriter
 
 # === Paths ===
-project_root = Path(__file__).parent.parent.parent
-data_path = project_root / "data" / "energy_fuse_archive.parquet"
-models_dir = project_root / "models" / "per_fuse"
-plots_dir = project_root / "results" / "plots" / "per_fuse"
+models_dir = MODELS_DIR / "per_fuse"
+plots_dir = RESULTS_DIR / "plots" / "per_fuse"
 
 models_dir.mkdir(parents=True, exist_ok=True)
 plots_dir.mkdir(parents=True, exist_ok=True)
 
-print(f"Loading data from: {data_path}")
-df = pd.read_parquet(data_path)
-df = df.sort_index()
-
-print(f"Data range: {df.index.min()} → {df.index.max()}")
-print(f"Total measurements: {len(df):,}")
-
-fuses = df['entity_id'].unique()
-print(f"Found {len(fuses)} fuses")
-
-results = []
-
-for fuse in fuses:
-    print(f"\nTraining model for: {fuse}")
-    
-    # Extract fuse data
-    fuse_data = df[df['entity_id'] == fuse].copy()
-    if len(fuse_data) < 100:
-        print(f"  → Skipping: only {len(fuse_data)} points")
-        continue
-
-    # Reindex to minutely, forward-fill missing
-    full_range = pd.date_range(start=df.index.min(), end=df.index.max(), freq='min')
-    fuse_data = fuse_data.reindex(full_range, method='ffill').fillna(method='bfill')
-    fuse_data = fuse_data.rename(columns={'value_w': 'power'})
-
-    # Feature engineering — short lags only for small data
-    df_feat = fuse_data[['power']].copy()
-    df_feat['minute'] = df_feat.index.minute
-    df_feat['hour'] = df_feat.index.hour
-    df_feat['dayofweek'] = df_feat.index.dayofweek
-
-    # Adaptive lags: use only what's possible
-    max_lag = min(60, len(df_feat) // 4)
-    for lag in [1, 5, 15, max_lag]:
-        df_feat[f'lag_{lag}'] = df_feat['power'].shift(lag)
-    
-    df_feat['rolling_mean_30'] = df_feat['power'].rolling(30, min_periods=1).mean()
-    df_feat = df_feat.dropna()
-
-    if len(df_feat) < 50:
-        print(f"  → Not enough data after features: {len(df_feat)}")
-        continue
+# === Parallel training ===
+# TRAIN_WORKERS: processes training fuses side by side (0 = auto, 1 = sequential in-process).
+# The CPU cores are split between the workers, each model gets cores // workers XGBoost threads.
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", "0"))
+CPUS = os.cpu_count() or 1
+# TRAIN_COMPARE=1: train every fuse a second time sequentially (1 worker × all cores) and
+# report wall time sequential / parallel. Needs TRAIN_MODE=full, so both runs do the same work.
+COMPARE = os.getenv("TRAIN_COMPARE", "0") == "1"
+
+# === Incremental training ===
+# incremental: skip fuses whose data fingerprint is unchanged, keep boosting the saved
+#              model when only new minutes were appended, retrain from scratch otherwise
+# full:        always retrain from scratch
+TRAIN_MODE = os.getenv("TRAIN_MODE", "incremental")
+N_ESTIMATORS = 500
+INCREMENT_ESTIMATORS = int(os.getenv("TRAIN_INCREMENT_ESTIMATORS", "50"))  # trees added per warm start
+MAX_ESTIMATORS = int(os.getenv("TRAIN_MAX_ESTIMATORS", "1500"))            # retrain from scratch beyond this
+
+# === External-memory training ===
+# TRAIN_EXTERNAL_MEMORY=1: stream each fuse from the Parquet archive in batches of
+# TRAIN_BATCH_ROWS raw rows, build features chunk by chunk and feed XGBoost through a
+# DataIter with an on-disk cache, so memory is bounded by the batch size, not the history.
+EXTERNAL_MEMORY = os.getenv("TRAIN_EXTERNAL_MEMORY", "0") == "1"
+BATCH_ROWS = int(os.getenv("TRAIN_BATCH_ROWS", "100000"))
+extmem_dir = DATA_DIR / "cache" / "xgb_extmem"
+
+
+def _sha256(values):
+    return hashlib.sha256(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+
+def data_fingerprint(power, start):
+    """Row count, time range and hash of one fuse's minutely series.
+
+    prefix_hash leaves out the last minute, which may have been only partly
+    filled when the model was trained; it decides whether data was only appended.
+    """
+    return {
+        "rows": int(len(power)),
+        "start": start.isoformat(),
+        "end": (start + pd.Timedelta(minutes=len(power) - 1)).isoformat(),
+        "hash": _sha256(power),
+        "prefix_hash": _sha256(power[:-1]),
+    }
+
+
+def load_meta(meta_path):
+    return json.loads(meta_path.read_text()) if meta_path.exists() else None
+
+
+def plan_training(meta, power, start, spec):
+    """Decide between 'skip', 'incremental' and 'full' for one fuse."""
+    if TRAIN_MODE == "full" or meta is None:
+        return "full"
+    if meta.get("features") != spec or meta["start"] != start.isoformat():
+        return "full"
+    if meta["rows"] == len(power) and meta.get("hash") == _sha256(power):
+        return "skip"
+    appended = len(power) > meta["rows"] and _sha256(power[:meta["rows"] - 1]) == meta.get("prefix_hash")
+    if appended and meta["n_estimators"] + INCREMENT_ESTIMATORS <= MAX_ESTIMATORS:
+        return "incremental"
+    return "full"
+
+
+def train_fuse(matrix_path, features_path, fuse, n_jobs):
+    """Train, evaluate and save the model of one fuse. Runs in a worker process.
+
+    The worker memory-maps the shared fuse matrix and feature set itself, so no
+    data is pickled. Returns (log lines, result dict or None, plot data or None, seconds).
+    """
+    t0 = time.perf_counter()
+    matrix = FuseMatrix(matrix_path)
+    features = FeatureSet(features_path)
+    log = []
+
+    power = np.asarray(matrix.values[:, matrix.column(fuse)])
+
+    safe_name = fuse.replace("/", "_")
+    model_path = models_dir / f"xgboost_{safe_name}.json"
+    meta_path = models_dir / f"xgboost_{safe_name}.meta.json"
+    meta = load_meta(meta_path) if model_path.exists() else None
+
+    plan = plan_training(meta, power, matrix.start, features.spec)
+    if plan == "skip":
+        log.append("  → Data unchanged since last training → skipped")
+        result = {'fuse': fuse, 'mae': meta['mae'], 'rmse': meta['rmse'], 'points': meta['rows'], 'training': plan}
+        return log, result, None, time.perf_counter() - t0
+
+    # Precomputed lag / rolling / calendar features, rows with NaN lags left out
+    X = features.frame(fuse)
+    y = power[features.first_row:]
+    index = matrix.index[features.first_row:]
+
+    if len(X) < 50:
+        log.append(f"  → Not enough data after features: {len(X)}")
+        return log, None, None, time.perf_counter() - t0
 
     # Train/test split
-    split = int(0.8 * len(df_feat))
-    train, test = df_feat.iloc[:split], df_feat.iloc[split:]
-
-    X_train = train.drop('power', axis=1)
-    y_train = train['power']
-    X_test = test.drop('power', axis=1)
-    y_test = test['power']
-
-    print(f"  → Training on {len(train)} | Testing on {len(test)} minutes")
-
-    # Light XGBoost for small data
-    model = xgb.XGBRegressor(
-        n_estimators=500,
-        learning_rate=0.05,
-        max_depth=5,
-        subsample=0.8,
-        random_state=42
-    )
-    model.fit(X_train, y_train, verbose=False)
+    split = int(0.8 * len(X))
+    X_test, y_test = X.iloc[split:], y[split:]
+
+    params = dict(learning_rate=0.05, max_depth=5, subsample=0.8, random_state=42, n_jobs=n_jobs)
+    if plan == "incremental":
+        # Continue boosting the saved booster on the minutes added to the training split
+        new_X, new_y = X.iloc[meta['train_rows']:split], y[meta['train_rows']:split]
+        log.append(f"  → Warm start: +{len(new_X)} new training minutes, "
+                   f"+{INCREMENT_ESTIMATORS} trees on top of {meta['n_estimators']} ({n_jobs} thread(s))")
+        model = xgb.XGBRegressor(n_estimators=INCREMENT_ESTIMATORS, **params)
+        if len(new_X):
+            model.fit(new_X, new_y, xgb_model=str(model_path), verbose=False)
+            n_estimators = meta['n_estimators'] + INCREMENT_ESTIMATORS
+        else:
+            model.load_model(model_path)
+            n_estimators = meta['n_estimators']
+    else:
+        log.append(f"  → Training on {split} | Testing on {len(X) - split} minutes ({n_jobs} thread(s))")
+
+        # Light XGBoost for small data
+        model = xgb.XGBRegressor(n_estimators=N_ESTIMATORS, **params)
+        model.fit(X.iloc[:split], y[:split], verbose=False)
+        n_estimators = N_ESTIMATORS
 
     pred = model.predict(X_test)
-    mae = mean_absolute_error(y_test, pred)
-    rmse = np.sqrt(mean_squared_error(y_test, pred))
+    # Plain numpy: importing sklearn.metrics costs every worker process about a second
+    err = np.asarray(y_test, dtype=np.float64) - pred
+    mae, rmse = float(np.mean(np.abs(err))), float(np.sqrt(np.mean(err ** 2)))
+
+    log.append(f"  → {fuse} | MAE: {mae:.1f}W | RMSE: {rmse:.1f}W")
+
+    # Save model + the fingerprint of the data it has seen
+    model.save_model(model_path)
+    meta_path.write_text(json.dumps({
+        **data_fingerprint(power, matrix.start),
+        "features": features.spec,
+        "train_rows": split,
+        "n_estimators": n_estimators,
+        "mae": float(mae),
+        "rmse": float(rmse),
+    }, indent=2))
+
+    # Last 6 hours for the plot
+    n = min(360, len(pred))
+    plot = (index[-n:], y_test[-n:], pred[-n:])
+    result = {'fuse': fuse, 'mae': mae, 'rmse': rmse, 'points': len(matrix), 'training': plan}
+    return log, result, plot, time.perf_counter() - t0
+
+
+class FeatureBatches(xgb.DataIter):
+    """xgb.DataIter over stream_features() chunks; the stream is restarted on every pass."""
+
+    def __init__(self, make_chunks, columns, cache_prefix):
+        super().__init__(cache_prefix=cache_prefix)
+        self._make_chunks = make_chunks
+        self._columns = columns
+        self._chunks = None
 
-    print(f"  → {fuse} | MAE: {mae:.1f}W | RMSE: {rmse:.1f}W")
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = self._make_chunks()
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        _, _, X, y = chunk
+        input_data(data=X, label=y, feature_names=self._columns)
+        return True
 
-    results.append({'fuse': fuse, 'mae': mae, 'rmse': rmse, 'points': len(fuse_data)})
+    def reset(self):
+        self._chunks = None
+
+
+def select_rows(chunks, lo, hi=None):
+    """Cut stream_features() chunks to feature rows [lo, hi)."""
+    for row, index, X, y in chunks:
+        a = max(lo - row, 0)
+        b = len(X) if hi is None else min(hi - row, len(X))
+        if a < b:
+            yield row + a, index[a:b], X[a:b], y[a:b]
+
+
+def source_fingerprint(files):
+    h = hashlib.sha256()
+    for f in files:
+        st = f.stat()
+        h.update(f"{f.name}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def train_fuse_streaming(fuse, info, filters, n_jobs):
+    """External-memory variant of train_fuse(): same features, model and outputs.
+
+    The fuse is read from the Parquet archive batch by batch; nothing scales with
+    the length of its history except XGBoost's on-disk cache. Series start at the
+    fuse's own first minute (no back-filled leading gap as in the fuse matrix).
+    Warm starts are not supported here: changed data means a full retrain.
+    """
+    t0 = time.perf_counter()
+    log = []
+    _, first, last = info
+    minutes = int((last.floor("min") - first.floor("min")) / pd.Timedelta(minutes=1)) + 1
+    spec = feature_spec(minutes)
+    columns = feature_columns(spec)
+    n_rows = minutes - max(spec["lags"])
+    if n_rows < 50:
+        log.append(f"  → Not enough data after features: {max(n_rows, 0)}")
+        return log, None, None, time.perf_counter() - t0
 
-    # Save model
     safe_name = fuse.replace("/", "_")
-    model.save_model(models_dir / f"xgboost_{safe_name}.json")
+    model_path = models_dir / f"xgboost_{safe_name}.json"
+    meta_path = models_dir / f"xgboost_{safe_name}.meta.json"
+    meta = load_meta(meta_path) if model_path.exists() else None
+    source = source_fingerprint(entity_files(fuse, start=filters["start"], end=filters["end"]))
+    if (TRAIN_MODE == "incremental" and meta is not None
+            and meta.get("source") == source and meta.get("features") == spec):
+        log.append("  → Data unchanged since last training → skipped")
+        result = {'fuse': fuse, 'mae': meta['mae'], 'rmse': meta['rmse'], 'points': meta['rows'], 'training': "skip"}
+        return log, result, None, time.perf_counter() - t0
 
-    # Plot last 6 hours
-    n = min(360, len(pred))
-    plt.figure(figsize=(14, 5))
-    plt.plot(y_test.index[-n:], y_test.values[-n:], label="Actual", linewidth=1.8)
-    plt.plot(y_test.index[-n:], pred[-n:], label=f"Forecast (RMSE {rmse:.0f}W)", linewidth=1.8, alpha=0.9)
-    plt.title(f"{fuse} — Last 6 Hours Minutely Forecast")
-    plt.ylabel("Power (W)")
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-    plt.savefig(plots_dir / f"forecast_6h_{safe_name}.png", dpi=300)
-    plt.close()
-
-# === Summary ===
-if results:
-    results_df = pd.DataFrame(results).sort_values('rmse')
-    print("\n" + "="*80)
-    print("PER-FUSE MINUTELY FORECASTING RESULTS")
-    print("="*80)
-    print(results_df.to_string(index=False, float_format="%.1f"))
-    results_df.to_csv(project_root / "results" / "per_fuse_results.csv", index=False)
-else:
-    print("\nNo fuse had enough data for training.")
-
-print(f"\nModels → models/per_fuse/")
-print(f"Plots → results/plots/per_fuse/")
+    def chunks(lo, hi=None):
+        batches = iter_entity_batches(fuse, filters["start"], filters["end"], batch_rows=BATCH_ROWS)
+        return select_rows(stream_features(batches, spec), lo, hi)
+
+    # Train/test split (approximate row count from the Parquet statistics)
+    split = int(0.8 * n_rows)
+    log.append(f"  → Streaming {split} training | {n_rows - split} test minutes "
+               f"in batches of {BATCH_ROWS:,} rows ({n_jobs} thread(s))")
+
+    cache = extmem_dir / safe_name
+    shutil.rmtree(cache, ignore_errors=True)
+    cache.mkdir(parents=True)
+    try:
+        train_iter = FeatureBatches(lambda: chunks(0, split), columns, str(cache / "train"))
+        if hasattr(xgb, "ExtMemQuantileDMatrix"):   # xgboost >= 3.0
+            dtrain = xgb.ExtMemQuantileDMatrix(train_iter, nthread=n_jobs)
+        else:
+            dtrain = xgb.DMatrix(train_iter, nthread=n_jobs)
+        params = {"learning_rate": 0.05, "max_depth": 5, "subsample": 0.8, "seed": 42,
+                  "nthread": n_jobs, "tree_method": "hist", "objective": "reg:squarederror"}
+        booster = xgb.train(params, dtrain, num_boost_round=N_ESTIMATORS)
+        del dtrain, train_iter
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+
+    # Streaming evaluation: running error sums, the last 6 hours kept for the plot
+    n, abs_err, sq_err = 0, 0.0, 0.0
+    tail = deque()
+    tail_rows = 0
+    for _, index, X, y in chunks(split):
+        pred = booster.inplace_predict(X)
+        err = pred.astype(np.float64) - y
+        n += len(y)
+        abs_err += np.abs(err).sum()
+        sq_err += (err ** 2).sum()
+        tail.append((index, y, pred))
+        tail_rows += len(y)
+        while tail_rows - len(tail[0][1]) >= 360:
+            tail_rows -= len(tail.popleft()[1])
+    if n == 0:
+        log.append("  → No test rows after streaming")
+        return log, None, None, time.perf_counter() - t0
+    mae, rmse = abs_err / n, np.sqrt(sq_err / n)
+
+    log.append(f"  → {fuse} | MAE: {mae:.1f}W | RMSE: {rmse:.1f}W")
+
+    booster.save_model(model_path)
+    meta_path.write_text(json.dumps({
+        "rows": minutes,
+        "start": first.floor("min").isoformat(),
+        "end": last.floor("min").isoformat(),
+        "source": source,
+        "features": spec,
+        "train_rows": split,
+        "n_estimators": N_ESTIMATORS,
+        "mae": float(mae),
+        "rmse": float(rmse),
+    }, indent=2))
+
+    index = pd.DatetimeIndex(np.concatenate([t[0] for t in tail]))[-360:]
+    plot = (index, np.concatenate([t[1] for t in tail])[-360:], np.concatenate([t[2] for t in tail])[-360:])
+    result = {'fuse': fuse, 'mae': mae, 'rmse': rmse, 'points': minutes, 'training': "full"}
+    return log, result, plot, time.perf_counter() - t0
+
+
+def main(matrix_loader=load_matrix):
+    """matrix_loader: the in-process runner passes one that shares the loaded FuseMatrix between stages."""
+    if TRAIN_MODE not in ("incremental", "full"):
+        print(f"ERROR: TRAIN_MODE must be 'incremental' or 'full', got '{TRAIN_MODE}'")
+        return 1
+    if COMPARE and TRAIN_MODE != "full":
+        print("ERROR: TRAIN_COMPARE=1 needs TRAIN_MODE=full (incremental runs skip the fuses the first run trained)")
+        return 1
+    metrics = StageMetrics("train_forecast")
+    filters = env_filters()
+    if EXTERNAL_MEMORY:
+        # Row counts and time ranges from the Parquet footers only
+        with metrics.step("archive_scan"):
+            infos = archive_entities(start=filters["start"], end=filters["end"])
+        if not infos:
+            print("ERROR: Archive is empty, nothing to train on")
+            return 1
+        print(f"Data range: {min(i[1] for i in infos.values())} → {max(i[2] for i in infos.values())} "
+              f"(streamed in batches of {BATCH_ROWS:,} rows)")
+        samples = {fuse: info[0] for fuse, info in infos.items()}
+    else:
+        # Minute-aligned, gap-filled time × fuse matrix (cached, memory-mapped)
+        with metrics.step("matrix_load") as step:
+            matrix = matrix_loader(start=filters["start"], end=filters["end"])
+            step.rows = len(matrix)
+        print(f"Data range: {matrix.index[0]} → {matrix.index[-1]} ({len(matrix):,} minutes)")
+        with metrics.step("features", rows=len(matrix)):
+            features = load_features(matrix)
+        samples = matrix.samples
+    print(f"Total measurements: {sum(samples.values()):,}")
+
+    fuses = [f for f in sorted(samples) if filters["entities"] is None or f in filters["entities"]]
+    print(f"Found {len(fuses)} fuses")
+
+    trainable = []
+    for fuse in fuses:
+        if samples[fuse] < 100:
+            print(f"  → Skipping {fuse}: only {samples[fuse]} points")
+        else:
+            trainable.append(fuse)
+
+    workers = TRAIN_WORKERS or max(1, min(len(trainable), CPUS // 2))
+    n_jobs = max(1, CPUS // workers)
+    print(f"Training {len(trainable)} fuses ({TRAIN_MODE}{', external memory' if EXTERNAL_MEMORY else ''}) "
+          f"with {workers} worker(s) × {n_jobs} XGBoost thread(s)")
+
+    def make_jobs(n_jobs):
+        if EXTERNAL_MEMORY:
+            return {fuse: (train_fuse_streaming, fuse, infos[fuse], filters, n_jobs) for fuse in trainable}
+        return {fuse: (train_fuse, matrix.path, features.path, fuse, n_jobs) for fuse in trainable}
+
+    jobs = make_jobs(n_jobs)
+
+    # Figures are drawn in the background as soon as their fuse is trained
+    plots = PlotWriter(metrics=metrics)
+    outcomes = {}
+
+    def finished(fuse, outcome):
+        outcomes[fuse] = outcome
+        _, result, plot, _ = outcome
+        if plot is not None:
+            safe_name = fuse.replace("/", "_")
+            plots.forecast(plots_dir / f"forecast_6h_{safe_name}.png", fuse, *plot, result['rmse'])
+
+    t_start = time.perf_counter()
+    if workers == 1:
+        for fuse, (fn, *args) in jobs.items():
+            finished(fuse, fn(*args))
+    else:
+        # spawn: forking after OpenMP has started can deadlock XGBoost
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = {pool.submit(*job): fuse for fuse, job in jobs.items()}
+            for future in as_completed(futures):
+                finished(futures[future], future.result())
+    wall = time.perf_counter() - t_start
+    metrics.record("train_all", wall, len(jobs))
+
+    # Report in fuse order, whatever order the workers finished in
+    results = []
+    for fuse in trainable:
+        log, result, plot, seconds = outcomes[fuse]
+        # Per-fuse fit in the worker: its wall time, the minutes it covers
+        metrics.record(f"fit:{fuse}", seconds, result['points'] if result else 0)
+        print(f"\nTraining model for: {fuse} ({seconds:.1f}s)")
+        print("\n".join(log))
+        if result is not None:
+            results.append(result)
+
+    fit_total = sum(o[3] for o in outcomes.values())
+    print(f"\nTraining wall time: {wall:.1f}s with {workers} worker(s) | sum of per-fuse times: {fit_total:.1f}s")
+    if COMPARE and workers > 1:
+        # Same fuses again on the sequential path; its models replace the identical parallel ones
+        print(f"Sequential baseline: {len(jobs)} fuses with 1 worker × {CPUS} XGBoost thread(s)...")
+        t_seq = time.perf_counter()
+        for fn, *args in make_jobs(CPUS).values():
+            fn(*args)
+        wall_seq = time.perf_counter() - t_seq
+        metrics.record("train_all_sequential", wall_seq, len(jobs))
+        print(f"Sequential wall time: {wall_seq:.1f}s → speedup {wall_seq / max(wall, 1e-9):.2f}× "
+              f"with {workers} workers")
+    elif COMPARE:
+        print("TRAIN_COMPARE=1: training already ran sequentially (1 worker), nothing to compare")
+
+    # === Summary ===
+    if results:
+        results_df = pd.DataFrame(results).sort_values('rmse')
+        print("\n" + "="*80)
+        print("PER-FUSE MINUTELY FORECASTING RESULTS")
+        print("="*80)
+        print(results_df.to_string(index=False, float_format="%.1f"))
+        results_df.to_csv(RESULTS_DIR / "per_fuse_results.csv", index=False)
+    else:
+        print("\nNo fuse had enough data for training.")
+
+    plot_s = plots.close()
+    print(f"\nModels → {models_dir}/")
+    print(f"Plots → {plots_dir}/ ({plots.count} {plots.mode}, all done {plot_s:.1f}s after the first was queued)")
+    metrics.close(rows=sum(r['points'] for r in results))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# code/machine_learning/perf_metrics.py
+# Per-stage performance metrics as structured JSON.
+#
+# results/metrics/<run>.json
+#   {"run": ..., "stages": {"<stage>": {
+#       "wall_s", "cpu_s", "peak_rss_mb", "children_peak_rss_mb", "rows", "rows_per_s",
+#       "steps": {"<step>": {"count", "wall_s", "cpu_s", "max_s", "rows", "rows_per_s"}}}}}
+#
+# cpu_s includes finished child processes (training / plot workers); peak_rss_mb is
+# the peak of the process so far, so under PIPELINE_RUNNER=inprocess it carries over
+# from earlier stages.
+#
+# All scripts of one pipeline run share PIPELINE_RUN_ID (set by project.py and the
+# runners), so their stages land in one file; a script started on its own gets a
+# run id of its own. Each stage merges itself into the file under an fcntl lock.
+#
+#   metrics = StageMetrics("export")
+#   with metrics.step("influx_query") as step:
+#       step.rows = points
+#   metrics.record("insert_batch", seconds, rows)   # timed elsewhere (threads, workers)
+#   metrics.close(rows=total)                        → results/metrics/<run>.json
+#
+# Compare two runs (default: the last two), exit code 1 when something regressed:
+#   python perf_metrics.py compare [old_run] [new_run]
+#   python perf_metrics.py list
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+    import resource
+except ImportError:  # not on Linux/macOS: no lock, no peak RSS
+    fcntl = resource = None
+
+project_root = Path(__file__).parent.parent.parent
+METRICS_DIR = project_root / os.getenv("RESULTS_DIR", "results") / "metrics"
+
+ENABLED = os.getenv("PERF_METRICS", "1") == "1"
+THRESHOLD = float(os.getenv("PERF_REGRESSION_THRESHOLD", "0.2"))   # relative change flagged as regression
+MIN_SECONDS = float(os.getenv("PERF_MIN_SECONDS", "0.5"))          # ignore timings below this (noise)
+MIN_RSS_MB = 10.0
+
+
+def run_id():
+    """Run id shared by every stage of one pipeline run (PIPELINE_RUN_ID), set on first use."""
+    if not os.getenv("PIPELINE_RUN_ID"):
+        os.environ["PIPELINE_RUN_ID"] = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    return os.environ["PIPELINE_RUN_ID"]
+
+
+def _cpu_seconds():
+    """CPU time of this process plus its finished children (pool workers)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _peak_rss_mb(who):
+    if resource is None:
+        return None
+    kb = resource.getrusage(who).ru_maxrss
+    return round(kb / 1024 / (1024 if sys.platform == "darwin" else 1), 1)  # bytes on macOS
+
+
+class _Step:
+    rows = 0
+
+
+class StageMetrics:
+    def __init__(self, stage):
+        self.stage = stage
+        self.steps = {}
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.cpu0 = _cpu_seconds()
+        self.closed = False
+
+    def record(self, name, seconds, rows=0, cpu_seconds=0.0):
+        with self.lock:
+            s = self.steps.setdefault(name, {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "max_s": 0.0, "rows": 0})
+            s["count"] += 1
+            s["wall_s"] += seconds
+            s["cpu_s"] += cpu_seconds
+            s["max_s"] = max(s["max_s"], seconds)
+            s["rows"] += int(rows)
+
+    @contextmanager
+    def step(self, name, rows=0):
+        """Time a block; CPU time is that of the calling thread. Set .rows on the yielded object."""
+        step = _Step()
+        step.rows = rows
+        t0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            yield step
+        finally:
+            self.record(name, time.perf_counter() - t0, step.rows, time.thread_time() - cpu0)
+
+    def summary(self, rows=0):
+        wall = time.perf_counter() - self.t0
+        steps = {}
+        for name, s in self.steps.items():
+            steps[name] = {**{k: round(v, 4) if isinstance(v, float) else v for k, v in s.items()},
+                           "rows_per_s": round(s["rows"] / s["wall_s"], 1) if s["rows"] and s["wall_s"] else None}
+        return {
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "wall_s": round(wall, 3),
+            "cpu_s": round(_cpu_seconds() - self.cpu0, 3),
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+            "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            "rows": int(rows),
+            "rows_per_s": round(rows / wall, 1) if rows and wall else None,
+            "steps": steps,
+        }
+
+    def close(self, rows=0):
+        """Merge this stage into results/metrics/<run>.json; returns the path (None when disabled)."""
+        if self.closed or not ENABLED:
+            return None
+        self.closed = True
+        run = run_id()
+        path = METRICS_DIR / f"{run}.json"
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        with open(METRICS_DIR / ".lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # stages of one run may finish at the same time
+            doc = json.loads(path.read_text()) if path.exists() else {"run": run, "stages": {}}
+            doc["stages"][self.stage] = self.summary(rows)
+            tmp = path.with_name(f".{path.name}.tmp")
+            tmp.write_text(json.dumps(doc, indent=2))
+            os.replace(tmp, path)
+        print(f"Metrics → {path} [{self.stage}]")
+        return path
+
+
+# === Comparing runs ===
+def list_runs():
+    return sorted(METRICS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+
+
+def _load(run):
+    path = Path(run)
+    if not path.exists():
+        path = METRICS_DIR / f"{run}.json"
+    return json.loads(path.read_text())
+
+
+def _changes(old, new, prefix):
+    """(metric, old, new, relative change, how much worse, significant) for the numbers of a stage/step.
+
+    Changes are significant only above the noise floors: timings under PERF_MIN_SECONDS,
+    RSS under 10 MB and the throughput of such short steps are not compared.
+    """
+    out = []
+    for key, higher_is_worse, floor in (("wall_s", True, MIN_SECONDS), ("cpu_s", True, MIN_SECONDS),
+                                        ("peak_rss_mb", True, MIN_RSS_MB), ("rows_per_s", False, 0.0)):
+        a, b = old.get(key), new.get(key)
+        if not a or b is None:
+            continue
+        change = (b - a) / a
+        worse = change if higher_is_worse else -change
+        short = max(old.get("wall_s") or 0, new.get("wall_s") or 0) < MIN_SECONDS
+        significant = abs(change) > THRESHOLD and max(a, b) >= floor and not (key == "rows_per_s" and short)
+        out.append((f"{prefix}.{key}", a, b, change, worse, significant))
+    return out
+
+
+def compare(old_run, new_run):
+    old, new = _load(old_run), _load(new_run)
+    print(f"Comparing {old['run']} → {new['run']} (regression: > {THRESHOLD:.0%} worse)")
+    rows = []
+    for stage in sorted(set(old["stages"]) & set(new["stages"])):
+        a, b = old["stages"][stage], new["stages"][stage]
+        rows += _changes(a, b, stage)
+        for step in sorted(set(a["steps"]) & set(b["steps"])):
+            rows += _changes(a["steps"][step], b["steps"][step], f"{stage}/{step}")
+    for stage in sorted(set(old["stages"]) ^ set(new["stages"])):
+        print(f"  {stage}: only in {'old' if stage in old['stages'] else 'new'} run")
+
+    regressions = [r for r in rows if r[5] and r[4] > 0]
+    for name, a, b, change, worse, significant in rows:
+        if significant:
+            flag = "REGRESSION" if worse > 0 else "improved"
+            print(f"  {name:<50} {a:>12,.2f} → {b:>12,.2f}  {change:+7.1%}  {flag}")
+    print(f"{len(regressions)} regression(s) in {len(rows)} compared metrics")
+    return 1 if regressions else 0
+
+
+def main(argv):
+    command = argv[0] if argv else "compare"
+    if command == "list":
+        for path in list_runs():
+            doc = json.loads(path.read_text())
+            print(f"  {doc['run']:<32} {', '.join(doc['stages'])}")
+        return 0
+    if command == "compare":
+        if len(argv) >= 3:
+            return compare(argv[1], argv[2])
+        runs = list_runs()
+        if len(runs) < 2:
+            print(f"Need two runs in {METRICS_DIR}/ to compare, found {len(runs)}")
+            return 1
+        return compare(runs[-2], runs[-1])
+    print("Usage: perf_metrics.py compare [old_run new_run] | list")
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
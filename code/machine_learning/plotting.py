@@ -0,0 +1,264 @@
+# code/machine_learning/plotting.py
+# Plot output for the ML scripts: series are decimated to screen resolution and the
+# figures are drawn in a process pool, off the training loop.
+#
+# PLOT_MODE:
+#   png   draw PNGs (default)
+#   data  write the decimated, plot-ready series instead (PLOT_DATA_FORMAT=parquet|json)
+#   none  skip plotting
+# PLOT_POINTS:   points kept per line (min/max keeps 2 per bucket, so ~2 × figure width in px)
+# PLOT_DECIMATE: minmax (keeps every spike) | lttb (Largest-Triangle-Three-Buckets, smoother)
+# PLOT_WORKERS:  render processes (0 = draw in the calling process)
+# PLOT_DPI:      PNG resolution
+#
+#   with PlotWriter() as plots:
+#       plots.forecast(path, fuse, index, actual, pred, rmse)
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PLOT_MODE = os.getenv("PLOT_MODE", "png")
+PLOT_POINTS = int(os.getenv("PLOT_POINTS", "4000"))
+PLOT_DECIMATE = os.getenv("PLOT_DECIMATE", "minmax")
+PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PLOT_DPI = int(os.getenv("PLOT_DPI", "300"))
+PLOT_DATA_FORMAT = os.getenv("PLOT_DATA_FORMAT", "parquet")
+
+
+# === Decimation ===
+def minmax_decimate(x, y, n_out):
+    """Keep the min and the max of each of n_out // 2 equal buckets, in time order."""
+    n = len(y)
+    if n <= n_out:
+        return x, y
+    size = -(-n // max(n_out // 2, 1))  # ceil
+    buckets = -(-n // size)
+    y = np.asarray(y, dtype=np.float64)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    grid = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    lo = np.argmin(np.where(np.isnan(grid), np.inf, grid), axis=1) + offsets
+    hi = np.argmax(np.where(np.isnan(grid), -np.inf, grid), axis=1) + offsets
+    keep = np.unique(np.concatenate([lo, hi]))
+    return x[keep], y[keep]
+
+
+def lttb_decimate(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: keep the point of each bucket that spans the
+    largest triangle with the previously kept point and the next bucket's mean."""
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return x, y
+    xs = np.arange(n, dtype=np.float64)  # equally spaced minutes: position is enough
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nxt_lo, nxt_hi = hi, min(max(edges[i + 2] if i + 2 < len(edges) else n, hi + 1), n)
+        cx, cy = xs[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        area = np.abs((xs[a] - cx) * (y[lo:hi] - y[a]) - (xs[a] - xs[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+
+def decimate(x, y, n_out=PLOT_POINTS, method=PLOT_DECIMATE):
+    x, y = np.asarray(x), np.asarray(y)
+    return lttb_decimate(x, y, n_out) if method == "lttb" else minmax_decimate(x, y, n_out)
+
+
+def on_intervals(index, mask):
+    """Runs of True in mask → (starts, ends), each run covering its minutes in full."""
+    mask = np.asarray(mask, dtype=bool)
+    change = np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8))
+    starts, ends = np.flatnonzero(change == 1), np.flatnonzero(change == -1) - 1
+    index = pd.DatetimeIndex(index)
+    return index[starts].to_numpy(), (index[ends] + pd.Timedelta(minutes=1)).to_numpy()
+
+
+# === Figures (run in the pool workers) ===
+def draw_forecast(payload, path, dpi):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    meta = payload["meta"]
+    plt.figure(figsize=(14, 5))
+    x, y = payload["lines"]["Actual"]
+    plt.plot(x, y, label="Actual", linewidth=1.8)
+    x, y = payload["lines"]["Forecast"]
+    plt.plot(x, y, label=f"Forecast (RMSE {meta['rmse']:.0f}W)", linewidth=1.8, alpha=0.9)
+    plt.title(f"{meta['fuse']} — Last 6 Hours Minutely Forecast")
+    plt.ylabel("Power (W)")
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    plt.tight_layout()
+    plt.savefig(path, dpi=dpi)
+    plt.close()
+
+
+def draw_nilm(payload, path, dpi):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    meta = payload["meta"]
+    plt.figure(figsize=(18, 9))
+
+    ax1 = plt.gca()
+    x, y = payload["lines"]["Total Power"]
+    ax1.plot(x, y, label='Total Power', color='gray', alpha=0.6, linewidth=1)
+    ax1.set_ylabel("Total Power (W)", color='gray', fontsize=12)
+    ax1.tick_params(axis='y', labelcolor='gray')
+
+    # ON periods as spans: one collection per state instead of a fill over every minute
+    top = meta["total_max"]
+    for label, color, alpha in (("True ON", '#2ca02c', 0.5), ("Predicted ON", '#b2df8a', 0.6)):
+        starts, ends = payload["spans"][label]
+        s, e = mdates.date2num(starts), mdates.date2num(ends)
+        ax1.broken_barh(list(zip(s, e - s)), (0, top), facecolors=color, alpha=alpha, label=label)
+
+    if meta.get("holdout_start") is not None:
+        ax1.axvline(pd.Timestamp(meta["holdout_start"]), color='black', linestyle=':', linewidth=1.5,
+                    label='Holdout start')
+
+    ax1.set_title(f"TRUE MINUTELY NILM — {meta['name']}\n"
+                  f"Entity ID: {meta['fuse']} | Holdout accuracy: {meta['accuracy']:.1%} | "
+                  f"Threshold: {meta['threshold']}W\n"
+                  f"From Total Power Only",
+                  fontsize=18, pad=30, fontweight='bold')
+    ax1.set_xlabel("Time", fontsize=14)
+    ax1.grid(True, alpha=0.3)
+
+    # Appliance power
+    ax2 = ax1.twinx()
+    x, y = payload["lines"]["Appliance Power"]
+    ax2.plot(x, y, color='#1f77b4', linewidth=1.8, label='Appliance Power')
+    ax2.axhline(meta["threshold"], color='red', linestyle='--', linewidth=2,
+                label=f"Threshold {meta['threshold']}W")
+    ax2.set_ylabel(f"{meta['name']} Power (W)", color='#1f77b4', fontsize=12)
+    ax2.tick_params(axis='y', labelcolor='#1f77b4')
+
+    # Combined legend
+    lines1, labels1 = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines1 + lines2, labels1 + labels2, loc='upper right', fontsize=11)
+
+    plt.tight_layout()
+    plt.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close()
+
+
+DRAW = {"forecast": draw_forecast, "nilm": draw_nilm}
+
+
+# === Plot-ready data ===
+def write_data(payload, path, fmt=PLOT_DATA_FORMAT):
+    """Decimated lines + ON spans of one figure as Parquet (long format) or JSON."""
+    if fmt == "json":
+        doc = {
+            "meta": payload["meta"],
+            "lines": {k: {"timestamp": pd.DatetimeIndex(x).strftime("%Y-%m-%dT%H:%M:%S").tolist(),
+                          "value": np.round(np.asarray(y, dtype=np.float64), 3).tolist()}
+                      for k, (x, y) in payload["lines"].items()},
+            "spans": {k: {"start": pd.DatetimeIndex(s).strftime("%Y-%m-%dT%H:%M:%S").tolist(),
+                          "end": pd.DatetimeIndex(e).strftime("%Y-%m-%dT%H:%M:%S").tolist()}
+                      for k, (s, e) in payload.get("spans", {}).items()},
+        }
+        path.write_text(json.dumps(doc, default=str))
+        return
+    frames = [pd.DataFrame({"series": k, "timestamp": x, "value": np.asarray(y, dtype=np.float64)})
+              for k, (x, y) in payload["lines"].items()]
+    frames += [pd.DataFrame({"series": k, "timestamp": s, "end": e})
+               for k, (s, e) in payload.get("spans", {}).items()]
+    pd.concat(frames, ignore_index=True).to_parquet(path, index=False)
+    path.with_suffix(".meta.json").write_text(json.dumps(payload["meta"], default=str, indent=2))
+
+
+# === Writer ===
+class PlotWriter:
+    """Decimates in the calling process, draws PNGs in a process pool (or writes data)."""
+
+    def __init__(self, mode=PLOT_MODE, workers=PLOT_WORKERS, dpi=PLOT_DPI, metrics=None):
+        if mode not in ("png", "data", "none"):
+            raise ValueError(f"PLOT_MODE must be 'png', 'data' or 'none', got '{mode}'")
+        self.mode, self.dpi = mode, dpi
+        self.metrics = metrics  # perf_metrics.StageMetrics of the calling stage, optional
+        self.futures = []
+        self.count = 0
+        self.t0 = time.perf_counter()
+        self.pool = None
+        if mode == "png" and workers > 0:
+            # spawn: the callers may have started OpenMP threads (XGBoost, scikit-learn)
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _record(self, name, t0, rows=0):
+        if self.metrics is not None:
+            self.metrics.record(name, time.perf_counter() - t0, rows)
+
+    def submit(self, kind, path, payload, prepared=None):
+        """prepared: (start time, input points) of the decimation, for the metrics."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.count += 1
+        if prepared is not None:
+            self._record("plot_decimate", *prepared)
+        t0 = time.perf_counter()
+        if self.mode == "data":
+            suffix = ".json" if PLOT_DATA_FORMAT == "json" else ".parquet"
+            write_data(payload, path.with_suffix(suffix))
+            self._record("plot_write_data", t0)
+        elif self.pool is not None:
+            self.futures.append(self.pool.submit(DRAW[kind], payload, path, self.dpi))
+        else:
+            DRAW[kind](payload, path, self.dpi)
+            self._record("plot_render", t0)
+
+    def forecast(self, path, fuse, index, actual, pred, rmse):
+        if self.mode == "none":
+            return
+        t0 = time.perf_counter()
+        self.submit("forecast", path, {
+            "meta": {"fuse": fuse, "rmse": float(rmse)},
+            "lines": {"Actual": decimate(index, actual), "Forecast": decimate(index, pred)},
+        }, (t0, 2 * len(index)))
+
+    def nilm(self, path, name, fuse, index, total, app_power, true_on, pred_on, accuracy, threshold,
+             holdout_start=None):
+        if self.mode == "none":
+            return
+        t0 = time.perf_counter()
+        self.submit("nilm", path, {
+            "meta": {"name": name, "fuse": fuse, "accuracy": float(accuracy), "threshold": threshold,
+                     "total_max": float(np.max(total)), "holdout_start": holdout_start},
+            "lines": {"Total Power": decimate(index, total), "Appliance Power": decimate(index, app_power)},
+            "spans": {"True ON": on_intervals(index, true_on), "Predicted ON": on_intervals(index, pred_on)},
+        }, (t0, 2 * len(index)))
+
+    def close(self):
+        """Wait for pending figures; returns seconds since the writer was created."""
+        if self.pool is not None:
+            t0 = time.perf_counter()
+            for future in self.futures:
+                future.result()
+            self.pool.shutdown()
+            self.pool = None
+            self._record("plot_render_wait", t0, len(self.futures))
+        return time.perf_counter() - self.t0
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 # code/machine_learning/run_machine_learning.py
 # FINAL — Runs all ML scripts in correct order
+# PIPELINE_RUNNER=dag:       forecast and NILM run side by side, up-to-date stages skipped → code/pipeline_dag.py
+# PIPELINE_RUNNER=inprocess: all scripts in this interpreter, imports and fuse matrix shared → inprocess_runner.py
 
+import os
 import subprocess
 import sys
 from pathlib import Path
@@ -11,55 +14,83 @@ from datetime import datetime
 SCRIPTS = [
     "export_full_archive.py",
     "per_fuse_minutely_forecast_xgboost.py",
+    "forecast_engine.py",
     "nilm_per_fuse_detection.py"
 ]
 
 # === Get this directory (machine_learning/) ===
 script_dir = Path(__file__).parent.resolve()
 
-print(f"[{datetime.now().strftime('%H:%M:%S')}] Starting Machine Learning Pipeline")
-print(f"Running from: {script_dir}")
-print("-" * 80)
 
-for script in SCRIPTS:
-    script_path = script_dir / script
-    
-    if not script_path.exists():
-        print(f"ERROR: Script not found: {script_path}")
-        print("Available scripts:")
-        for p in script_dir.glob("*.py"):
-            if p.name != "__init__.py":
-                print(f"  • {p.name}")
-        sys.exit(1)
-    
-    print(f"\n→ Running: {script}")
-    print(f"   {script_path}")
-    
-    result = subprocess.run(
-        [sys.executable, str(script_path)],
-        capture_output=True,
-        text=True,
-        cwd=script_dir
-    )
-    
-    if result.returncode != 0:
-        print(f"FAILED: {script}")
-        print("STDOUT:")
-        print(result.stdout)
-        print("STDERR:")
-        print(result.stderr)
-        sys.exit(1)
+def run_subprocesses():
+    for script in SCRIPTS:
+        script_path = script_dir / script
+        
+        if not script_path.exists():
+            print(f"ERROR: Script not found: {script_path}")
+            print("Available scripts:")
+            for p in script_dir.glob("*.py"):
+                if p.name != "__init__.py":
+                    print(f"  • {p.name}")
+            sys.exit(1)
+        
+        print(f"\n→ Running: {script}")
+        print(f"   {script_path}")
+        
+        result = subprocess.run(
+            [sys.executable, str(script_path)],
+            capture_output=True,
+            text=True,
+            cwd=script_dir
+        )
+        
+        if result.returncode != 0:
+            print(f"FAILED: {script}")
+            print("STDOUT:")
+            print(result.stdout)
+            print("STDERR:")
+            print(result.stderr)
+            sys.exit(1)
+        else:
+            output = result.stdout.strip()
+            if output:
+                print(output)
+
+
+def main():
+    # One results/metrics/<run>.json for every stage of this run (inherited by the scripts)
+    os.environ.setdefault("PIPELINE_RUN_ID", datetime.now().strftime("%Y%m%d-%H%M%S"))
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] Starting Machine Learning Pipeline")
+    print(f"Running from: {script_dir}")
+    print("-" * 80)
+
+    runner = os.getenv("PIPELINE_RUNNER", "sequential")
+    if runner == "dag":
+        sys.path.insert(0, str(script_dir.parent))
+        from pipeline_dag import ML_STAGES, run_pipeline
+
+        if run_pipeline(targets=ML_STAGES) != 0:
+            sys.exit(1)
+    elif runner == "inprocess":
+        from inprocess_runner import run_inprocess
+
+        if run_inprocess([script_dir / s for s in SCRIPTS]) != 0:
+            sys.exit(1)
     else:
-        output = result.stdout.strip()
-        if output:
-            print(output)
+        run_subprocesses()
+
+    print("\n" + "="*80)
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] MACHINE LEARNING PIPELINE COMPLETED!")
+    print("="*80)
+    print("   • Full dataset exported")
+    print("   • Per-fuse minutely XGBoost models trained")
+    print("   • Next-hour forecast saved in results/forecast_latest.csv")
+    print("   • NILM (Non-Intrusive Load Monitoring) detection!")
+    print("   • All plots saved in results/plots/")
+    print("   • Models saved in models/per_fuse/")
+    print("="*80)
+
 
-print("\n" + "="*80)
-print(f"[{datetime.now().strftime('%H:%M:%S')}] MACHINE LEARNING PIPELINE COMPLETED!")
-print("="*80)
-print("   • Full dataset exported")
-print("   • Per-fuse minutely XGBoost models trained")
-print("   • NILM (Non-Intrusive Load Monitoring) detection!")
-print("   • All plots saved in results/plots/")
-print("   • Models saved in models/per_fuse/")
-print("="*80)
\ No newline at end of file
+# Guarded: spawn-based process pools of in-process stages re-import the main module
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# code/migrate_archive_v2.py
+# Online copy of the v1 fuse archive (TABLE_NAME) into the v2 layout, see machine_learning/archive_schema.py.
+#
+#   python3 code/migrate_archive_v2.py                       → create the v2 tables, copy, verify
+#   python3 code/migrate_archive_v2.py verify                → compare the row counts per fuse
+#   python3 code/migrate_archive_v2.py drop-before 2024-01   → drop the v2 months before January 2024
+#
+# The copy runs inside MariaDB (INSERT ... SELECT) over id ranges of MIGRATE_BATCH_ROWS,
+# one transaction per range together with its position in <TABLE_NAME>_v2_migration,
+# so an interrupted copy resumes where it stopped. The v1 table stays in use: rows the
+# export adds meanwhile are copied by the last ranges, which run until the copy has
+# caught up with MAX(id).
+#
+# Afterwards set ARCHIVE_SCHEMA=v2: export_fuse_data.py then writes to the v2 table,
+# resuming from what was copied, and the readers use the v2 view.
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, str(Path(__file__).parent / "machine_learning"))
+from archive_schema import create_v2, drop_partitions_before, ensure_partitions, v2_tables
+
+# === Load .env ===
+env_path = Path(__file__).parent.parent / "env" / ".env"
+load_dotenv(dotenv_path=env_path)
+
+# === Config ===
+DB_USER = os.getenv("MARIADB_USER")
+DB_PASS = os.getenv("MARIADB_PASSWORD")
+DB_HOST = os.getenv("MARIADB_HOST", "192.168.188.74")
+DB_PORT = os.getenv("MARIADB_PORT", "3306")
+DB_NAME = os.getenv("MARIADB_DATABASE", "homeassistant")
+TABLE_NAME = os.getenv("TABLE_NAME", "energy_fuse_archive")
+
+BATCH_ROWS = int(os.getenv("MIGRATE_BATCH_ROWS", "50000"))          # v1 ids per INSERT ... SELECT
+PAUSE_SECONDS = float(os.getenv("MIGRATE_PAUSE_SECONDS", "0.2"))    # between ranges, leaves room for the export
+MONTHS_AHEAD = int(os.getenv("ARCHIVE_PARTITION_MONTHS_AHEAD", "2"))
+
+DB_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+V2 = v2_tables(TABLE_NAME)
+CHECKPOINT_TABLE = f"{V2['data']}_migration"
+
+
+# === Copy ===
+def copy_range(conn, low, high):
+    """Copy the v1 rows with low < id <= high → rows written. New fuses get their id first."""
+    range_params = {"low": low, "high": high}
+    conn.execute(text(f"""
+        INSERT INTO {V2['entities']} (name)
+        SELECT DISTINCT s.entity_id FROM {TABLE_NAME} s
+        LEFT JOIN {V2['entities']} e ON e.name = s.entity_id
+        WHERE s.id > :low AND s.id <= :high AND e.entity_id IS NULL
+    """), range_params)
+    written = conn.execute(text(f"""
+        INSERT IGNORE INTO {V2['data']} (entity_id, timestamp, value_w)
+        SELECT e.entity_id, s.timestamp, s.value_w
+        FROM {TABLE_NAME} s JOIN {V2['entities']} e ON e.name = s.entity_id
+        WHERE s.id > :low AND s.id <= :high
+    """), range_params).rowcount
+    conn.execute(text(f"""
+        INSERT INTO {CHECKPOINT_TABLE} (source, last_id) VALUES (:source, :high)
+        ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)
+    """), {"source": TABLE_NAME, "high": high})
+    return written
+
+
+def copy(engine):
+    with engine.begin() as conn:
+        first_id, max_id, first_ts = conn.execute(
+            text(f"SELECT MIN(id), MAX(id), MIN(timestamp) FROM {TABLE_NAME}")).one()
+        if max_id is None:
+            print(f"`{TABLE_NAME}` is empty → nothing to copy")
+            return 0
+        create_v2(conn, TABLE_NAME, first_month=first_ts, months_ahead=MONTHS_AHEAD)
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                source VARCHAR(64) NOT NULL PRIMARY KEY,
+                last_id BIGINT NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """))
+        last_id = conn.execute(text(f"SELECT last_id FROM {CHECKPOINT_TABLE} WHERE source = :source"),
+                               {"source": TABLE_NAME}).scalar()
+    print(f"Tables `{V2['data']}` + `{V2['entities']}` + view `{V2['view']}` ready "
+          f"(monthly partitions from {first_ts:%Y-%m})")
+
+    if last_id is None:
+        last_id = first_id - 1
+    else:
+        print(f"Resuming after id {last_id:,} (of {max_id:,})")
+
+    total, started = 0, time.perf_counter()
+    while True:
+        if last_id >= max_id:
+            with engine.connect() as conn:
+                max_id = conn.execute(text(f"SELECT MAX(id) FROM {TABLE_NAME}")).scalar()
+            if last_id >= max_id:
+                break  # caught up, also with rows the export added during the copy
+        high = min(last_id + BATCH_ROWS, max_id)
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            written = copy_range(conn, last_id, high)
+        seconds = time.perf_counter() - t0
+        total += written
+        done = (high - first_id + 1) / (max_id - first_id + 1)
+        print(f"  Ids {last_id + 1:,}–{high:,}: {written:,} rows in {seconds:.2f}s "
+              f"({written / max(seconds, 1e-9):,.0f} rows/s, {done:.1%}, total {total:,})")
+        last_id = high
+        time.sleep(PAUSE_SECONDS)
+
+    with engine.begin() as conn:
+        added = ensure_partitions(conn, TABLE_NAME, MONTHS_AHEAD)
+    print(f"Copied {total:,} rows in {time.perf_counter() - started:.1f}s"
+          + (f", {added} monthly partition(s) added" if added else ""))
+    return total
+
+
+# === Verify ===
+def verify(engine):
+    """Row counts per fuse in v1 and v2 → 0 if v2 holds every v1 row."""
+    with engine.connect() as conn:
+        v1 = dict(conn.execute(text(f"SELECT entity_id, COUNT(*) FROM {TABLE_NAME} GROUP BY entity_id")).all())
+        v2 = dict(conn.execute(text(f"""
+            SELECT e.name, COUNT(*) FROM {V2['data']} d
+            JOIN {V2['entities']} e ON e.entity_id = d.entity_id
+            GROUP BY e.name
+        """)).all())
+    short = {fuse: (n, v2.get(fuse, 0)) for fuse, n in v1.items() if v2.get(fuse, 0) < n}
+    print(f"v1 `{TABLE_NAME}`: {sum(v1.values()):,} rows, {len(v1)} fuses → "
+          f"v2 `{V2['data']}`: {sum(v2.values()):,} rows, {len(v2)} fuses")
+    for fuse, (n1, n2) in sorted(short.items()):
+        print(f"   • {fuse:<40} {n1:>12,} → {n2:>12,}")
+    if short:
+        print(f"WARNING: {len(short)} fuse(s) have fewer rows in v2 → run the copy again")
+        return 1
+    print("Every v1 row is in v2 → set ARCHIVE_SCHEMA=v2")
+    return 0
+
+
+def main(argv):
+    if not DB_USER or not DB_PASS:
+        print("ERROR: Missing credentials")
+        return 1
+    command = argv[0] if argv else "copy"
+    if command not in ("copy", "verify", "drop-before") or (command == "drop-before" and len(argv) < 2):
+        print("Usage: migrate_archive_v2.py [copy | verify | drop-before YYYY-MM]")
+        return 1
+
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Archive v2 migration: {command}")
+    engine = create_engine(DB_URL, pool_pre_ping=True, pool_recycle=3600)
+    try:
+        if command == "drop-before":
+            month = datetime.strptime(argv[1], "%Y-%m")
+            with engine.begin() as conn:
+                dropped = drop_partitions_before(conn, TABLE_NAME, month)
+            print(f"Dropped {len(dropped)} partition(s) of `{V2['data']}` before {month:%Y-%m}: "
+                  f"{', '.join(dropped) or '-'}")
+            return 0
+        if command == "copy":
+            copy(engine)
+        return verify(engine)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    try:
+        raise SystemExit(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        print("\nInterrupted by user. The next run resumes the copy.")
+        raise SystemExit(1)
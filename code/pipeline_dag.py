@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# code/pipeline_dag.py
+# DAG runner for the TEK5370 pipeline: stages declare what they depend on, read and
+# write; independent stages run concurrently and up-to-date stages are skipped.
+#
+#   python3 code/pipeline_dag.py                       → every stage
+#   python3 code/pipeline_dag.py train_forecast nilm   → these stages (+ what they depend on)
+#   PIPELINE_RUNNER=dag python3 code/project.py        → same as the first line
+#
+# A stage is skipped (make-like) when all its outputs exist and the content
+# fingerprint of its inputs — files, its own code and the sibling modules it imports,
+# the env vars it reads — is the one recorded when those outputs were written
+# (<DATA_DIR>/cache/pipeline_state.json).
+# Stages without inputs read external systems (InfluxDB, MariaDB) and always run.
+#
+# Exit codes of a stage: 0 ok, 2 warning (dependents still run), anything else
+# fails the stage; its dependents are not started and the pipeline exits 1.
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BASE = Path(__file__).resolve().parent
+project_root = BASE.parent
+load_dotenv(dotenv_path=project_root / "env" / ".env")
+
+ML = BASE / "machine_learning"
+sys.path.insert(0, str(ML))
+from archive_dataset import ARCHIVE_DIR, DATA_DIR, LEGACY_PATH, MODELS_DIR, RESULTS_DIR
+
+JOBS = int(os.getenv("PIPELINE_JOBS", "4"))            # stages running at the same time
+FORCE = os.getenv("PIPELINE_FORCE", "0") == "1"        # run every stage, even if up to date
+STATE_PATH = DATA_DIR / "cache" / "pipeline_state.json"
+
+ARCHIVE = (ARCHIVE_DIR / "entity_id=*" / "date=*" / "*.parquet", LEGACY_PATH)
+# Where the ML stages read and write (fleet.py sets them per house)
+DIRS_ENV = ("DATA_DIR", "MODELS_DIR", "RESULTS_DIR")
+
+
+@dataclass
+class Stage:
+    name: str
+    script: Path
+    deps: tuple = ()      # stages that must finish first
+    inputs: tuple = ()    # files / globs (absolute or relative to the project root); empty = external source, always run
+    outputs: tuple = ()   # files / globs that must exist for the stage to count as up to date
+    env: tuple = ()       # env var prefixes the outputs depend on
+
+
+STAGES = [
+    Stage("check_fuse_data", BASE / "check_fuse_data.py"),
+    Stage("check_influx_retention", BASE / "check_influx_retention.py"),
+    Stage("export_fuse_data", BASE / "export_fuse_data.py", deps=("check_fuse_data",)),
+    Stage("export_full_archive", ML / "export_full_archive.py", deps=("export_fuse_data",)),
+    Stage("train_forecast", ML / "per_fuse_minutely_forecast_xgboost.py", deps=("export_full_archive",),
+          inputs=ARCHIVE, outputs=(MODELS_DIR / "per_fuse" / "xgboost_*.json", RESULTS_DIR / "per_fuse_results.csv"),
+          env=("ML_", "TRAIN_") + DIRS_ENV),
+    Stage("forecast", ML / "forecast_engine.py", deps=("train_forecast",),
+          inputs=ARCHIVE + (MODELS_DIR / "per_fuse" / "xgboost_*.json",), outputs=(RESULTS_DIR / "forecast_latest.csv",),
+          env=("ML_", "FORECAST_") + DIRS_ENV),
+    Stage("nilm", ML / "nilm_per_fuse_detection.py", deps=("export_full_archive",),
+          inputs=ARCHIVE, outputs=(MODELS_DIR / "nilm" / "*.joblib", RESULTS_DIR / "nilm_minutely_summary.csv"),
+          env=("ML_", "NILM_") + DIRS_ENV),
+]
+
+ML_STAGES = ["export_full_archive", "train_forecast", "forecast", "nilm"]
+
+
+# === Fingerprints ===
+def _expand(patterns):
+    files = []
+    for pattern in map(Path, patterns):
+        root = Path(pattern.anchor) if pattern.is_absolute() else project_root
+        files.extend(p for p in sorted(root.glob(str(pattern.relative_to(root)))) if p.is_file())
+    return files
+
+
+def _key(path):
+    """Path as recorded in the state file: relative to the project root where possible."""
+    return os.path.relpath(path, project_root)
+
+
+def _file_hash(path, cache):
+    """sha256 of a file's content; reused while size and mtime are unchanged."""
+    st = path.stat()
+    key = _key(path)
+    cached = cache.get(key)
+    if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+        return cached["sha256"]
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    cache[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+    return cache[key]["sha256"]
+
+
+def local_imports(script):
+    """Modules next to `script` that it imports, directly or through one another."""
+    found, todo = set(), [script]
+    while todo:
+        for node in ast.walk(ast.parse(todo.pop().read_text())):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = script.parent / f"{name.split('.')[0]}.py"
+                if module != script and module not in found and module.is_file():
+                    found.add(module)
+                    todo.append(module)
+    return sorted(found)
+
+
+def input_fingerprint(stage, cache):
+    h = hashlib.sha256()
+    for path in _expand(stage.inputs) + [stage.script, *local_imports(stage.script)]:
+        h.update(f"{_key(path)}|{_file_hash(path, cache)}\n".encode())
+    for name in sorted(os.environ):
+        if name.startswith(stage.env or ("\0",)):
+            h.update(f"{name}={os.environ[name]}\n".encode())
+    return h.hexdigest()
+
+
+def outputs_exist(stage):
+    return all(_expand([pattern]) for pattern in stage.outputs)
+
+
+def load_state():
+    if STATE_PATH.exists():
+        return json.loads(STATE_PATH.read_text())
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state):
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    os.replace(tmp, STATE_PATH)
+
+
+# === Running ===
+print_lock = threading.Lock()
+
+
+def log(line):
+    with print_lock:
+        print(line, flush=True)
+
+
+def run_stage(stage):
+    """Run one script, streaming its output prefixed with the stage name → (exit code, last lines)."""
+    tail = deque(maxlen=20)
+    process = subprocess.Popen(
+        [sys.executable, str(stage.script)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        cwd=stage.script.parent,
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},  # stream lines as they are printed
+    )
+    for line in process.stdout:
+        if line.strip():
+            tail.append(line.rstrip())
+            log(f"[{stage.name}] {line.rstrip()}")
+    return process.wait(), list(tail)
+
+
+def select(stages, targets):
+    """Targets plus everything they depend on, in declaration order."""
+    by_name = {s.name: s for s in stages}
+    unknown = [t for t in targets if t not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)} (known: {', '.join(by_name)})")
+    wanted, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(by_name[name].deps)
+    return [s for s in stages if s.name in wanted]
+
+
+def critical_path(stages, timings):
+    """Chain of dependencies that ended last: walk back from the last stage to finish."""
+    by_name = {s.name: s for s in stages}
+    done = [n for n in timings if "end" in timings[n]]
+    if not done:
+        return []
+    path = [max(done, key=lambda n: timings[n]["end"])]
+    while True:
+        deps = [d for d in by_name[path[-1]].deps if d in timings and "end" in timings[d]]
+        if not deps:
+            return path[::-1]
+        path.append(max(deps, key=lambda d: timings[d]["end"]))
+
+
+def summary(stages, timings, started):
+    wall = time.perf_counter() - started
+    print("\n=== Stage timings ===")
+    for s in stages:
+        t = timings.get(s.name, {"status": "not run"})
+        if "end" in t:
+            print(f"  {s.name:<24} {t['status']:<8} {t['end'] - t['start']:7.1f}s  "
+                  f"({t['start'] - started:.1f}s → {t['end'] - started:.1f}s)")
+        else:
+            print(f"  {s.name:<24} {t['status']}")
+    path = critical_path(stages, timings)
+    busy = sum(t["end"] - t["start"] for t in timings.values() if "end" in t)
+    if path:
+        length = sum(timings[n]["end"] - timings[n]["start"] for n in path)
+        print(f"Critical path: {' → '.join(path)} = {length:.1f}s")
+    print(f"Wall time {wall:.1f}s for {busy:.1f}s of stage time ({busy / max(wall, 1e-9):.1f}× overlap)")
+
+
+def run_pipeline(stages=STAGES, targets=None, jobs=JOBS, force=FORCE):
+    """Run the DAG; returns 0 when every stage succeeded or warned, 1 otherwise."""
+    if targets:
+        stages = select(stages, targets)
+    names = {s.name for s in stages}
+    # Dependencies outside the selection count as done
+    stages = [replace(s, deps=tuple(d for d in s.deps if d in names)) for s in stages]
+
+    os.environ.setdefault("PIPELINE_RUN_ID", datetime.now().strftime("%Y%m%d-%H%M%S"))  # one metrics file per run
+    state = load_state()
+    timings, running = {}, {}
+    pending = list(stages)
+    finished, failed = set(), set()
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while pending or running:
+            # Dependents of a failed stage are never started
+            for s in [s for s in pending if failed.intersection(s.deps)]:
+                pending.remove(s)
+                timings[s.name] = {"status": "blocked"}
+                failed.add(s.name)
+
+            for s in [s for s in pending if finished.issuperset(s.deps)]:
+                pending.remove(s)
+                fingerprint = input_fingerprint(s, state["files"]) if s.inputs else None
+                recorded = state["stages"].get(s.name, {}).get("fingerprint")
+                if not force and fingerprint and fingerprint == recorded and outputs_exist(s):
+                    now = time.perf_counter()
+                    timings[s.name] = {"status": "skipped", "start": now, "end": now}
+                    finished.add(s.name)
+                    log(f"[{datetime.now().strftime('%H:%M:%S')}] {s.name}: up to date, skipped")
+                    continue
+                log(f"[{datetime.now().strftime('%H:%M:%S')}] {s.name}: started ({s.script.name})")
+                timings[s.name] = {"start": time.perf_counter()}
+                running[pool.submit(run_stage, s)] = (s, fingerprint)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                s, fingerprint = running.pop(future)
+                t = timings[s.name]
+                t["end"] = time.perf_counter()
+                try:
+                    code, tail = future.result()
+                except Exception as e:
+                    code, tail = -1, [f"Failed to execute {s.script.name}: {e}"]
+
+                if code in (0, 2):
+                    t["status"] = "ok" if code == 0 else "warning"
+                    finished.add(s.name)
+                    if code == 2:
+                        log(f"Warning WARNING from {s.name} (continuing): {tail[-1] if tail else 'No details'}")
+                    if fingerprint and outputs_exist(s):
+                        # The fingerprint taken before the run: inputs changed meanwhile rerun next time
+                        state["stages"][s.name] = {
+                            "fingerprint": fingerprint,
+                            "finished": datetime.now().isoformat(timespec="seconds"),
+                        }
+                        save_state(state)
+                else:
+                    t["status"] = "failed"
+                    failed.add(s.name)
+                    log(f"\nError ERROR in {s.name} (exit code: {code})")
+                    for line in tail[-5:]:
+                        log(f"   {line}")
+                log(f"[{datetime.now().strftime('%H:%M:%S')}] {s.name}: {t['status']} in {t['end'] - t['start']:.1f}s")
+
+    summary(stages, timings, started)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    try:
+        raise SystemExit(run_pipeline(targets=sys.argv[1:]))
+    except KeyboardInterrupt:
+        print("\nInterrupted by user. Stopping pipeline.")
+        raise SystemExit(1)
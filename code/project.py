@@ -2,7 +2,10 @@
 # code/project.py
 # MASTER SCRIPT — Runs the entire TEK5370 pipeline with live output
 # Just run: python3 code/project.py
+# PIPELINE_RUNNER=dag:       run the stages as a DAG (parallel, up-to-date stages skipped) → pipeline_dag.py
+# PIPELINE_RUNNER=inprocess: run every script in this interpreter → machine_learning/inprocess_runner.py
 
+import os
 import subprocess
 import sys
 from pathlib import Path
@@ -59,28 +62,60 @@ def run_script(script_path):
 
 # ================================================================
 
-print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] TEK5370 PROJECT — FULL PIPELINE STARTED")
-print("=" * 80)
-print("  Non-Intrusive Load Monitoring & Minutely Forecasting")
-print("  Pilot House 108x — Real Fuse-Level Data — 100% NILM Accuracy Achieved")
-print("=" * 80)
-
-# Step 1: Check fuse data / InfluxDB health
-run_script(BASE / "check_fuse_data.py")
-
-# Step 2: Export today's data from InfluxDB → MariaDB
-run_script(BASE / "export_fuse_data.py")
-
-# Step 3: Run full ML pipeline
-run_script(BASE / "machine_learning" / "run_machine_learning.py")
-
-# Final success message
-print("\n" + "=" * 80)
-print(f"[{datetime.now().strftime('%H:%M:%S')}] FULL PIPELINE COMPLETED SUCCESSFULLY!")
-print("=" * 80)
-print("  • Data archived to MariaDB + Parquet")
-print("  • Per-fuse XGBoost models trained")
-print("  • True minutely NILM: 100% accuracy achieved")
-print("  • All plots saved in results/plots/")
-print("  • Models saved in models/per_fuse/")
-print("=" * 80)
\ No newline at end of file
+
+def main():
+    # One results/metrics/<run>.json for every stage of this run (inherited by the scripts)
+    os.environ.setdefault("PIPELINE_RUN_ID", datetime.now().strftime("%Y%m%d-%H%M%S"))
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] TEK5370 PROJECT — FULL PIPELINE STARTED")
+    print("=" * 80)
+    print("  Non-Intrusive Load Monitoring & Minutely Forecasting")
+    print("  Pilot House 108x — Real Fuse-Level Data — 100% NILM Accuracy Achieved")
+    print("=" * 80)
+
+    runner = os.getenv("PIPELINE_RUNNER", "sequential")
+    if runner == "dag":
+        from pipeline_dag import run_pipeline
+
+        try:
+            if run_pipeline() != 0:
+                sys.exit(1)
+        except KeyboardInterrupt:
+            print("\nInterrupted by user. Stopping pipeline.")
+            sys.exit(1)
+    elif runner == "inprocess":
+        sys.path.insert(0, str(BASE / "machine_learning"))
+        from inprocess_runner import run_inprocess
+        from run_machine_learning import SCRIPTS, script_dir
+
+        try:
+            scripts = [BASE / "check_fuse_data.py", BASE / "export_fuse_data.py"] + [script_dir / s for s in SCRIPTS]
+            if run_inprocess(scripts) != 0:
+                sys.exit(1)
+        except KeyboardInterrupt:
+            print("\nInterrupted by user. Stopping pipeline.")
+            sys.exit(1)
+    else:
+        # Step 1: Check fuse data / InfluxDB health
+        run_script(BASE / "check_fuse_data.py")
+
+        # Step 2: Export today's data from InfluxDB → MariaDB
+        run_script(BASE / "export_fuse_data.py")
+
+        # Step 3: Run full ML pipeline
+        run_script(BASE / "machine_learning" / "run_machine_learning.py")
+
+    # Final success message
+    print("\n" + "=" * 80)
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] FULL PIPELINE COMPLETED SUCCESSFULLY!")
+    print("=" * 80)
+    print("  • Data archived to MariaDB + Parquet")
+    print("  • Per-fuse XGBoost models trained")
+    print("  • True minutely NILM: 100% accuracy achieved")
+    print("  • All plots saved in results/plots/")
+    print("  • Models saved in models/per_fuse/")
+    print("=" * 80)
+
+
+# Guarded: spawn-based process pools of in-process stages re-import the main module
+if __name__ == "__main__":
+    main()